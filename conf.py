@@ -1,4 +1,4 @@
-import pickle
+import json
 
 x = {
     'server': 'irc.freenode.org',
@@ -11,5 +11,10 @@ x = {
     'active_channels': ['##xenobook']
 }
 
-with open("conf", "wb") as cf:
-    pickle.dump(x, cf, pickle.HIGHEST_PROTOCOL)
+# To run on several networks, put each network's server, nick, password, port,
+# logchan, channels and active_channels under its own name, along with the
+# auth service to use ("freenode", "libera" or "none"):
+# x['networks'] = {'freenode': {..., 'auth': 'freenode'}, 'libera': {..., 'auth': 'libera'}}
+
+with open("conf", "w") as cf:
+    json.dump(x, cf, indent=1, sort_keys=True)
@@ -1,20 +1,227 @@
+import json
+import os
 import pickle
+from abc import ABCMeta, abstractmethod
 
 
-class Configuration:
+class Settings(metaclass=ABCMeta):
+    """
+    Settings of one connection. Channels and active channels are exposed
+    as frozen sets that are swapped whole on every change, so membership
+    tests are cheap and readers never see a half-applied update.
+    """
+
+    @abstractmethod
+    def _get(self, key, default=None):
+        pass
+
+    @abstractmethod
+    def _lists(self):
+        """The dictionary holding the channel lists."""
+        pass
+
+    @abstractmethod
+    def _refresh(self):
+        pass
+
+    def _views(self, d):
+        self.channels = frozenset(d.get("channels", ()))
+        self.active_channels = frozenset(d.get("active_channels", ()))
+
+    def password(self):
+        return self._get("password")
+
+    def nick(self):
+        return self._get("nick")
+
+    def server(self):
+        return self._get("server")
+
+    def port(self):
+        return self._get("port")
+
+    def log_chan(self):
+        return self._get("logchan")
+
+    def auth(self):
+        """Name of the network whose auth service is used, see Networks.get."""
+        return self._get("auth", "freenode")
+
+    def reconnect_delay(self):
+        """Seconds before the first reconnection attempt. Later attempts back off exponentially."""
+        return self._get("reconnect_delay", 1.0)
+
+    def reconnect_max_delay(self):
+        return self._get("reconnect_max_delay", 300.0)
+
+    def send_rate(self):
+        """Lines per second sent once the burst allowance is spent."""
+        return self._get("send_rate", 1.0)
+
+    def send_burst(self):
+        """Lines that may be sent back to back."""
+        return self._get("send_burst", 5)
+
+    def coalesce_window(self):
+        """Seconds replies are held back so that replies to the same target share lines."""
+        return self._get("coalesce_window", 0.2)
+
+    def max_targets(self):
+        """Most targets put in a single PRIVMSG, if the server allows that many."""
+        return self._get("max_targets", 4)
+
+    def get_channels(self):
+        return list(self._lists()["channels"])
+
+    def add_channel(self, channel):
+        if channel not in self.channels:
+            self._lists().setdefault("channels", []).append(channel)
+            self._refresh()
+
+    def has_channel(self, channel):
+        return channel in self.channels
+
+    def add_active_channel(self, channel):
+        if channel not in self.active_channels:
+            self._lists().setdefault("active_channels", []).append(channel)
+            self._refresh()
+
+    def remove_active_channel(self, channel):
+        self._lists()["active_channels"].remove(channel)
+        self._refresh()
+
+    def has_active_channel(self, channel):
+        return channel in self.active_channels
+
+
+class NetworkSettings(Settings):
+    """
+    Settings of one network. Keys missing from the network's own entry are
+    taken from the top level of the configuration, except for the owners:
+    a mask only tells who someone is on its own network, so the owners at
+    the top level own the home network only.
+    """
+
+    def __init__(self, configuration, name, net_dict):
+        self.configuration = configuration
+        self.name = name
+        self._load(net_dict)
+
+    def _load(self, net_dict):
+        self.net_dict = net_dict
+        self._views(net_dict)
+        if "owners" in net_dict or self.name != self.configuration.home_network():
+            self.owners = frozenset(net_dict.get("owners", ()))
+        else:
+            self.owners = self.configuration.owners
+
+    def is_owner(self, user):
+        return user in self.owners
+
+    def _get(self, key, default=None):
+        if key in self.net_dict:
+            return self.net_dict[key]
+        return self.configuration.con_dict.get(key, default)
+
+    def _lists(self):
+        return self.net_dict
+
+    def _refresh(self):
+        self.configuration._refresh()
+
+
+class Configuration(Settings):
+    """
+    Bot settings. Owners are a frozen set like the channels, kept for each
+    network. The file is JSON; legacy pickled files are still read and are rewritten as JSON on
+    save.
+
+    Several networks are configured under "networks", a dictionary from a
+    name to the settings of that network. A configuration without one is a
+    single network called "default" made of the top level settings.
+    """
+
+    default_network = "default"
+
     def __init__(self, config_source):
+        self.config_file = None
+        self.mtime = None
+        self.networks = {}
         if isinstance(config_source, dict):
-            self.con_dict = config_source
+            self._load(config_source)
+        else:
+            self.config_file = config_source
+            self._load(self._read())
+
+    def _read(self):
+        """
+        The settings in the configuration file. Raises ValueError if the
+        JSON does not parse; the file is then read again once fixed.
+        """
+        mtime = os.stat(self.config_file).st_mtime
+        with open(self.config_file, "rb") as cf:
+            data = cf.read()
+        if Configuration._is_pickle(data):
+            # Legacy file holding a pickled dictionary with the relevant settings,
+            # connection info from the conf.py file.
+            con_dict = pickle.loads(data)
         else:
-            with open(config_source, "rb") as cf:
-                # File should contained a pickled dictionary with the relevant settings.
-                # Connection info from conf.py file:
-                con_dict = pickle.load(cf)
-                self.channels = con_dict["channels"]
-                self.owners = con_dict["owners"]
-                self.active_channels = con_dict["active_channels"]
-                self.con_dict = con_dict
-                self.config_file = config_source
+            con_dict = json.loads(data.decode("utf-8"))
+        self.mtime = mtime
+        return con_dict
+
+    @staticmethod
+    def _is_pickle(data):
+        """Pickles start with the protocol, or with a mark or an empty dictionary for protocols 0 and 1."""
+        return data[:1] in (b"\x80", b"(", b"}")
+
+    def _load(self, con_dict):
+        self.con_dict = con_dict
+        self._refresh()
+
+    def _refresh(self):
+        """Rebuild the frozen views from con_dict, reusing the settings objects of networks still configured."""
+        self._views(self.con_dict)
+        self.owners = frozenset(self.con_dict.get("owners", ()))
+        net_dicts = self.con_dict.get("networks", {Configuration.default_network: self.con_dict})
+        for name in list(self.networks):
+            if name not in net_dicts:
+                del self.networks[name]
+        for name, net_dict in net_dicts.items():
+            if name in self.networks:
+                self.networks[name]._load(net_dict)
+            else:
+                self.networks[name] = NetworkSettings(self, name, net_dict)
+
+    def _get(self, key, default=None):
+        return self.con_dict.get(key, default)
+
+    def _lists(self):
+        return self.con_dict
+
+    def network_names(self):
+        return list(self.networks)
+
+    def network(self, name):
+        """Settings of the network called name."""
+        if name not in self.networks:
+            raise ValueError("Unknown network: " + str(name))
+        return self.networks[name]
+
+    def changed(self):
+        """Tell whether the configuration file was modified since it was read."""
+        if self.config_file is None:
+            return False
+        try:
+            return os.stat(self.config_file).st_mtime != self.mtime
+        except FileNotFoundError:
+            return False
+
+    def reload(self):
+        """Re-read the configuration file. Returns the channels joined and left."""
+        old_channels = self.channels
+        self._load(self._read())
+        return self.channels - old_channels, old_channels - self.channels
 
     def password(self):
         return self.con_dict["password"]
@@ -31,27 +238,89 @@ class Configuration:
     def log_chan(self):
         return self.con_dict["logchan"]
 
-    def get_channels(self):
-        return self.con_dict["channels"]
+    def home_network(self):
+        """
+        Network whose users are known by their bare host mask, as they were
+        before several networks were served. Accounts of users on other
+        networks have the network name added.
+        """
+        return self.con_dict.get("home_network", Configuration.default_network)
 
-    def add_channel(self, channel):
-        self.con_dict["channels"].append(channel)
+    def transport(self):
+        """Either "asyncio", or "select" for the irc library's own reactor."""
+        return self.con_dict.get("transport", "asyncio")
 
-    def has_channel(self, channel):
-        return channel in self.con_dict["channels"]
+    def trace_sample_rate(self):
+        return self.con_dict.get("trace_sample_rate", 1.0)
 
-    def add_active_channel(self, channel):
-        self.con_dict["active_channels"].append(channel)
+    def trace_file(self):
+        return self.con_dict.get("trace_file")
 
-    def remove_active_channel(self, channel):
-        self.con_dict["active_channels"].remove(channel)
+    def command_rate(self):
+        """Commands per second a hostmask may run once its burst allowance is spent."""
+        return self.con_dict.get("command_rate", 0.5)
 
-    def has_active_channel(self, channel):
-        return channel in self.con_dict["active_channels"]
+    def command_burst(self):
+        """Tokens a hostmask may spend back to back. Queries take one."""
+        return self.con_dict.get("command_burst", 6)
 
-    def is_owner(self, user):
-        return user in self.con_dict["owners"]
+    def mutating_cost(self):
+        """Tokens taken by a command that changes state."""
+        return self.con_dict.get("mutating_cost", 2)
+
+    def command_queue_size(self):
+        """Most commands waiting for the engine."""
+        return self.con_dict.get("command_queue_size", 100)
+
+    def command_shed_at(self):
+        """Commands waiting for the engine from which queries are refused."""
+        return self.con_dict.get("command_shed_at", 50)
+
+    def read_burst(self):
+        """Reads run in a row ahead of a waiting trade or admin command."""
+        return self.con_dict.get("read_burst", 4)
+
+    def response_cache_size(self):
+        """Query answers kept for repeated queries."""
+        return self.con_dict.get("response_cache_size", 1024)
+
+    def page_size(self):
+        """Items shown per page of a listing. $more shows the next page."""
+        return self.con_dict.get("page_size", 10)
+
+    def claims_check_interval(self):
+        """Seconds between closings of the claims that expired."""
+        return self.con_dict.get("claims_check_interval", 60)
+
+    def orders_check_interval(self):
+        """Seconds between cancellations of the good till date orders whose time is up."""
+        return self.con_dict.get("orders_check_interval", 5)
+
+    def log_file(self):
+        return self.con_dict.get("log_file", "log.txt")
+
+    def log_format(self):
+        """Either "text" for key=value lines, or "json" for JSON lines."""
+        return self.con_dict.get("log_format", "text")
+
+    def log_max_bytes(self):
+        """Size from which the log is rotated. It is also rotated daily."""
+        return self.con_dict.get("log_max_bytes", 10 * 1024 * 1024)
+
+    def log_backups(self):
+        """Rotated, gzipped logs kept."""
+        return self.con_dict.get("log_backups", 10)
+
+    def ledger_file(self):
+        """JSON lines trail of the ledger. It is only ever appended to."""
+        return self.con_dict.get("ledger_file", "ledger.txt")
+
+    def is_owner(self, user, network=None):
+        """Tell whether user owns the bot on network, by default the home network."""
+        settings = self.networks.get(self.home_network() if network is None else network)
+        return settings is not None and settings.is_owner(user)
 
     def save(self):
-        with open(self.config_file, "wb") as f:
-            pickle.dump(self.con_dict, f)
+        with open(self.config_file, "w") as f:
+            json.dump(self.con_dict, f, indent=1, sort_keys=True)
+        self.mtime = os.stat(self.config_file).st_mtime
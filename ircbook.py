@@ -2,25 +2,42 @@
 import fnmatch
 import json
 import re
-from datetime import date
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import namedtuple
+from itertools import chain
+from datetime import date, datetime, timedelta
 from decimal import Decimal as D
 from decimal import InvalidOperation as DIO
 
+from sortedcontainers import SortedKeyList
+
 from config import Configuration
 # IrcBook: a prediction market for IRC.
 from ircfacade import commands
 from ircfacade.commands import Command, NoMatchingCommand
-from ircfacade.ircclient import IrcClient
-from ircfacade.networks import Networks
+from ircfacade.pager import split_filters
 from trading.orderbook import OrderBook, Order
-from trading.positions import Positions
-from trading.tradingengine import TradingEngine, Trades
-from util.dateutils import today, parse_iso_date
+from trading.positions import Positions, Portfolio, Coupon
+from trading.tradingengine import TradingEngine, Trades, Trade
+from util.auditlog import Journal
+from util.dateutils import today, clock, parse_iso_date
+from util.memory import MemoryReport
+from util.prefixes import PrefixIndex
 from util.stringutils import pretty_list
+from util.tracing import span
 
-config = Configuration("conf")
-network = Networks.get_freenode()
-ircclient = IrcClient(config, network)
+# Set up by Application: the configuration and the IRC client first, then
+# users, claims and the engine once the state is loaded.
+config = None
+ircclient = None
+users = None
+claims = None
+engine = None
+# Trail of the postings to the ledger of users.positions.
+journal = None
 
 
 # Helper functions and data structures:
@@ -33,20 +50,35 @@ def dirty(func):
     return my_func
 
 
+# host is the account name: the host mask, qualified by the network outside the home network.
+Identity = namedtuple("Identity", ["nick", "host", "user"])
+
+
 class Users:
     """
     Represent user information.
     """
 
+    # Number of message sources remembered by identify().
+    identity_cache_size = 4096
+
     def __init__(self, state=None):
         if state is None:
             state = {}
         self.users = {}
+        self.by_nick = {}
+        self.identities = {}
+        # Network whose users are known by their bare host mask, see identify().
+        self.home_network = None
+        # Bumped when users register or change nick.
+        self.version = 0
         if state:
             if state["Users"]:
                 for i in state["Users"]:
                     u = User(*i)
                     self.users[u.name] = u
+                    if u.nick:
+                        self.by_nick[u.nick] = u
             if state["Positions"]:
                 self.positions = Positions(state["Positions"])
             else:
@@ -71,16 +103,46 @@ class Users:
         else:
             self.users[user.name] = user
             self.positions.add_portfolio(user.name)
+            self.identities.clear()
+            self.version += 1
 
     def get_user(self, name):
         if name in self.users:
             return self.users[name]
+        elif name in self.by_nick:
+            return self.by_nick[name]
         else:
-            for i in self.users.values():
-                if i.nick == name:
-                    return i
             raise ValueError("User {0} does not exist.".format(name))
 
+    @dirty
+    def set_nick(self, name, nick):
+        user = self.users[name]
+        if user.nick and self.by_nick.get(user.nick) is user:
+            del self.by_nick[user.nick]
+        user.nick = nick
+        self.by_nick[nick] = user
+        self.version += 1
+
+    def identify(self, source, network=None):
+        """
+        Nick, account name and registered user (or None) of a message
+        source on network. The account name is the host mask, followed by
+        @ and the network unless that is the home network, so that the same
+        host on two networks makes two accounts.
+        """
+        key = (network, source)
+        try:
+            return self.identities[key]
+        except KeyError:
+            host = vmask(source)
+            if network is not None and network != self.home_network:
+                host = "{0}@{1}".format(host, network)
+            identity = Identity(nick_from_mask(source), host, self.users.get(host))
+            if len(self.identities) >= self.identity_cache_size:
+                self.identities.clear()
+            self.identities[key] = identity
+            return identity
+
     def save(self):
         with open("status.txt", "w") as f:
             users = []
@@ -115,8 +177,8 @@ class User:
         self.nick = nick
 
     @dirty
-    def confirm(self, by):
-        if config.is_owner(by):
+    def confirm(self, by, network=None):
+        if config.is_owner(by, network):
             if not self.confirmed:
                 self.confirmed, self.promoter = True, by
             else:
@@ -128,11 +190,12 @@ class User:
         return self.name, self.confirmed, (self.bday.year, self.bday.month, self.bday.day), self.promoter, self.nick
 
 
-try:
-    with open("status.txt", "r") as f:
-        users = Users(state=json.load(f))
-except FileNotFoundError:
-    users = Users()
+def load_users(status_file="status.txt"):
+    try:
+        with open(status_file, "r") as f:
+            return Users(state=json.load(f))
+    except FileNotFoundError:
+        return Users()
 
 
 class Claims:
@@ -140,20 +203,62 @@ class Claims:
         if l is None:
             l = []
         self.claims = {}
+        self.prefixes = PrefixIndex()
+        # Approved claims not judged nor closed yet, by expiry. Those that
+        # expired stay until close_expired() takes them off.
+        self.open = SortedKeyList(key=lambda cl: (cl.expires, cl.name))
+        # Bumped on every save, which follows every change to a claim.
+        self.version = 0
         for i in l:
             cl = Claim(*i)
             self.claims[cl.name] = cl
+            self.prefixes.add(cl.name)
+            if cl.approved and cl.result is None:
+                self.open.add(cl)
 
     @dirty
     def add(self, claim):
         if claim.name in self.claims:
             raise ValueError("Claim already exists.")
-        elif (claim.expires - today()).days <= 0:
+        elif claim.expired():
             raise ValueError("Expiration date must occur in the future.")
         else:
             self.claims[claim.name] = claim
+            self.prefixes.add(claim.name)
+
+    def approve(self, claim, owner, network=None):
+        claim.approve(owner, network)
+        self.open.add(claim)
+
+    def resolve(self, claim, result):
+        self.open.discard(claim)
+        claim.resolve(result)
+
+    def is_open(self, claim):
+        """Whether claim is open for trade."""
+        return not claim.expired() and claim in self.open
+
+    def open_claims(self, before=None):
+        """Claims open for trade by expiry, only those expiring before the date before if given."""
+        tomorrow = clock.today() + timedelta(days=1)
+        return self.open.irange_key((tomorrow, ""), None if before is None else (before, ""), (True, False))
+
+    def close_expired(self):
+        """Take the claims that expired off the open claims, and return them."""
+        today = clock.today()
+        closed = []
+        while self.open and self.open[0].expires <= today:
+            closed.append(self.open.pop(0))
+        if closed:
+            self.version += 1
+        return closed
+
+    def complete(self, prefix):
+        """Claim symbols starting with prefix, sorted."""
+        return self.prefixes.find(prefix)
 
     def save(self):
+        self.version += 1
         with open("claims.txt", "w") as f:
             json.dump(self.dump(), f, indent=1)
 
@@ -192,14 +297,11 @@ class Claim:
         self.result = result
 
     def expired(self):
-        if (self.expires - today()).days <= 0:
-            return True
-        else:
-            return False
+        return self.expires <= clock.today()
 
     @dirty
-    def approve(self, owner):
-        if is_owner(owner):
+    def approve(self, owner, network=None):
+        if is_owner(owner, network):
             self.approved = True
             self.promoter = owner
         else:
@@ -230,27 +332,70 @@ class Claim:
                                                            self.bday.month, self.bday.day))
 
 
-try:
-    with open("claims.txt", "r") as f:
-        claims = Claims(json.load(f))
-except FileNotFoundError:
-    claims = Claims()
+def load_claims(claims_file="claims.txt"):
+    try:
+        with open(claims_file, "r") as f:
+            return Claims(json.load(f))
+    except FileNotFoundError:
+        return Claims()
+
 
-engine = TradingEngine(users.ob, users.positions, users.trades)
+def is_owner(user, network=None):
+    """Tell whether user owns the bot on network, the home network if None."""
+    return config.is_owner(user, network)
 
 
-def is_owner(user):
-    print("is owner %s" % user)
-    return config.is_owner(user)
+def update_locks(accounts):
+    """Work out again the cash locked by the orders of accounts."""
+    for account_id in accounts:
+        account_handler = users.ob.get_by_account_id(account_id)
+        p = users.positions.get_portfolio(account_id)
+        if account_handler is not None and p is not None:
+            p.calc_risk(account_handler.risk.risk)
+    users.positions.mark_changed()
+
+
+def close_expired_claims():
+    """Cancel the orders on the claims that expired, releasing the cash they locked."""
+    if not commands.ready.is_set():
+        return
+    accounts = set()
+    for cl in claims.close_expired():
+        accounts |= users.ob.mass_cancel(instrument_id=cl.name).accounts
+    if not accounts:
+        return
+    update_locks(accounts)
+    users.save()
+
+
+def expire_orders():
+    """Cancel the good till date orders whose time is up."""
+    if commands.ready.is_set() and engine.expire():
+        users.save()
 
 
 def place_order(o):
     """Attempt to place an order. Returns info about placement."""
-    results = engine.place(o)
-    users.save()
+    with span("place"):
+        results = engine.place(o)
+    with span("save"):
+        users.save()
     return results
 
 
+def identify(e):
+    """Identity of the sender of event e, on the network it came from."""
+    return users.identify(e.source, getattr(e, "network", None))
+
+
+def sender(e):
+    """Registered user who sent event e. Raises ValueError if there is none."""
+    ident = identify(e)
+    if ident.user is None:
+        raise ValueError("User {0} does not exist.".format(ident.host))
+    return ident.user
+
+
 def nick_from_mask(s):
     m = re.match(r"(\S*)!.*", s)
     return m.group(1)
@@ -269,11 +414,33 @@ def split_order(s):
     return claim, order_id
 
 
+def parse_tif(s):
+    """
+    Time in force and expiry of an order from ioc, fok, or gtd= a date
+    yyyy-mm-dd, good through that day, or a duration such as 30m, 2h or 7d.
+    """
+    if s in (Order.ioc, Order.fok):
+        return s, None
+    name, sep, value = s.partition("=")
+    if name != Order.gtd or not sep:
+        raise ValueError("Time in force must be ioc, fok, or gtd= a date or a duration such as 30m, 2h or 7d.")
+    m = re.fullmatch(r"(\d+)([mhd])", value)
+    if m:
+        unit = {"m": "minutes", "h": "hours", "d": "days"}[m.group(2)]
+        expires = datetime.utcnow() + timedelta(**{unit: int(m.group(1))})
+    else:
+        d = parse_iso_date(value) + timedelta(days=1)
+        expires = datetime(d.year, d.month, d.day)
+    if expires <= datetime.utcnow():
+        raise ValueError("Orders must expire in the future.")
+    return Order.gtd, expires
+
+
 def owner_check(func):
     """Make sure that a command is executed by a bot owner."""
 
     def check_it(s, e, respond):
-        if is_owner(e.source):
+        if is_owner(e.source, getattr(e, "network", None)):
             func(s, e, respond)
         else:
             e.target = "IrcBook"
@@ -287,9 +454,8 @@ def user_check(func):
     """Make sure the command is executed by a registered user."""
 
     def do_func(s, e, respond):
-        try:
-            u = users.get_user(vmask(e.source))
-        except ValueError:
+        u = identify(e).user
+        if u is None:
             e.target = "IrcBook"
             respond("You're not registered.")
         else:
@@ -314,18 +480,21 @@ def quiet(func):
     return do_quietly
 
 
+@commands.trade
 @quiet
 def do_reg(s, e, respond):
     """Registers a user. No arguments."""
     if s:
         raise ValueError("This command takes no arguments.")
-    users.add(User(vmask(e.source)))
-    respond("Registered " + str(nick_from_mask(e.source)) + " with mask " + str(vmask(e.source)))
+    ident = identify(e)
+    users.add(User(ident.host))
+    respond("Registered " + str(ident.nick) + " with mask " + str(ident.host))
 
 
 commands.registry.reg("register", do_reg)
 
 
+@commands.admin
 @quiet
 @owner_check
 def do_confirm(s, e, respond):
@@ -334,7 +503,7 @@ def do_confirm(s, e, respond):
         raise ValueError("You must provide the user name to confirm as a single argument.")
     else:
         our_user = users.get_user(s[0])
-        our_user.confirm(e.source)
+        our_user.confirm(e.source, getattr(e, "network", None))
         respond(our_user.name + " confirmed by " + str(our_user.promoter))
 
 
@@ -350,6 +519,7 @@ def get_desc(s):
     return r.strip()
 
 
+@commands.trade
 @user_check
 def do_create(s, e, respond):
     """Create a claim. Name, date (yyyy-mm-dd), and description."""
@@ -361,13 +531,14 @@ def do_create(s, e, respond):
     if not claim_date:
         raise ValueError("Expiration date must be given as yyyy-mm-dd.")
     claim_desc = get_desc(s[2:])
-    claims.add(Claim(s[0], claim_date, claim_desc, vmask(e.source)))
+    claims.add(Claim(s[0], claim_date, claim_desc, identify(e).host))
     respond("Claim created.")
 
 
 commands.registry.reg("create", do_create)
 
 
+@commands.admin
 @quiet
 @owner_check
 def do_approve(s, e, respond):
@@ -377,20 +548,21 @@ def do_approve(s, e, respond):
     claim = claims.get_claim(s[0])
     if claim.approved:
         raise ValueError("Claim already approved.")
-    claim.approve(e.source)
+    claims.approve(claim, e.source, getattr(e, "network", None))
     respond("Claim approved.")
 
 
 commands.registry.reg("approve", do_approve)
 
 
+@commands.read
 def do_cash(s, e, respond):
     """Cash and unlocked cash in parentheses. Takes a user or implicit self."""
     if len(s) > 1:
         raise ValueError(
             "Too many parameters. You may pass one parameter to check someone else's cash, or none to check your own.")
     if len(s) == 0:
-        por = users.positions.get_portfolio(users.get_user(vmask(e.source)).name)
+        por = users.positions.get_portfolio(sender(e).name)
     else:
         por = users.positions.get_portfolio(users.get_user(s[0]).name)
     respond("{0} ({1})".format(por.cash_balance, por.get_unlocked_cash()))
@@ -399,31 +571,77 @@ def do_cash(s, e, respond):
 commands.registry.reg("cash", do_cash)
 
 
+def claims_versions(s, e):
+    """What claim listings depend on. Claims expire as days go by."""
+    return claims.version, clock.today()
+
+
+def book_versions(s, e):
+    """What the book of the claim s[0] depends on."""
+    return claims.version, clock.today(), users.ob.version(s[0] if s else None)
+
+
+def market_versions(s, e):
+    """What the market of the claim s[0] depends on."""
+    return book_versions(s, e), users.trades.version, users.positions.version
+
+
+def holder_versions(s, e):
+    """What holdings of users depend on."""
+    return users.version, users.positions.version
+
+
+def chart_versions(s, e):
+    """What bars of the claim s[0] depend on, and whether it exists."""
+    return claims.version, users.trades.version
+
+
+def filtered_claims(filters):
+    """Claims passing the prefix= and before=yyyy-mm-dd filters, by symbol."""
+    prefix = filters.get("prefix", "")
+    before = parse_iso_date(filters["before"]) if "before" in filters else None
+    for name in claims.complete(prefix):
+        cl = claims.claims[name]
+        if before is None or cl.expires < before:
+            yield cl
+
+
+@commands.read
+@commands.pager.paged
+@commands.cache.cached(claims_versions)
 def do_claims(s, e, respond):
-    """Available claims. Optional claim symbol for details."""
+    """Available claims. Optional claim symbol for details, or filters prefix= and before=yyyy-mm-dd."""
+    s, filters = split_filters(s, ["prefix", "before"])
     if len(s) > 1:
         raise ValueError("Too many parameters.")
     if len(s) == 0:
-        c_list = pretty_list(list(filter(lambda k: (not claims.claims[k].expired()) and claims.claims[k].approved,
-                                         sorted(claims.claims.keys(), key=lambda k: claims.claims[k].expires))))
-        if c_list == "":
-            raise ValueError("No claims are open for trade.")
-        else:
-            respond(c_list)
+        prefix = filters.get("prefix", "")
+        before = parse_iso_date(filters["before"]) if "before" in filters else None
+        open_claims = (cl.name for cl in claims.open_claims(before) if cl.name.startswith(prefix))
+        respond(commands.pager.format(open_claims, e, "No claims are open for trade."))
     else:
         if s[0] in claims.claims:
             respond(claims.claims[s[0]])
         else:
-            raise ValueError("No such claim.")
+            matching = claims.complete(s[0])
+            if len(matching) == 1:
+                respond(claims.claims[matching[0]])
+            elif matching:
+                respond("Claims starting with {0}: {1}".format(s[0], commands.pager.format(matching, e, "")))
+            else:
+                raise ValueError("No such claim.")
 
 
 commands.registry.reg("claims", do_claims)
 
 
+@commands.read
+@commands.pager.paged
 @quiet
 @owner_check
 def do_unapproved(s, e, respond):
-    """Unapproved claims. Optional symbol and then it returns true/false. Owner command."""
+    """Unapproved claims. Optional symbol and then it returns true/false, or filters prefix= and before=yyyy-mm-dd. Owner command."""
+    s, filters = split_filters(s, ["prefix", "before"])
     if len(s) > 1:
         raise ValueError("Too many parameters.")
     if len(s) == 1:
@@ -432,23 +650,20 @@ def do_unapproved(s, e, respond):
         except KeyError:
             respond("No such claim.")
     else:
-        l = []
-        for i in claims.claims.values():
-            if not i.approved:
-                l.append(i.name)
-        if len(l) == 0:
-            respond("No pending claims.")
-        else:
-            respond(pretty_list(l))
+        pending = (cl.name for cl in filtered_claims(filters) if not cl.approved)
+        respond(commands.pager.format(pending, e, "No pending claims."))
 
 
 commands.registry.reg("unapproved", do_unapproved)
 
 
+@commands.read
+@commands.pager.paged
 @quiet
 @owner_check
 def do_unconfirmed(s, e, respond):
-    """Unconfirmed users. Optional user, then returns true/false. Owner command."""
+    """Unconfirmed users. Optional user, then returns true/false, or filter prefix=. Owner command."""
+    s, filters = split_filters(s, ["prefix"])
     if len(s) > 1:
         raise ValueError("Too many parameters.")
     if len(s) == 1:
@@ -457,19 +672,15 @@ def do_unconfirmed(s, e, respond):
         else:
             respond("No such user.")
     else:
-        u_list = []
-        for i in users.users.values():
-            if not i.confirmed:
-                u_list.append(i.name)
-        if len(u_list) == 0:
-            respond("No unconfirmed users.")
-        else:
-            respond(pretty_list(u_list))
+        prefix = filters.get("prefix", "")
+        u_list = (i.name for i in users.users.values() if not i.confirmed and i.name.startswith(prefix))
+        respond(commands.pager.format(u_list, e, "No unconfirmed users."))
 
 
 commands.registry.reg("unconfirmed", do_unconfirmed)
 
 
+@commands.admin
 @owner_check
 def do_judge(s, e, respond):
     """Judge a claim true or false. Claim and y/n. Owner command."""
@@ -480,31 +691,10 @@ def do_judge(s, e, respond):
         if not cl.approved:
             raise ValueError("Cannot judge unapproved claim.")
         result = s[-1]
-        o_handler = users.ob.get_by_instrument_id(cl.name)
-        if o_handler:
-            o_asks = o_handler.get_asks()
-            if o_asks:
-                for i in list(o_handler.get_asks()):
-                    users.ob.remove_order(i)
-            o_bids = o_handler.get_bids()
-            if o_bids:
-                for i in list(o_handler.get_bids()):
-                    users.ob.remove_order(i)
-        for i in users.positions.portfolios.values():
-            if cl.name in i.coupons:
-                j = i.coupons[cl.name]
-                if j.side == result:
-                    i.cash_balance += D(100) * j.shares
-                del i.coupons[j.instrument_id]
-        for i in users.users:
-            account_handler = users.ob.get_by_account_id(i)
-            p = users.positions.get_portfolio(i)
-            if account_handler:
-                p.calc_risk(account_handler.risk.risk)
-        if s[-1] == "y":
-            cl.resolve(True)
-        else:
-            cl.resolve(False)
+        accounts = users.ob.mass_cancel(instrument_id=cl.name).accounts
+        accounts |= users.positions.settle(cl.name, result)
+        update_locks(accounts)
+        claims.resolve(cl, s[-1] == "y")
         users.save()
         respond(str(cl))
     else:
@@ -514,12 +704,12 @@ def do_judge(s, e, respond):
 commands.registry.reg("judge", do_judge)
 
 
-@user_check
-def do_buy(s, e, respond):
-    """Buy. Symbol, y/n, price, shares."""
-    if len(s) != 4:
-        raise ValueError("Must provide claim, y/n, price and amount.")
-    u = vmask(e.source)
+def new_order(s, e):
+    """Order of the sender of e from the arguments of $buy."""
+    if len(s) not in (4, 5):
+        raise ValueError("Must provide claim, y/n, price and amount, and optionally the time in force.")
+    tif, expires = parse_tif(s[4]) if len(s) == 5 else (Order.gtc, None)
+    u = identify(e).host
     if s[1] != "y" and s[1] != "n":
         raise ValueError("Type of coupon must be \"y\" or \"n\".")
     if s[1] == "y":
@@ -529,7 +719,7 @@ def do_buy(s, e, respond):
     if s[0] not in claims.claims:
         raise ValueError("That claim does not exist.")
     cla = claims.claims[s[0]]
-    if cla.expired() or not cla.approved:
+    if not claims.is_open(cla):
         raise ValueError("Claim not open for trade.")
     try:
         if t == Order.bid:
@@ -545,17 +735,34 @@ def do_buy(s, e, respond):
         raise ValueError("Must provide a decimal for quantity.")
     if amount <= 0:
         raise ValueError("Amount must be positive.")
-    o = Order(u, t, cla.name, price, amount)
-    result = place_order(o)
+    return Order(u, t, cla.name, price, amount, tif=tif, expires=expires)
+
+
+@commands.trade
+@user_check
+def do_buy(s, e, respond):
+    """Buy. Symbol, y/n, price, shares, and optionally ioc, fok, or gtd= a date or a duration such as 2h."""
+    result = place_order(new_order(s, e))
     respond(str(result))
 
 
 commands.registry.reg("buy", do_buy)
 
 
+@commands.read
+@user_check
+def do_quote(s, e, respond):
+    """What buying would do, without trading. Same parameters as buy; buying n is selling y."""
+    respond(str(engine.simulate(new_order(s, e))))
+
+
+commands.registry.reg("quote", do_quote)
+
+
+@commands.trade
 @user_check
 def do_sell(s, e, respond):
-    """Sell. Symbol, y/n, price, shares."""
+    """Sell. Symbol, y/n, price, shares, and optionally ioc, fok, or gtd= a date or a duration such as 2h."""
     if len(s) < 4:
         raise ValueError("Must provide claim, y/n, price and amount.")
     if s[1] == "y":
@@ -572,21 +779,23 @@ def do_sell(s, e, respond):
 commands.registry.reg("sell", do_sell)
 
 
+@commands.admin
+@commands.stateless
 @quiet
 @owner_check
 def do_enter(s, e, respond):
-    """Join a channel. Channel name. Owner command."""
+    """Join a channel on the network the command came from. Channel name. Owner command."""
     if len(s) != 1:
         raise ValueError("You must pass the channel as a single parameter.")
     channel = str(s[0])
     print("Joining %s" % channel)
     try:
-        ircclient.join(channel)
+        ircclient.join(channel, e.network)
     except Exception as exc:
         commands.log_msg(str(exc))
         respond(str(exc))
     else:
-        config.add_channel(channel)
+        config.network(e.network).add_channel(channel)
         config.save()
         respond("Joining.")
 
@@ -594,16 +803,19 @@ def do_enter(s, e, respond):
 commands.registry.reg("enter", do_enter)
 
 
+@commands.admin
+@commands.stateless
 @quiet
 @owner_check
 def do_loud(s, e, respond):
     """Activate bot in a channel. Takes a compulsory channel that must have been entered."""
     if len(s) != 1:
         raise ValueError("You must pass the channel as a single parameter.")
-    if not config.has_channel(s[0]):
+    settings = config.network(e.network)
+    if not settings.has_channel(s[0]):
         raise ValueError("Channel not in join list. Use $enter?")
     else:
-        config.add_active_channel(s[0])
+        settings.add_active_channel(s[0])
         config.save()
         respond("Activated on {0}.".format(s[0]))
 
@@ -611,16 +823,19 @@ def do_loud(s, e, respond):
 commands.registry.reg("loud", do_loud)
 
 
+@commands.admin
+@commands.stateless
 @quiet
 @owner_check
 def do_unloud(s, e, respond):
     """Deactivate bot in a channel. Takes a compulsory channel that must be active."""
     if len(s) != 1:
         raise ValueError("You must pass the channel as a single parameter.")
-    if not config.has_active_channel(s[0]):
+    settings = config.network(e.network)
+    if not settings.has_active_channel(s[0]):
         raise ValueError("Channel not in active list.")
     else:
-        config.remove_active_channel(s[0])
+        settings.remove_active_channel(s[0])
         config.save()
         respond("Deactivated on {0}.".format(s[0]))
 
@@ -628,6 +843,69 @@ def do_unloud(s, e, respond):
 commands.registry.reg("unloud", do_unloud)
 
 
+@commands.admin
+@commands.stateless
+@quiet
+@owner_check
+def do_reload(s, e, respond):
+    """Reload the configuration file, joining and leaving networks and channels as needed. Owner command."""
+    if s:
+        raise ValueError("This command takes no arguments.")
+    joined, left = ircclient.reload_config()
+    joined = ["{0} on {1}".format(ch, network) for network, ch in sorted(joined)]
+    left = ["{0} on {1}".format(ch, network) for network, ch in sorted(left)]
+    respond("Configuration reloaded. Joined: {0}. Left: {1}.".format(pretty_list(joined) or "none",
+                                                                      pretty_list(left) or "none"))
+
+
+commands.registry.reg("reload", do_reload)
+
+
+@commands.admin
+@commands.stateless
+@quiet
+@owner_check
+def do_connect(s, e, respond):
+    """Connect to a network from the configuration file. Network name. Owner command."""
+    if len(s) != 1:
+        raise ValueError("You must pass the network as a single parameter.")
+    ircclient.add_connection(s[0])
+    respond("Connecting to {0}.".format(s[0]))
+
+
+commands.registry.reg("connect", do_connect)
+
+
+@commands.admin
+@commands.stateless
+@quiet
+@owner_check
+def do_disconnect(s, e, respond):
+    """Disconnect from a network. Network name. Owner command."""
+    if len(s) != 1:
+        raise ValueError("You must pass the network as a single parameter.")
+    ircclient.remove_connection(s[0])
+    respond("Disconnecting from {0}.".format(s[0]))
+
+
+commands.registry.reg("disconnect", do_disconnect)
+
+
+@commands.read
+@commands.stateless
+def do_networks(s, e, respond):
+    """List the networks the bot is on, and those configured it is not on."""
+    connected = sorted(ircclient.connections)
+    idle = sorted(set(config.network_names()) - set(connected))
+    respond("Connected to: {0}. Not connected to: {1}.".format(pretty_list(connected) or "none",
+                                                                 pretty_list(idle) or "none"))
+
+
+commands.registry.reg("networks", do_networks)
+
+
+@commands.read
+@commands.cache.cached(market_versions)
 def do_ticker(s, e, respond):
     """Show ticker. Compulsory claim symbol."""
     if len(s) != 1:
@@ -680,13 +958,71 @@ def do_ticker(s, e, respond):
 commands.registry.reg("ticker", do_ticker)
 
 
+@commands.read
+@commands.pager.paged
+@commands.cache.cached(chart_versions)
+def do_chart(s, e, respond):
+    """Bars of a claim, newest first: open, high, low and close * volume. Claim symbol and optional 1m, 1h or 1d."""
+    if len(s) not in (1, 2):
+        raise ValueError("Must pass a claim symbol and optionally 1m, 1h or 1d.")
+    if s[0] not in claims.claims:
+        raise ValueError("No such claim.")
+    series = users.trades.bars.get_series(s[0], s[1] if len(s) > 1 else "1h")
+    if series is None:
+        raise ValueError("No trades yet.")
+    shown = ("{0:%Y-%m-%d %H:%M}: {1} {2} {3} {4} * {5}".format(
+        series.start(b.n), b.open, b.high, b.low, b.close, b.volume) for b in series.bars(reverse=True))
+    respond(commands.pager.format(shown, e, "No trades yet."))
+
+
+commands.registry.reg("chart", do_chart)
+
+
+def minute():
+    """The current minute, which rolling windows move by."""
+    return datetime.utcnow().replace(second=0, microsecond=0)
+
+
+@commands.read
+@commands.cache.cached(lambda s, e: (chart_versions(s, e), minute()))
+def do_change(s, e, respond):
+    """Change of the last price of a claim, and its VWAP and TWAP. Claim symbol and optional 1h or 24h, 24h default."""
+    if len(s) not in (1, 2):
+        raise ValueError("Must pass a claim symbol and optionally 1h or 24h.")
+    if s[0] not in claims.claims:
+        raise ValueError("No such claim.")
+    span = s[1] if len(s) > 1 else "24h"
+    window = users.trades.bars.get_window(s[0], span)
+    if window is None:
+        raise ValueError("No trades yet.")
+    now = datetime.utcnow()
+    last = users.trades.last_price(s[0])
+    before = users.trades.bars.price_at(s[0], now - window.span)
+    q = D("0.01")
+    if before is None:
+        change = "no trades before {0}".format(span)
+    else:
+        change = "{0:+} ({1:+}%) in {2}".format(last - before, ((last - before) * 100 / before).quantize(q), span)
+    vwap = window.vwap(now)
+    averages = "VWAP {0}, ".format(vwap.quantize(q)) if vwap is not None else ""
+    respond("{0}: {1}, {2}, {3}TWAP {4}, volume {5}.".format(
+        s[0], last, change, averages, window.twap(now).quantize(q), window.volume))
+
+
+commands.registry.reg("change", do_change)
+
+
+@commands.read
+@commands.stateless
+@commands.pager.paged
 @quiet
+@commands.cache.cached(lambda s, e: len(commands.registry.handlers))
 def do_help(s, e, respond):
     """Help. Optional command to show syntax or show command list."""
     if len(s) > 1:
         raise ValueError("Pass a single command or nothing to see the command list.")
     elif len(s) == 0:
-        respond("Command list: " + pretty_list(list(commands.registry.handlers.keys())))
+        respond("Command list: " + commands.pager.format(commands.registry.handlers, e, "No commands."))
     else:
         matching_commands = commands.registry.find(s[0])
         if not matching_commands:
@@ -694,57 +1030,96 @@ def do_help(s, e, respond):
         else:
             if len(matching_commands) == 1:
                 try:
-                    handler = commands.registry.lookup(Command(s[0], []))
+                    handler = commands.registry.lookup(Command(matching_commands[0], []))
                     respond(handler.__doc__)
                 except NoMatchingCommand:
                     raise ValueError("Internal error: failed to look up command: " + str(s[0]))
             else:
-                respond("Ambiguous prefix: " + pretty_list(matching_commands))
+                respond("Ambiguous prefix: " + commands.pager.format(matching_commands, e, ""))
 
 
 commands.registry.reg("help", do_help)
 
 
+@commands.read
+@commands.pager.paged
+@commands.cache.cached(holder_versions, key=lambda s, e: (tuple(s), identify(e).host))
 def do_coupons(s, e, respond):
-    """Shows coupons. Optional user or implicit self."""
+    """Shows coupons. Optional user or implicit self, and filters prefix= and side=y/n."""
+    s, filters = split_filters(s, ["prefix", "side"])
     if len(s) > 1:
         raise ValueError("Give a user as parameter, or none to see your own coupons.")
     if len(s) == 0:
-        u = users.get_user(vmask(e.source))
+        u = sender(e)
     else:
         u = users.get_user(s[0])
     coupons = users.positions.get_coupons(u.name)
-    if len(coupons) == 0:
-        raise ValueError("No coupons.")
-    else:
-        respond(pretty_list(list(coupons.values())))
+    prefix = filters.get("prefix", "")
+    side = filters.get("side")
+    shown = (coupons[k] for k in sorted(coupons)
+             if k.startswith(prefix) and (side is None or coupons[k].side == side))
+    respond(commands.pager.format(shown, e, "No coupons."))
 
 
 commands.registry.reg("coupons", do_coupons)
 
 
+@commands.read
+@commands.pager.paged
 @user_check
 def do_orders(s, e, respond):
-    """Outstanding orders. No arguments."""
+    """Outstanding orders. Optional filters prefix= and side=bid/ask."""
+    s, filters = split_filters(s, ["prefix", "side"])
     if len(s) != 0:
-        raise ValueError("No arguments allowed.")
-    o_handler = users.ob.get_by_account_id(vmask(e.source))
+        raise ValueError("Only filters allowed.")
+    o_handler = users.ob.get_by_account_id(identify(e).host)
     if not o_handler:
         raise ValueError("No orders available.")
-    orders = []
-    orders += o_handler.asks
-    orders += o_handler.bids
-    if len(orders) == 0:
-        raise ValueError("No orders available.")
-    o_str = []
-    for i in orders:
-        o_str.append(str(i))
-    respond(pretty_list(o_str))
+    prefix = filters.get("prefix", "")
+    side = filters.get("side")
+    if side is not None:
+        sides = {"bid": Order.bid, "ask": Order.ask}
+        if side not in sides:
+            raise ValueError("Side must be bid or ask.")
+        side = sides[side]
+    orders = sorted((o for o in chain(o_handler.asks, o_handler.bids)
+                     if o.instrument_id.startswith(prefix) and (side is None or o.side == side)),
+                    key=lambda o: (o.instrument_id, o.rank))
+    respond(commands.pager.format(orders, e, "No orders available."))
 
 
 commands.registry.reg("orders", do_orders)
 
 
+def trade_history_versions(s, e):
+    """What trade histories depend on: trades, and nicks for the user= filter."""
+    return users.trades.version, users.version
+
+
+@commands.read
+@commands.pager.paged
+@commands.cache.cached(trade_history_versions)
+def do_history(s, e, respond):
+    """Trades, newest first. Optional claim symbol, and filters user=, since=yyyy-mm-dd and until=yyyy-mm-dd."""
+    s, filters = split_filters(s, ["user", "since", "until"])
+    if len(s) > 1:
+        raise ValueError("Too many parameters.")
+    account_id = users.get_user(filters["user"]).name if "user" in filters else None
+    start = datetime.combine(parse_iso_date(filters["since"]), datetime.min.time()) if "since" in filters else None
+    end = None
+    if "until" in filters:
+        end = datetime.combine(parse_iso_date(filters["until"]) + timedelta(days=1), datetime.min.time())
+    trades = users.trades.history(instrument_id=s[0] if s else None, account_id=account_id, start=start, end=end)
+    shown = ("{0:%Y-%m-%d %H:%M} {1} {2} * {3}".format(t.timestamp, t.instrument_id, t.price, t.shares)
+             for t in trades)
+    respond(commands.pager.format(shown, e, "No trades."))
+
+
+commands.registry.reg("history", do_history)
+
+
+@commands.read
+@commands.cache.cached(book_versions)
 def do_depth(s, e, respond):
     """Shows how much money is required to move the price. Takes a claim."""
     if len(s) != 1:
@@ -764,17 +1139,8 @@ def do_depth(s, e, respond):
     ask = ohandler.get_best_ask()
     if not bid and not ask:
         raise ValueError("Claim {0} has no outstanding orders.".format(cl.name))
-    bid_depth, ask_depth = D(0), D(0)
-    if bid:
-        for i in range(len(ohandler.get_bids()) - 1, -1, -1):
-            if ohandler.get_bids()[i].price != bid:
-                break
-            bid_depth += ohandler.get_bids()[i].num_shares
-    if ask:
-        for i in range(len(ohandler.get_asks()) - 1, -1, -1):
-            if ohandler.get_asks()[i].price != ask:
-                break
-            ask_depth += ohandler.get_asks()[i].num_shares
+    bid_depth = ohandler.bid_levels[bid] if bid else D(0)
+    ask_depth = ohandler.ask_levels[ask] if ask else D(0)
     if not bid:
         bid = D(0)
     if not ask:
@@ -785,18 +1151,64 @@ def do_depth(s, e, respond):
 commands.registry.reg("depth", do_depth)
 
 
+def profit_versions(s, e):
+    """What profit depends on: holdings, and the last prices they are valued at."""
+    return holder_versions(s, e), users.trades.version
+
+
+def profit(user):
+    """Realized and unrealized profit of user, open positions valued at the last price."""
+    return users.positions.get_portfolio(user.name).profit(users.trades.last_price)
+
+
+@commands.read
+@commands.pager.paged
+@commands.cache.cached(profit_versions, key=lambda s, e: (tuple(s), identify(e).host))
+def do_pnl(s, e, respond):
+    """Profit and loss at last prices. Optional user or implicit self, and filter prefix= to list it by claim."""
+    s, filters = split_filters(s, ["prefix"])
+    if len(s) > 1:
+        raise ValueError("Give a user as parameter, or none to see your own profit.")
+    if len(s) == 0:
+        u = sender(e)
+    else:
+        u = users.get_user(s[0])
+    q = D("0.01")
+    if "prefix" not in filters:
+        realized, unrealized = profit(u)
+        respond("Realized: {0}, unrealized: {1}, total: {2}.".format(
+            realized.quantize(q), unrealized.quantize(q), (realized + unrealized).quantize(q)))
+        return
+    pnl = users.positions.get_portfolio(u.name).pnl
+    shown = ("{0}: {1} ({2} realized)".format(
+        k, (pnl[k].realized + pnl[k].unrealized(users.trades.last_price(k))).quantize(q), pnl[k].realized.quantize(q))
+        for k in sorted(pnl) if k.startswith(filters["prefix"]))
+    respond(commands.pager.format(shown, e, "No profit or loss."))
+
+
+commands.registry.reg("pnl", do_pnl)
+
+
+@commands.read
+@commands.cache.cached(profit_versions)
 def do_top(s, e, respond):
-    user_list = list(users)
-    user_list.sort(key=lambda user: users.positions.get_portfolio(user.name).get_cash_balance())
-    user_list.reverse()
-    top5 = list(map(lambda user: user.nick + ":" + str(users.positions.get_portfolio(user.name).get_cash_balance()),
-                    user_list[0:5]))
+    """Top 5 by cash, or by profit at last prices with pnl."""
+    if len(s) > 1 or (s and s[0] != "pnl"):
+        raise ValueError("Pass pnl to rank by profit, or nothing to rank by cash.")
+    if s:
+        worth = {user.name: sum(profit(user)) for user in users}
+    else:
+        worth = {user.name: users.positions.get_portfolio(user.name).get_cash_balance() for user in users}
+    user_list = sorted(users, key=lambda user: worth[user.name], reverse=True)
+    top5 = [user.nick + ":" + str(worth[user.name].quantize(D("0.01")) if s else worth[user.name])
+            for user in user_list[0:5]]
     respond("Top 5: " + pretty_list(top5))
 
 
 commands.registry.reg("top", do_top)
 
 
+@commands.trade
 @user_check
 def do_cancelstar(s, e, respond):
     """Cancels matching orders. Takes a glob pattern as parameter"""
@@ -806,30 +1218,19 @@ def do_cancelstar(s, e, respond):
         regex = re.compile(fnmatch.translate(s[0]))
     except:
         raise ValueError("Incorrect format of order ID, not a valid glob pattern")
-    p = users.positions.get_portfolio(vmask(e.source))
+    p = users.positions.get_portfolio(identify(e).host)
+    cancelled = users.ob.mass_cancel(account_id=p.account_id, predicate=lambda o: regex.match(o.name()))
     a_h = users.ob.get_by_account_id(p.account_id)
-    orders = list(filter(lambda o: regex.match(o.name()), a_h))
-    #    for order in a_h:
-    for order in orders:
-        if regex.match(order.name()):
-            print("%s matches %s" % (regex, order.name()))
-    print("matching %s orders" % (len(orders)))
-
-    cancelled = 0
-    cancelled_shares = 0
-    for order in orders:
-        if order.account_id == p.account_id:
-            users.ob.remove_order(order)
-            cancelled = cancelled + 1
-            cancelled_shares = cancelled_shares + order.num_shares
-    l1, l2 = p.calc_risk(a_h.risk.risk)
+    l1, l2 = p.calc_risk(a_h.risk.risk) if a_h is not None else (p.locked_cash, p.locked_cash)
     users.save()
-    respond("Cancelled {0} orders ({1} shares. {2} cash released)".format(cancelled, cancelled_shares, l1 - l2))
+    respond("Cancelled {0} orders ({1} shares. {2} cash released)".format(len(cancelled), cancelled.num_shares,
+                                                                           l1 - l2))
 
 
 commands.registry.reg("gcancel", do_cancelstar)
 
 
+@commands.trade
 @user_check
 def do_cancel(s, e, respond):
     """Cancels an order. Takes an order ID in the form claim#id as a single parameter.."""
@@ -839,30 +1240,14 @@ def do_cancel(s, e, respond):
         cl, id = split_order(s[0])
     except:
         raise ValueError("Incorrect format of order ID. Try claim#id as shown by the orders command.")
-    p = users.positions.get_portfolio(vmask(e.source))
-    a_h = users.ob.get_by_account_id(p.account_id)
-    if not a_h:
-        raise ValueError("No such order.")
-    risk = a_h.risk.risk
-    c_h = users.ob.get_by_instrument_id(cl)
-    if not c_h:
-        raise ValueError("No such order.")
-    bid, ask = None, None
-    for i in c_h.bids:
-        if i.rank == id:
-            bid = i
-    for i in c_h.asks:
-        if i.rank == id:
-            ask = i
-    if (not ask) and (not bid):
+    p = users.positions.get_portfolio(identify(e).host)
+    o = users.ob.get_order(cl, id)
+    if o is None:
         raise ValueError("No such order.")
-    if ask and bid:
-        raise ValueError("Two orders share this rank. Inconsistent state.")
-    o = bid if bid else ask
     if o.account_id != p.account_id:
         raise ValueError("Cannot cancel someone else's order.")
     users.ob.remove_order(o)
-    l1, l2 = p.calc_risk(risk)
+    l1, l2 = p.calc_risk(users.ob.get_by_account_id(p.account_id).risk.risk)
     users.save()
     respond("Cancelled {0}, {1} coupons at {2} price. {3} cash released.".format(cl + "#" + str(id), o.num_shares,
                                                                                  o.price, l1 - l2))
@@ -871,6 +1256,42 @@ def do_cancel(s, e, respond):
 commands.registry.reg("cancel", do_cancel)
 
 
+@commands.trade
+@user_check
+def do_amend(s, e, respond):
+    """Changes an order. Order ID claim#id, then price= and shares= as shown by the orders command. Lowering the shares keeps the place in the queue, other changes queue the order anew."""
+    s, changes = split_filters(s, ["price", "shares"])
+    if len(s) != 1 or not changes:
+        raise ValueError("Pass an order ID in the form claim#id, and price= or shares= or both.")
+    try:
+        cl, id = split_order(s[0])
+    except:
+        raise ValueError("Incorrect format of order ID. Try claim#id as shown by the orders command.")
+    try:
+        price = D(changes["price"]) if "price" in changes else None
+        shares = D(changes["shares"]) if "shares" in changes else None
+    except DIO:
+        raise ValueError("Must provide decimals for price and shares.")
+    p = users.positions.get_portfolio(identify(e).host)
+    o = users.ob.get_order(cl, id)
+    if o is None:
+        raise ValueError("No such order.")
+    if o.account_id != p.account_id:
+        raise ValueError("Cannot amend someone else's order.")
+    if not claims.is_open(claims.claims[cl]):
+        raise ValueError("Claim not open for trade.")
+    result = engine.amend(o, price, shares)
+    users.save()
+    if result is None:
+        respond("Amended {0}.".format(o))
+    else:
+        respond("Replaced {0}#{1} by {2}. {3}".format(cl, id, result.order.name(), result))
+
+
+commands.registry.reg("amend", do_amend)
+
+
+@commands.admin
 @owner_check
 def do_nick(s, e, respond):
     """Set a nick for a given user. Takes a host mask and a nick. Owner command."""
@@ -880,14 +1301,100 @@ def do_nick(s, e, respond):
     if mask not in users.users:
         raise ValueError("No such user: {0}".format(mask))
     else:
-        users.users[mask].nick = nick
-        users.save()
+        users.set_nick(mask, nick)
         respond("Mask {0} assigned nick {1}.".format(mask, nick))
 
 
 commands.registry.reg("nick", do_nick)
 
 
+def memory_report():
+    """Build a memory report over the domain objects and the main containers."""
+    containers = {
+        "orderbook": users.ob,
+        "risk": [i.risk for i in users.ob.orders_by_acct.values()],
+        "trades.sorted_trades": users.trades.sorted_trades,
+        "trades.trades_by_instrument": users.trades.trades_by_instrument,
+        "positions": users.positions,
+        "users": users.users,
+        "claims": claims.claims,
+    }
+    return MemoryReport([Order, Trade, Coupon, Portfolio, User, Claim], containers)
+
+
+@commands.admin
+@quiet
+@owner_check
+def do_memory(s, e, respond):
+    """Memory footprint by object type and container. Optional start/stop to toggle tracemalloc. Owner command."""
+    if len(s) > 1:
+        raise ValueError("Pass start, stop, or nothing to see the report.")
+    if s and s[0] == "start":
+        tracemalloc.start()
+        respond("Tracing memory allocations.")
+    elif s and s[0] == "stop":
+        tracemalloc.stop()
+        respond("Stopped tracing memory allocations.")
+    elif s:
+        raise ValueError("Unknown option: " + s[0])
+    else:
+        respond(memory_report().summary())
+
+
+commands.registry.reg("memory", do_memory)
+
+
+@commands.admin
+@commands.stateless
+@quiet
+@owner_check
+def do_traces(s, e, respond):
+    """Recent command traces with per-stage timings. Optional count, or "slow" for the slowest. Owner command."""
+    if len(s) > 1:
+        raise ValueError("Pass a count, \"slow\", or nothing.")
+    if s and s[0] == "slow":
+        traces = commands.tracer.slowest(5)
+    else:
+        try:
+            n = int(s[0]) if s else 5
+        except ValueError:
+            raise ValueError("Count must be an integer.")
+        traces = commands.tracer.recent(n)
+    if not traces:
+        respond("No traces recorded.")
+    else:
+        respond("; ".join(str(i) for i in traces))
+
+
+commands.registry.reg("traces", do_traces)
+
+
+@commands.read
+def do_more(s, e, respond):
+    """Next page of the last listing you asked for."""
+    if s:
+        raise ValueError("This command takes no arguments.")
+    commands.pager.more(e, respond)
+
+
+commands.registry.reg("more", do_more)
+
+
+@commands.read
+@commands.stateless
+def do_stats(s, e, respond):
+    """Show how many commands were run, and how many were refused for flooding or load."""
+    stats = commands.stats
+    respond("Commands run: {0}. Rate limited: {1}. Shed under load: {2}. Waiting: {3}. Cache hits: {4}/{5}.".format(
+        stats["run"], stats["throttled"], stats["shed"], ircclient.backlog(), commands.cache.hits,
+        commands.cache.hits + commands.cache.misses))
+
+
+commands.registry.reg("stats", do_stats)
+
+
+@commands.admin
+@commands.stateless
 @quiet
 @owner_check
 def do_quit(s, e, respond):
@@ -898,13 +1405,97 @@ commands.registry.reg("quit", do_quit)
 
 
 def on_shutdown():
-    users.save()
-    claims.save()
+    if commands.ready.is_set():
+        users.save()
+        claims.save()
+    commands.audit.close()
+    if journal is not None:
+        journal.close()
+
+
+class Application:
+    """
+    Starts the bot. The configuration is read and the networks are joined
+    right away, while users, claims and the book are loaded in the
+    background. Until they are, commands needing them answer that the bot
+    is warming up.
+    """
+
+    def __init__(self, config_file="conf"):
+        self.config_file = config_file
+        # What made load_state() fail, if it did.
+        self.failure = None
+
+    def configure(self):
+        global config, ircclient
+        config = Configuration(self.config_file)
+        # The transports are imported here, so that importing the handlers does not load them.
+        if config.transport() == "select":
+            from ircfacade.ircclient import IrcClient
+            ircclient = IrcClient(config)
+        else:
+            from ircfacade.aioclient import AioIrcClient
+            ircclient = AioIrcClient(config)
+        commands.tracer.sample_rate = config.trace_sample_rate()
+        commands.tracer.path = config.trace_file()
+        commands.limiter.rate = config.command_rate()
+        commands.limiter.capacity = config.command_burst()
+        commands.limiter.mutating_cost = config.mutating_cost()
+        commands.cache.max_entries = config.response_cache_size()
+        commands.pager.page_size = config.page_size()
+        commands.audit.path = config.log_file()
+        commands.audit.fmt = config.log_format()
+        commands.audit.max_bytes = config.log_max_bytes()
+        commands.audit.backups = config.log_backups()
+        ircclient.every(config.claims_check_interval(), close_expired_claims)
+        ircclient.every(config.orders_check_interval(), expire_orders)
+
+    @staticmethod
+    def load_state():
+        """Load users, the book and claims, then let the commands needing them run."""
+        global users, claims, engine, journal
+        started = time.monotonic()
+        users = load_users()
+        users.home_network = config.home_network()
+        claims = load_claims()
+        if users.positions.untracked:
+            results = {cl.name: Coupon.yes if cl.result else Coupon.no
+                       for cl in claims.claims.values() if cl.result is not None}
+            users.positions.seed_pnl(users.trades.sorted_trades, results)
+            users.save()
+        engine = TradingEngine(users.ob, users.positions, users.trades)
+        journal = Journal(config.ledger_file())
+        users.positions.ledger.journal = journal.log
+        users.positions.ledger.snapshot()
+        commands.ready.set()
+        print("State loaded in {0:.2f}s.".format(time.monotonic() - started))
+
+    def bootstrap(self):
+        """
+        load_state(), in the background. If it fails the bot would be warming
+        up forever, so the error is logged and the client stopped instead.
+        """
+        try:
+            self.load_state()
+        except Exception as ex:
+            traceback.print_exc()
+            self.failure = ex
+            ircclient.stop_soon()
+
+    def run(self):
+        self.configure()
+        threading.Thread(target=self.bootstrap, name="bootstrap", daemon=True).start()
+        try:
+            ircclient.run(commands, on_shutdown)
+        except SystemExit:
+            if self.failure is None:
+                raise
+        if self.failure is not None:
+            raise SystemExit("Could not load the state: {0}".format(self.failure))
 
 
 def main():
-    # Network initialisation.
-    ircclient.run(commands, on_shutdown)
+    Application().run()
 
 
 if __name__ == "__main__":
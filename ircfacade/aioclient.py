@@ -0,0 +1,111 @@
+import asyncio
+
+import irc.client_aio
+
+from ircfacade.ircclient import IrcConnection, IrcClient
+from ircfacade.networks import Networks
+from ircfacade.worker import EngineWorker
+
+
+class AioIrcConnection(IrcConnection):
+    """
+    IrcConnection driven by an asyncio event loop. Reading, parsing and
+    sending stay on the loop; commands run on the engine worker and their
+    replies are posted back to the loop.
+    """
+
+    def __init__(self, loop, reactor, connection_parameters, network, commands, name, worker):
+        super().__init__(reactor, connection_parameters, network, commands, name)
+        self.loop = loop
+        self.worker = worker
+
+    def call_later(self, delay, func):
+        self.loop.call_later(delay, func)
+
+    def post(self, func, *args):
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def dispatch(self, command, e, respond):
+        """
+        Queue the command for the worker. When it falls behind, reads are
+        shed first, then trades; admin commands are always queued. Each
+        sender's commands run in the order they were sent.
+        """
+        kind = self.commands.registry.kind(command.command)
+        owner = (self.name, e.source.host)
+        if kind == self.commands.ADMIN:
+            self.worker.submit(self.run_command, command, e, respond, owner=owner)
+        elif not self.worker.offer(self.run_command, command, e, respond, read=kind == self.commands.READ,
+                                   owner=owner):
+            self.commands.stats["shed"] += 1
+            e.target = "IrcBook"
+            respond("Too busy, {0} was not run. Try again shortly.".format(command.command))
+
+
+class AioIrcClient(IrcClient):
+    """IrcClient on an asyncio event loop with a dedicated engine worker."""
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.loop = None
+        self.worker = EngineWorker(config.command_queue_size(), config.command_shed_at(), config.read_burst())
+
+    def run(self, commands, shutdown_handler):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.reactor = irc.client_aio.AioReactor(loop=self.loop)
+        irc.client_aio.AioConnection.buffer_class.encoding = 'latin-1'
+        self.commands = commands
+        self.shutdown_handler = shutdown_handler
+        self.worker.start()
+        for name in self.config.network_names():
+            self.add_connection(name)
+        self.loop.call_later(self.config_check_interval, self._check_config_periodically)
+        for interval, func in self.jobs:
+            self.start_job(interval, func)
+        if self.stopping:
+            self.loop.call_soon(self.stop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.worker.stop()
+            self.loop.close()
+
+    def new_connection(self, name):
+        settings = self.config.network(name)
+        return AioIrcConnection(self.loop, self.reactor, settings, Networks.get(settings.auth()), self.commands, name,
+                                self.worker)
+
+    def post(self, func, *args):
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def stop_soon(self):
+        self.stopping = True
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stop)
+
+    def stop(self):
+        """Saves state from the worker, then disconnects and stops the loop. Owner command."""
+        for connection in list(self.connections.values()):
+            connection.supervisor.stop()
+        self.shutdown_handler()
+        self.post(self._close_all)
+
+    def _close_all(self):
+        for connection in list(self.connections.values()):
+            connection.close("Quit!")
+        self.loop.stop()
+
+    def start_job(self, interval, func):
+        def tick():
+            self.worker.submit(self.run_job, func)
+            self.loop.call_later(interval, tick)
+
+        self.loop.call_later(interval, tick)
+
+    def backlog(self):
+        return self.worker.backlog()
+
+    def _check_config_periodically(self):
+        self.check_config()
+        self.loop.call_later(self.config_check_interval, self._check_config_periodically)
@@ -0,0 +1,85 @@
+from collections import OrderedDict
+
+from ircfacade.pager import Pager
+
+
+class _Entry:
+    def __init__(self, versions, responses, error):
+        self.versions = versions
+        self.responses = responses
+        self.error = error
+
+    def replay(self, respond):
+        for m in self.responses:
+            respond(m)
+        if self.error is not None:
+            raise ValueError(*self.error.args)
+
+
+class ResponseCache:
+    """
+    Answers of query commands, keyed by command and arguments. Each entry
+    remembers the versions of the state it was computed from and is only
+    served while they are unchanged, so it is never stale. Only the
+    max_entries most recently used entries are kept.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key, versions):
+        """The entry for key if it was computed from versions, else None."""
+        entry = self.entries.get(key)
+        if entry is None or entry.versions != versions:
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def store(self, key, versions, responses, error=None):
+        self.entries[key] = _Entry(versions, responses, error)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def cached(self, versions, key=None):
+        """
+        Decorator for a query handler. The responses, or the ValueError, it
+        gave for the same arguments are replayed while versions(s, e) is
+        unchanged. key(s, e) stands for the arguments in the cache key of
+        handlers whose answer also depends on who asks. Pages of paged
+        listings are cached apart.
+        """
+
+        def decorate(func):
+            def do_cached(s, e, respond):
+                k = (func.__name__, key(s, e) if key else tuple(s), Pager.page_of(e))
+                current = versions(s, e)
+                entry = self.lookup(k, current)
+                if entry is not None:
+                    self.hits += 1
+                    entry.replay(respond)
+                    return
+                self.misses += 1
+                responses = []
+
+                def record(m):
+                    responses.append(m)
+                    respond(m)
+
+                try:
+                    func(s, e, record)
+                except ValueError as ex:
+                    self.store(k, current, responses, ex)
+                    raise
+                self.store(k, current, responses)
+
+            do_cached.__doc__ = func.__doc__
+            return do_cached
+
+        return decorate
@@ -1,6 +1,16 @@
 # Out of a list, obtain the elements starting with a prefix.
 
+import math
+import threading
+from collections import Counter
+
+from ircfacade.cache import ResponseCache
+from ircfacade.pager import Pager
+from ircfacade.ratelimit import RateLimiter
+from util.auditlog import AuditLog
+from util.prefixes import PrefixIndex
 from util.stringutils import pretty_list
+from util.tracing import Tracer
 
 
 class InvalidCommand(Exception):
@@ -23,6 +33,18 @@ class AmbiguousCommand(InvalidCommand):
         self.commands = commands
 
 
+class Throttled(InvalidCommand):
+    """The sender ran out of tokens. quiet when they were already told so."""
+
+    def __init__(self, message, quiet=False):
+        super().__init__(message)
+        self.quiet = quiet
+
+
+class WarmingUp(InvalidCommand):
+    pass
+
+
 class Command:
     def __init__(self, command, args):
         self.command = command
@@ -38,9 +60,23 @@ class Command:
 class CommandRegistry:
     def __init__(self):
         self.handlers = {}
+        self.prefixes = PrefixIndex()
 
     def reg(self, s, func):
         self.handlers[s] = func
+        self.prefixes.add(s)
+
+    def kind(self, command):
+        """READ, TRADE or ADMIN, as the handler of a command was classified."""
+        return getattr(self.handlers.get(command), "kind", READ)
+
+    def needs_state(self, command):
+        """Whether the handler of a command has to wait for the state to be loaded."""
+        return not getattr(self.handlers.get(command), "stateless", False)
+
+    def is_mutating(self, command):
+        """Whether the handler of a command changes state."""
+        return self.kind(command) != READ
 
     def lookup(self, command):
         try:
@@ -49,12 +85,8 @@ class CommandRegistry:
             raise NoMatchingCommand("Command not found: " + command.command)
 
     def find(self, p):
-        matching_commands = []
-        for i in self.handlers:
-            if i.startswith(p):
-                matching_commands.append(i)
-        matching_commands.sort()
-        return matching_commands
+        """Commands p may stand for: an exact match, or all commands it prefixes."""
+        return self.prefixes.resolve(p)
 
 
 class CommandLine:
@@ -74,9 +106,8 @@ class CommandLine:
 
 
 def log_msg(m):
-    """Log to file."""
-    with open("log.txt", "a") as f:
-        f.write(str(m) + "\n")
+    """Log a message to the audit log."""
+    audit.log({"message": str(m)})
 
 
 def with_log(func):
@@ -89,7 +120,48 @@ def with_log(func):
     return do_it
 
 
+# Kinds of command handlers. Reads only look at state; trades change the
+# book, users or claims and run in the order they arrived; admin commands
+# are owner commands that change state.
+READ = "read"
+TRADE = "trade"
+ADMIN = "admin"
+
+
+def read(func):
+    """Classify a command handler as a read."""
+    func.kind = READ
+    return func
+
+
+def trade(func):
+    """Classify a command handler as a trade."""
+    func.kind = TRADE
+    return func
+
+
+def admin(func):
+    """Classify a command handler as an admin command."""
+    func.kind = ADMIN
+    return func
+
+
+def stateless(func):
+    """Mark a command handler as one that works before the state is loaded."""
+    func.stateless = True
+    return func
+
+
 registry = CommandRegistry()
+tracer = Tracer()
+limiter = RateLimiter()
+cache = ResponseCache()
+pager = Pager()
+audit = AuditLog()
+# Set once the state commands work on is loaded.
+ready = threading.Event()
+# Commands run, and commands refused before running, by reason.
+stats = Counter()
 
 
 def prepare(c):
@@ -118,7 +190,29 @@ def tokenize_command(c):
     return s
 
 
+def admit(command, e):
+    """
+    Charge the sender of event e for running command, or at the cost of a
+    query if it is None, for a line that is no valid command. Raises
+    Throttled when they cannot afford it. Senders are told apart by network
+    and host, as the same host on two networks may be two people.
+    """
+    key = (getattr(e, "network", None), e.source.host)
+    mutating = command is not None and registry.is_mutating(command.command)
+    name = command.command if command is not None else "your command"
+    told = key in limiter.refused
+    if not limiter.allow(key, mutating):
+        stats["throttled"] += 1
+        raise Throttled("Too many commands, {0} was not run. Try again in {1}s.".format(
+            name, math.ceil(limiter.delay(key, mutating))), quiet=told)
+
+
 def execute(command, e, respond):
-    log_msg([command, e.source])
+    audit.log({"command": command.command, "args": command.args, "source": str(e.source),
+               "network": getattr(e, "network", None)})
+    stats["run"] += 1
     handler = registry.lookup(command)
-    handler(command.args, e, respond)
+    if not ready.is_set() and registry.needs_state(command.command):
+        raise WarmingUp("Warming up, {0} will work in a moment.".format(command.command))
+    with tracer.trace(command.command):
+        handler(command.args, e, respond)
@@ -1,98 +1,206 @@
 import re
+import traceback
 
 import irc.client
 
-from ircfacade.commands import InvalidCommand
+from ircfacade.commands import InvalidCommand, Throttled
+from ircfacade.networks import Networks
+from ircfacade.outbound import Coalescer, SendQueue, TokenBucket, guess_prefix, line_budget, pack_messages
+from ircfacade.reconnect import Backoff, ReconnectSupervisor
 
 
 class IrcConnection:
-    def __init__(self, reactor, connection_parameters, shutdown_handler, network, commands):
+    """
+    Connection to one network. Several connections may share a reactor;
+    each only handles the events of its own server connection.
+    """
+
+    def __init__(self, reactor, connection_parameters, network, commands, name):
         self.config = connection_parameters
         self.commands = commands
+        self.name = name
         self.c = None
         self.r = reactor
-        self.shutdownHandler = shutdown_handler
         self.network = network
+        self.prefix = None
+        # Channels joined from the configuration, None until they are first joined.
+        self.joined = None
+        self.handlers = []
+        self.send_queue = SendQueue(self.send_line, TokenBucket(connection_parameters.send_rate(),
+                                                                connection_parameters.send_burst()))
+        self.pumping = False
+        self.coalescer = Coalescer()
+        self.coalescing = False
+        backoff = Backoff(connection_parameters.reconnect_delay(), maximum=connection_parameters.reconnect_max_delay())
+        self.supervisor = ReconnectSupervisor(self.connect_to_server, self.call_later, self.on_server_connected,
+                                              backoff)
 
-    def try_connect(self, max_attempts=10):
-        """Takes a reactor object and attempts to connect 10 times."""
-        connected, attempts = False, 0
-        while not connected:
-            try:
-                print("Connection attempt: " + str(attempts))
-                c = self.connect_to_server()
-                print("Connected: from Main.")
-                connected = True
-            except irc.client.ServerConnectionError:
-                print("Connection failed.")
-                attempts += 1
-            if attempts > max_attempts:
-                raise SystemExit("Impossible to connect after " + str(max_attempts) + " attempts.")
-        self.c = c
-        return c
+    def connect(self):
+        """Connect, retrying with backoff for as long as it takes."""
+        self.supervisor.start()
+
+    def on_server_connected(self, c):
+        self.pump()
+
+    def online(self):
+        return self.supervisor.is_connected()
 
     def connect_to_server(self):
         server = self.config.server()
         port = self.config.port()
         nick = self.config.nick()
-        c = self.r.server().connect(server, port, nick)
-        return c
+        # Set before connecting so that events of the new connection are recognised as ours.
+        # Reconnections reuse it rather than adding a connection to the reactor each time.
+        if self.c is None:
+            self.c = self.r.server()
+        return self.c.connect(server, port, nick)
 
     def respond(self, e, m):
         """Respond with message m to the sender of event or a channel e through connection c."""
-        # If string is too long, split it.
-        m = str(m)
-        result = [m]
-        if len(m.encode("latin1")) >= 450:
-            s = m.split(" ")
-            size_in_bytes = 0
-            cut_point = 0
-            result = []
-            for i in range(len(s)):
-                if size_in_bytes + len(s[i].encode("latin1")) + 1 >= 450:
-                    result.append(" ".join(s[cut_point:i]))
-                    cut_point = i
-                    size_in_bytes = 0
-                else:
-                    size_in_bytes += len(s[i]) + 1
-            result.append(" ".join(s[cut_point:]))
-        for i in result:
-            if e.target in self.config.active_channels:
-                self.c.privmsg(e.target, i)
-            else:
-                self.c.privmsg(e.source.nick, i)
+        target, private = self.reply_target(e)
+        self.send(target, m, private)
+
+    def reply_target(self, e):
+        """Where replies to event e go, and whether that is a private reply."""
+        if e.target in self.config.active_channels:
+            return e.target, False
+        return e.source.nick, True
+
+    def call_later(self, delay, func):
+        """Run func on the I/O thread after delay seconds."""
+        self.r.scheduler.execute_after(delay, func)
+
+    def post(self, func, *args):
+        """Run func(*args) on the I/O thread. Commands already run there."""
+        func(*args)
+
+    def send(self, target, m, private=False):
+        """Queue message m to target. Messages to a target within a short window share lines."""
+        self.coalescer.add(target, m, private)
+        if not self.coalescing:
+            self.coalescing = True
+            self.call_later(self.config.coalesce_window(), self.flush)
+
+    def flush(self):
+        """Pack the messages held back into lines and queue them."""
+        self.coalescing = False
+        prefix = self.prefix or guess_prefix(self.config.nick())
+        for target, messages, private in self.coalescer.drain():
+            for line in pack_messages(messages, line_budget(prefix, target)):
+                self.send_queue.put(target, line, private)
+        self.pump()
+
+    def send_line(self, target, line):
+        self.c.privmsg(target, line)
+
+    def pump(self):
+        """Send queued lines as flood control allows, and come back for the rest."""
+        if not self.online():
+            # Kept until reconnected.
+            return
+        delay = self.send_queue.pump()
+        if delay is not None and not self.pumping:
+            self.pumping = True
+            self.call_later(delay, self._pump_later)
+
+    def _pump_later(self):
+        self.pumping = False
+        self.pump()
+
+    def on_features(self, c, e):
+        """Learn how many targets the server takes per PRIVMSG."""
+        targmax = getattr(c.features, "targmax", None) or {}
+        max_targets = targmax.get("PRIVMSG")
+        if max_targets:
+            self.send_queue.max_targets = int(min(max_targets, self.config.max_targets()))
+
+    def on_join(self, c, e):
+        """Learn the prefix the server relays our messages with."""
+        if e.source.nick == c.get_nickname():
+            self.prefix = str(e.source)
 
     def join(self, channel):
-        print("Joining channel: " + channel)
-        self.c.join(channel)
+        print("Joining channel: " + channel + " on " + self.name)
+        if self.joined is not None:
+            self.joined = self.joined | {channel}
+        self.post(self.c.join, channel)
+
+    def part(self, channel):
+        print("Leaving channel: " + channel + " on " + self.name)
+        if self.joined is not None:
+            self.joined = self.joined - {channel}
+        self.post(self.c.part, channel)
+
+    def sync_channels(self):
+        """Join the channels added to the configuration and leave those removed. Returns both."""
+        if self.joined is None:
+            # Not joined yet, the configured channels are joined once ready.
+            return set(), set()
+        joined = self.config.channels - self.joined
+        left = self.joined - self.config.channels
+        for ch in joined:
+            self.join(ch)
+        for ch in left:
+            self.part(ch)
+        return joined, left
 
     def response_callback(self, event):
         def response_func(message):
-            self.respond(event, message)
+            target, private = self.reply_target(event)
+            self.post(self.send, target, message, private)
 
         return response_func
 
-    def on_pm(self, c, e):
+    def handle(self, e):
+        """Parse a command out of event e and dispatch it."""
+        e.network = self.name
+        command = invalid = None
         try:
             command = self.commands.prepare(e.arguments[0])
-            callback = self.response_callback(e)
-            self.commands.execute(command, e, callback)
         except InvalidCommand as ex:
-            self.respond(e, str(ex))
-        except ValueError as ex:
-            self.respond(e, str(ex))
+            invalid = ex
+        try:
+            # Lines that are no valid command are charged too, as they are answered all the same.
+            self.commands.admit(command, e)
+        except Throttled as ex:
+            if not ex.quiet:
+                e.target = "IrcBook"
+                self.respond(e, str(ex))
+            return
+        if invalid is not None:
+            e.target = "IrcBook"
+            self.respond(e, str(invalid))
+            return
+        self.dispatch(command, e, self.response_callback(e))
+
+    def dispatch(self, command, e, respond):
+        """Run a parsed command."""
+        self.run_command(command, e, respond)
+
+    def run_command(self, command, e, respond):
+        if not self.online() and self.commands.registry.is_mutating(command.command):
+            e.target = "IrcBook"
+            respond("Reconnecting to the server, {0} was not run. Try again shortly.".format(command.command))
+            return
+        try:
+            self.commands.execute(command, e, respond)
+        except (InvalidCommand, ValueError) as ex:
+            e.target = "IrcBook"
+            respond(str(ex))
+
+    def on_pm(self, c, e):
+        self.handle(e)
 
     def on_disconnect(self, c, e):
-        print("Connection lost. " + str(e))
-        print("Attempting to reconnect...")
-        self.try_connect()
+        print("Connection to " + self.name + " lost. " + str(e))
+        self.supervisor.lost()
 
-    def stop(self):
-        """Disconnects bot and saves state. Owner command."""
-        self.c.remove_global_handler("disconnect", self.on_disconnect)
-        self.c.disconnect("Quit!")
-        self.shutdownHandler()
-        raise SystemExit("Terminated by owner.")
+    def close(self, message):
+        """Stop handling events and disconnect for good."""
+        self.supervisor.stop()
+        self.unregister_handlers()
+        if self.c is not None and self.c.is_connected():
+            self.c.disconnect(message)
 
     @staticmethod
     def is_command(sentence):
@@ -106,19 +214,14 @@ class IrcConnection:
             return
         if not self.is_command(e.arguments):
             return
-        try:
-            command = self.commands.prepare(e.arguments[0])
-            self.commands.execute(command, e, self.response_callback(e))
-        except InvalidCommand as ex:
-            e.target = "IrcBook"
-            self.respond(e, str(ex))
-        except ValueError as eve:
-            e.target = "IrcBook"
-            self.respond(e, str(eve))
+        self.handle(e)
 
-    @staticmethod
-    def on_connect(c, e):
-        print("Connection realised, on_connect.")
+    def on_connect(self, c, e):
+        print("Connection to " + self.name + " realised, on_connect.")
+        self.supervisor.registered()
+        if not self.network.needs_auth:
+            self.join_channels(c)
+            print("Ready.")
 
     def on_notice(self, c, e):
         print("Notice: " + str(c) + ", " + str(e))
@@ -132,35 +235,164 @@ class IrcConnection:
             print("Ready.")
 
     def join_channels(self, c):
-        c.join(self.config.log_chan())
-        for ch in self.config.channels:
+        if self.config.log_chan():
+            c.join(self.config.log_chan())
+        self.joined = self.config.channels
+        for ch in self.joined:
             c.join(ch)
 
+    def _own(self, handler):
+        """Handler called only for events of this connection."""
+
+        def own_handler(c, e):
+            if c is self.c:
+                return handler(c, e)
+
+        return own_handler
+
     def register_handlers(self):
-        self.c.add_global_handler("welcome", self.on_connect)
-        self.c.add_global_handler("disconnect", self.on_disconnect)
-        self.c.add_global_handler("privnotice", self.on_notice)
-        self.c.add_global_handler("privmsg", self.on_pm)
-        self.c.add_global_handler("pubmsg", self.on_chan)
+        for event, handler in (("welcome", self.on_connect),
+                               ("disconnect", self.on_disconnect),
+                               ("privnotice", self.on_notice),
+                               ("privmsg", self.on_pm),
+                               ("pubmsg", self.on_chan),
+                               ("join", self.on_join),
+                               ("featurelist", self.on_features)):
+            handler = self._own(handler)
+            self.r.add_global_handler(event, handler)
+            self.handlers.append((event, handler))
+
+    def unregister_handlers(self):
+        for event, handler in self.handlers:
+            self.r.remove_global_handler(event, handler)
+        self.handlers = []
 
 
 class IrcClient:
-    def __init__(self, config, network):
-        self.connection = None
+    """
+    Drives a connection to every network in the configuration from one
+    reactor. All of them feed the same commands, and so the same engine.
+    """
+
+    # Seconds between checks of the configuration file for changes.
+    config_check_interval = 10
+
+    def __init__(self, config):
         self.config = config
-        self.network = network
+        self.connections = {}
+        self.reactor = None
+        self.commands = None
+        self.shutdown_handler = None
+        # (interval, func) of the jobs to run every interval seconds.
+        self.jobs = []
+        # Set by stop_soon().
+        self.stopping = False
 
     def run(self, commands, shutdown_handler):
-        reactor = irc.client.Reactor()
+        self.reactor = irc.client.Reactor()
         irc.client.ServerConnection.buffer_class.encoding = 'latin-1'
-        connection = IrcConnection(reactor, self.config, shutdown_handler, self.network, commands)
-        connection.try_connect()
+        self.commands = commands
+        self.shutdown_handler = shutdown_handler
+        for name in self.config.network_names():
+            self.add_connection(name)
+        self.reactor.scheduler.execute_every(self.config_check_interval, self.check_config)
+        for interval, func in self.jobs:
+            self.start_job(interval, func)
+        if self.stopping:
+            self.stop()
+        self.reactor.process_forever()
+
+    def every(self, interval, func):
+        """Run func() every interval seconds once the client runs, on the thread commands run on."""
+        self.jobs.append((interval, func))
+
+    def start_job(self, interval, func):
+        self.reactor.scheduler.execute_every(interval, lambda: self.run_job(func))
+
+    @staticmethod
+    def run_job(func):
+        try:
+            func()
+        except Exception:
+            traceback.print_exc()
+
+    def new_connection(self, name):
+        settings = self.config.network(name)
+        return IrcConnection(self.reactor, settings, Networks.get(settings.auth()), self.commands, name)
+
+    def post(self, func, *args):
+        """Run func(*args) on the I/O thread. Commands already run there."""
+        func(*args)
+
+    def connection(self, name):
+        if name not in self.connections:
+            raise ValueError("Not connected to " + str(name) + ".")
+        return self.connections[name]
+
+    def add_connection(self, name):
+        """Connect to the network called name in the configuration."""
+        if name in self.connections:
+            raise ValueError("Already connected to " + name + ".")
+        connection = self.new_connection(name)
+        self.connections[name] = connection
+        self.post(self._open, connection)
+
+    @staticmethod
+    def _open(connection):
         connection.register_handlers()
-        self.connection = connection
-        reactor.process_forever()
+        connection.connect()
+
+    def remove_connection(self, name):
+        """Disconnect from the network called name."""
+        connection = self.connection(name)
+        del self.connections[name]
+        self.post(connection.close, "Leaving.")
+
+    def stop_soon(self):
+        """Stop from another thread, on the I/O thread, or as soon as the client runs."""
+        self.stopping = True
+        if self.reactor is not None:
+            self.reactor.scheduler.execute_after(0, self.stop)
 
     def stop(self):
-        self.connection.stop()
+        """Disconnects bot and saves state. Owner command."""
+        for connection in list(self.connections.values()):
+            connection.close("Quit!")
+        self.shutdown_handler()
+        raise SystemExit("Terminated by owner.")
 
-    def join(self, channel):
-        self.connection.join(channel)
+    def join(self, channel, network):
+        self.connection(network).join(channel)
+
+    def backlog(self):
+        """Commands waiting to run."""
+        return 0
+
+    def reload_config(self):
+        """
+        Re-read the configuration, connect to the networks added, disconnect
+        from those removed and move between channels accordingly. Returns the
+        (network, channel) pairs joined and left.
+        """
+        self.config.reload()
+        names = set(self.config.network_names())
+        for name in set(self.connections) - names:
+            self.remove_connection(name)
+        for name in names - set(self.connections):
+            self.add_connection(name)
+        joined, left = set(), set()
+        for name, connection in list(self.connections.items()):
+            j, l = connection.sync_channels()
+            joined.update((name, ch) for ch in j)
+            left.update((name, ch) for ch in l)
+        return joined, left
+
+    def check_config(self):
+        """Reload the configuration if its file changed. One that fails to load is logged and ignored."""
+        if self.config.changed():
+            print("Configuration changed, reloading.")
+            try:
+                self.reload_config()
+            except Exception:
+                print("Configuration not reloaded, keeping the old one.")
+                traceback.print_exc()
@@ -16,6 +16,9 @@ class AuthService:
 class Network:
     __metaclass__ = ABCMeta
 
+    # Whether channels are joined only once the auth service confirms.
+    needs_auth = True
+
     @abstractmethod
     def get_auth_service(self):
         pass
@@ -26,21 +29,47 @@ class Networks:
     def get_freenode():
         return Freenode()
 
+    @staticmethod
+    def get(name):
+        """Network by the name used for it in the configuration."""
+        networks = {"freenode": Freenode, "libera": Libera, "none": Unauthenticated}
+        if name not in networks:
+            raise ValueError("Unknown network type: " + str(name))
+        return networks[name]()
+
+
+class _Nickserv(AuthService):
+    def __init__(self, nickserv):
+        self.nickserv = nickserv
+
+    def is_auth_request(self, source, msg):
+        return source == self.nickserv and "identify via" in msg
+
+    def is_auth_confirmation(self, source, msg):
+        return source == self.nickserv and "now identified" in msg
+
 
 class Freenode(Network):
-    class _Nickserv(AuthService):
+    def get_auth_service(self):
+        return _Nickserv("NickServ!NickServ@services.")
+
+
+class Libera(Network):
+    def get_auth_service(self):
+        return _Nickserv("NickServ!NickServ@services.libera.chat")
+
+
+class Unauthenticated(Network):
+    """Network without services. Channels are joined once the server welcomes us."""
 
+    class _NoAuth(AuthService):
         def is_auth_request(self, source, msg):
-            is_nickserv = self.__class__._is_nickserv(source)
-            return is_nickserv and "identify via" in msg
+            return False
 
         def is_auth_confirmation(self, source, msg):
-            is_nickserv = self.__class__._is_nickserv(source)
-            return is_nickserv and "now identified" in msg
+            return False
 
-        @staticmethod
-        def _is_nickserv(source):
-            return source == "NickServ!NickServ@services."
+    needs_auth = False
 
     def get_auth_service(self):
-        return self._Nickserv()
+        return self._NoAuth()
@@ -0,0 +1,209 @@
+import time
+from collections import deque
+
+# Longest line a server accepts, including the trailing CR LF.
+MAX_LINE = 512
+
+# Longest host name servers hand out, used while our own prefix is unknown.
+MAX_HOST = 63
+
+# Encoding lines go out in, the transmit_encoding of irc.client connections.
+ENCODING = "utf-8"
+
+
+def line_budget(prefix, target, command="PRIVMSG", encoding=ENCODING):
+    """
+    Bytes available for the text of a message, given the prefix the server
+    will put in front of it when relaying it (nick!user@host).
+    """
+    overhead = len(":{0} {1} {2} :\r\n".format(prefix, command, target).encode(encoding, "replace"))
+    return MAX_LINE - overhead
+
+
+def guess_prefix(nick):
+    """Longest prefix the server may give us, for use until we learn the real one."""
+    return nick + "!~" + nick[:10] + "@" + "x" * MAX_HOST
+
+
+def chunk_message(message, budget, encoding=ENCODING):
+    """
+    Split a message into pieces of at most budget bytes once encoded.
+    Pieces are cut at spaces; words longer than a piece are cut between
+    characters wherever they have to be. Raises ValueError if budget is
+    not positive.
+    """
+    if budget <= 0:
+        raise ValueError("Budget must be positive.")
+    message = str(message)
+    if len(message.encode(encoding, "replace")) <= budget:
+        yield message
+        return
+    words = []
+    size = 0
+    for word in message.split(" "):
+        word_size = len(word.encode(encoding, "replace"))
+        if words and size + 1 + word_size <= budget:
+            words.append(word)
+            size += 1 + word_size
+            continue
+        if words:
+            yield " ".join(words)
+            words, size = [], 0
+        while word_size > budget:
+            piece, piece_size = _cut(word, budget, encoding)
+            yield piece
+            word = word[len(piece):]
+            word_size -= piece_size
+        words, size = [word], word_size
+    if words:
+        yield " ".join(words)
+
+
+def pack_messages(messages, budget, separator=" | ", encoding=ENCODING):
+    """
+    Put consecutive messages on shared lines of at most budget bytes,
+    keeping their order. Messages too long for a line are chunked first.
+    """
+    separator_size = len(separator.encode(encoding))
+    line, size = None, 0
+    for m in messages:
+        for piece in chunk_message(m, budget, encoding):
+            piece_size = len(piece.encode(encoding, "replace"))
+            if line is not None and size + separator_size + piece_size <= budget:
+                line += separator + piece
+                size += separator_size + piece_size
+            else:
+                if line is not None:
+                    yield line
+                line, size = piece, piece_size
+    if line is not None:
+        yield line
+
+
+def _cut(word, budget, encoding):
+    """Longest head of word fitting in budget bytes, and its size. Characters are never split."""
+    size = 0
+    for i, ch in enumerate(word):
+        ch_size = len(ch.encode(encoding, "replace"))
+        if size + ch_size > budget:
+            if i == 0:
+                raise ValueError("Budget too small for a character.")
+            return word[:i], size
+        size += ch_size
+    return word, size
+
+
+def _privmsg_size(targets, text):
+    return len("PRIVMSG {0} :{1}\r\n".format(",".join(targets), text).encode(ENCODING, "replace"))
+
+
+class TokenBucket:
+    """Allow bursts of up to capacity events, refilled at rate per second."""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.last = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def consume(self, n=1):
+        """Take n tokens if available. Tells whether they were taken."""
+        self._refill()
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
+
+    def delay(self, n=1):
+        """Seconds until n tokens are available."""
+        self._refill()
+        if self.tokens >= n:
+            return 0
+        return (n - self.tokens) / self.rate
+
+
+class Coalescer:
+    """
+    Messages held back for a moment so that those to the same target can
+    share lines. Private and public messages to a target are kept apart.
+    """
+
+    def __init__(self):
+        self.pending = {}
+
+    def add(self, target, message, private=False):
+        self.pending.setdefault((target, private), []).append(str(message))
+
+    def drain(self):
+        """Pending messages as (target, messages, private), in the order targets were first seen."""
+        pending, self.pending = self.pending, {}
+        return [(target, messages, private) for (target, private), messages in pending.items()]
+
+    def __len__(self):
+        return len(self.pending)
+
+
+class SendQueue:
+    """
+    Outbound lines of a connection, paced by a token bucket. Private
+    replies are sent before channel messages. When the server accepts
+    several targets per PRIVMSG, a line queued for several targets is
+    sent once to all of them.
+    """
+
+    def __init__(self, send, bucket, max_targets=1):
+        self.send = send
+        self.bucket = bucket
+        self.max_targets = max_targets
+        self.private = deque()
+        self.public = deque()
+
+    def put(self, target, text, private=False):
+        if private:
+            self.private.append((target, text))
+        else:
+            self.public.append((target, text))
+
+    def pump(self):
+        """
+        Send as many lines as the bucket allows. Returns the seconds to
+        wait before pumping again, or None once the queue is empty.
+        """
+        while self.private or self.public:
+            if not self.bucket.consume():
+                return self.bucket.delay()
+            queue = self.private if self.private else self.public
+            target, text = queue.popleft()
+            targets = [target]
+            if self.max_targets > 1:
+                self._take_copies(queue, text, targets)
+            self.send(",".join(targets), text)
+        return None
+
+    def _take_copies(self, queue, text, targets):
+        """
+        Move the queued copies of text for other targets into targets, as
+        many as fit. A copy is only taken if nothing is queued ahead of it
+        for its target, so that each target gets its lines in order.
+        """
+        rest = deque()
+        # Targets with a line queued ahead of any copy found later.
+        waiting = set()
+        for target, t in queue:
+            if (t == text and target not in targets and target not in waiting and
+                    len(targets) < self.max_targets and _privmsg_size(targets + [target], text) <= MAX_LINE):
+                targets.append(target)
+            else:
+                rest.append((target, t))
+                waiting.add(target)
+        queue.clear()
+        queue.extend(rest)
+
+    def __len__(self):
+        return len(self.private) + len(self.public)
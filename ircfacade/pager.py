@@ -0,0 +1,82 @@
+from collections import OrderedDict
+from itertools import islice
+
+from util.stringutils import pretty_list
+
+
+class Pager:
+    """
+    Cuts listings into pages of at most page_size items. Each sender, known
+    by network and host, has a cursor remembering the last listing it asked for and the page after
+    the one shown, so that $more runs the listing again for that page.
+    Only the max_cursors most recently used cursors are kept.
+    """
+
+    def __init__(self, page_size=10, max_cursors=1024):
+        self.page_size = page_size
+        self.max_cursors = max_cursors
+        self.cursors = OrderedDict()
+
+    @staticmethod
+    def sender_of(e):
+        """Whose cursor event e moves. The same host on two networks may be two people."""
+        return getattr(e, "network", None), e.source.host
+
+    @staticmethod
+    def page_of(e):
+        """Page of a listing asked for with event e. $more sets it."""
+        return getattr(e, "page", 0)
+
+    def paged(self, func):
+        """Decorator for listing handlers, moving the cursor of the sender past the page shown."""
+
+        def do_paged(s, e, respond):
+            sender = Pager.sender_of(e)
+            self.cursors[sender] = (do_paged, s, Pager.page_of(e) + 1)
+            self.cursors.move_to_end(sender)
+            if len(self.cursors) > self.max_cursors:
+                self.cursors.popitem(last=False)
+            func(s, e, respond)
+
+        do_paged.__doc__ = func.__doc__
+        return do_paged
+
+    def page(self, items, e):
+        """Items of the page asked for with event e, taken from the iterable items, and whether more follow."""
+        start = Pager.page_of(e) * self.page_size
+        items = list(islice(items, start, start + self.page_size + 1))
+        return items[:self.page_size], len(items) > self.page_size
+
+    def format(self, items, e, empty):
+        """The page asked for with event e, as a sentence. Raises ValueError(empty) on an empty first page."""
+        shown, more = self.page(items, e)
+        if not shown:
+            if Pager.page_of(e):
+                raise ValueError("Nothing more to show.")
+            raise ValueError(empty)
+        if more:
+            return pretty_list(shown) + " ($more for more)"
+        return pretty_list(shown)
+
+    def more(self, e, respond):
+        """Show the next page of the last listing the sender of e asked for."""
+        cursor = self.cursors.get(Pager.sender_of(e))
+        if cursor is None:
+            raise ValueError("Nothing more to show.")
+        handler, s, page = cursor
+        e.page = page
+        handler(s, e, respond)
+
+
+def split_filters(args, names):
+    """Split the name=value filters out of command arguments. Returns the other arguments and the filters."""
+    rest, filters = [], {}
+    for arg in args:
+        name, sep, value = arg.partition("=")
+        if not sep:
+            rest.append(arg)
+        elif name not in names:
+            raise ValueError("No filter {0}. Filters: {1}.".format(name, pretty_list(names)))
+        else:
+            filters[name] = value
+    return rest, filters
@@ -0,0 +1,50 @@
+import time
+from collections import OrderedDict
+
+from ircfacade.outbound import TokenBucket
+
+
+class RateLimiter:
+    """
+    A token bucket per sender, known by a key such as its network and
+    host. Queries take query_cost tokens and commands that change state
+    mutating_cost. Only the most recently seen max_buckets senders are
+    remembered; a bucket forgotten would have been full by then anyway.
+    """
+
+    def __init__(self, rate=0.5, capacity=6, query_cost=1, mutating_cost=2, max_buckets=10000, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.query_cost = query_cost
+        self.mutating_cost = mutating_cost
+        self.max_buckets = max_buckets
+        self.clock = clock
+        self.buckets = OrderedDict()
+        # Hostmasks refused since their last allowed command.
+        self.refused = set()
+
+    def bucket(self, mask):
+        if mask in self.buckets:
+            self.buckets.move_to_end(mask)
+            return self.buckets[mask]
+        bucket = TokenBucket(self.rate, self.capacity, self.clock)
+        self.buckets[mask] = bucket
+        if len(self.buckets) > self.max_buckets:
+            old, _ = self.buckets.popitem(last=False)
+            self.refused.discard(old)
+        return bucket
+
+    def cost(self, mutating):
+        return self.mutating_cost if mutating else self.query_cost
+
+    def allow(self, mask, mutating=False):
+        """Take the tokens for a command from the bucket of mask. Tells whether they were taken."""
+        if self.bucket(mask).consume(self.cost(mutating)):
+            self.refused.discard(mask)
+            return True
+        self.refused.add(mask)
+        return False
+
+    def delay(self, mask, mutating=False):
+        """Seconds until mask may run a command again."""
+        return self.bucket(mask).delay(self.cost(mutating))
@@ -0,0 +1,111 @@
+import asyncio
+import inspect
+import random
+
+
+class Backoff:
+    """Exponentially growing delays with random jitter, capped at maximum."""
+
+    def __init__(self, base=1.0, factor=2.0, maximum=300.0, jitter=0.5, rand=random.random):
+        self.base = base
+        self.factor = factor
+        self.maximum = maximum
+        self.jitter = jitter
+        self.rand = rand
+        self.attempts = 0
+
+    def next(self):
+        """Delay before the next attempt."""
+        delay = min(self.maximum, self.base * self.factor ** self.attempts)
+        self.attempts += 1
+        return delay * (1 - self.jitter * self.rand())
+
+    def reset(self):
+        self.attempts = 0
+
+
+class ReconnectSupervisor:
+    """
+    Keeps a connection up. Connection attempts are run as scheduled tasks
+    spaced by a backoff, never from inside the disconnect handler, and
+    never give up until stop() is called. connect may return the connection
+    or an awaitable of it. The backoff only starts over once the server
+    registers us, see registered(), so that a server accepting the
+    connection and dropping it at once is not retried in a tight loop.
+    """
+
+    connecting = "connecting"
+    connected = "connected"
+    stopped = "stopped"
+
+    def __init__(self, connect, call_later, on_connected, backoff=None):
+        self.connect = connect
+        self.call_later = call_later
+        self.on_connected = on_connected
+        self.backoff = backoff or Backoff()
+        self.state = ReconnectSupervisor.connecting
+        self.pending = False
+
+    def start(self):
+        self.state = ReconnectSupervisor.connecting
+        self._schedule(0)
+
+    def lost(self):
+        """The connection went down: try again later, unless stopped."""
+        if self.state == ReconnectSupervisor.stopped:
+            return
+        self.state = ReconnectSupervisor.connecting
+        self._schedule(self.backoff.next())
+
+    def stop(self):
+        self.state = ReconnectSupervisor.stopped
+
+    def registered(self):
+        """The server welcomed us: the next loss starts the backoff over."""
+        self.backoff.reset()
+
+    def is_connected(self):
+        return self.state == ReconnectSupervisor.connected
+
+    def _schedule(self, delay):
+        if self.pending:
+            return
+        self.pending = True
+        print("Connecting in {0:.1f}s.".format(delay))
+        self.call_later(delay, self._attempt)
+
+    def _attempt(self):
+        self.pending = False
+        if self.state != ReconnectSupervisor.connecting:
+            return
+        print("Connection attempt: " + str(self.backoff.attempts))
+        try:
+            result = self.connect()
+        except Exception as ex:
+            print("Connection failed: " + str(ex))
+            self._failed()
+            return
+        if inspect.isawaitable(result):
+            asyncio.ensure_future(result).add_done_callback(self._done)
+        else:
+            self._succeeded(result)
+
+    def _done(self, future):
+        if future.cancelled() or future.exception() is not None:
+            if not future.cancelled():
+                print("Connection failed: " + str(future.exception()))
+            self._failed()
+        else:
+            self._succeeded(future.result())
+
+    def _succeeded(self, connection):
+        if self.state == ReconnectSupervisor.stopped:
+            return
+        print("Connected.")
+        self.state = ReconnectSupervisor.connected
+        self.on_connected(connection)
+
+    def _failed(self):
+        if self.state == ReconnectSupervisor.stopped:
+            return
+        self._schedule(self.backoff.next())
@@ -0,0 +1,69 @@
+import queue
+import threading
+from collections import deque
+
+
+class CommandQueue:
+    """
+    Jobs waiting for the engine, in a lane for reads and a lane for writes.
+    Writes are taken in the order they were put. Reads are taken ahead of
+    waiting writes, but no more than read_burst in a row while a write
+    waits, so neither kind holds the other up for long. Jobs run one at a
+    time, so a read always sees the state left by whole writes.
+
+    Jobs may name their owner, such as the host mask of the sender. A read
+    whose owner has jobs waiting in the write lane goes there too, behind
+    them, so that nobody reads the state from before their own writes.
+    """
+
+    def __init__(self, maxsize=0, read_burst=4):
+        self.maxsize = maxsize
+        self.read_burst = read_burst
+        self.reads = deque()
+        # (job, owner) of the writes, and of the reads queued behind writes of their owner.
+        self.writes = deque()
+        # Jobs in the write lane by owner.
+        self.owners = {}
+        self.reads_in_row = 0
+        self.closed = False
+        self.ready = threading.Condition()
+
+    def put(self, job, read=False, bounded=True, owner=None):
+        """Queue job of owner. Raises queue.Full if bounded and maxsize jobs are waiting already."""
+        with self.ready:
+            if bounded and self.maxsize and self.qsize() >= self.maxsize:
+                raise queue.Full
+            if read and not self.owners.get(owner):
+                self.reads.append(job)
+            else:
+                self.writes.append((job, owner))
+                if owner is not None:
+                    self.owners[owner] = self.owners.get(owner, 0) + 1
+            self.ready.notify()
+
+    def get(self):
+        """Next job to run, waiting for one. None once closed and empty."""
+        with self.ready:
+            while not self.reads and not self.writes:
+                if self.closed:
+                    return None
+                self.ready.wait()
+            if self.reads and (not self.writes or self.reads_in_row < self.read_burst):
+                self.reads_in_row += 1
+                return self.reads.popleft()
+            self.reads_in_row = 0
+            job, owner = self.writes.popleft()
+            if owner is not None:
+                self.owners[owner] -= 1
+                if not self.owners[owner]:
+                    del self.owners[owner]
+            return job
+
+    def close(self):
+        """Let get() return None once the jobs already queued are taken."""
+        with self.ready:
+            self.closed = True
+            self.ready.notify_all()
+
+    def qsize(self):
+        return len(self.reads) + len(self.writes)
@@ -0,0 +1,67 @@
+import pytest
+
+from ircfacade.cache import ResponseCache
+
+
+def test_replays_while_versions_unchanged():
+    cache = ResponseCache()
+    state = {"version": 0, "calls": 0}
+
+    @cache.cached(lambda s, e: state["version"])
+    def do_query(s, e, respond):
+        """Query."""
+        state["calls"] += 1
+        respond("first " + " ".join(s))
+        respond("second")
+
+    out = []
+    do_query(["a"], None, out.append)
+    do_query(["a"], None, out.append)
+    assert out == ["first a", "second", "first a", "second"]
+    assert state["calls"] == 1
+    do_query(["b"], None, out.append)
+    assert state["calls"] == 2
+    state["version"] += 1
+    do_query(["a"], None, out.append)
+    assert state["calls"] == 3
+    assert (cache.hits, cache.misses) == (1, 3)
+    assert do_query.__doc__ == "Query."
+
+
+def test_replays_errors():
+    cache = ResponseCache()
+    calls = []
+
+    @cache.cached(lambda s, e: 0)
+    def do_query(s, e, respond):
+        calls.append(s)
+        raise ValueError("No such claim.")
+
+    for _ in range(2):
+        with pytest.raises(ValueError) as ex:
+            do_query(["x"], None, print)
+        assert str(ex.value) == "No such claim."
+    assert len(calls) == 1
+
+
+def test_key():
+    cache = ResponseCache()
+
+    @cache.cached(lambda s, e: 0, key=lambda s, e: e)
+    def do_query(s, e, respond):
+        respond(e)
+
+    out = []
+    do_query([], "alice", out.append)
+    do_query([], "bob", out.append)
+    assert out == ["alice", "bob"]
+
+
+def test_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2)
+    cache.store("a", 0, ["a"])
+    cache.store("b", 0, ["b"])
+    assert cache.lookup("a", 0) is not None
+    cache.store("c", 0, ["c"])
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.lookup("a", 1) is None
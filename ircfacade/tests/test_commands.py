@@ -0,0 +1,111 @@
+from collections import Counter
+
+import pytest
+
+from ircfacade.commands import CommandRegistry, AmbiguousCommand, NoMatchingCommand, Command, Throttled
+from ircfacade.ratelimit import RateLimiter
+from ircfacade import commands
+
+
+def handler(s, e, respond):
+    respond(s)
+
+
+def test_registry_find():
+    r = CommandRegistry()
+    for i in ["cancel", "cash", "claims", "buy"]:
+        r.reg(i, handler)
+    assert r.find("ca") == ["cancel", "cash"]
+    assert r.find("b") == ["buy"]
+    assert r.find("cash") == ["cash"]
+    assert r.find("z") == []
+
+
+def test_prepare(monkeypatch):
+    r = CommandRegistry()
+    for i in ["cancel", "cash", "buy"]:
+        r.reg(i, handler)
+    monkeypatch.setattr(commands, "registry", r)
+    c = commands.prepare("$b claim y 50 10")
+    assert c.command == "buy"
+    assert c.args == ["claim", "y", "50", "10"]
+    with pytest.raises(AmbiguousCommand) as ex:
+        commands.prepare("$ca")
+    assert ex.value.commands == ["cancel", "cash"]
+    with pytest.raises(NoMatchingCommand):
+        commands.prepare("$sell")
+
+
+class Event:
+    def __init__(self, source):
+        self.source = source
+
+
+class Source:
+    host = "unaffiliated/xeno"
+
+
+def test_admit(monkeypatch):
+    r = CommandRegistry()
+    r.reg("cash", handler)
+    monkeypatch.setattr(commands, "registry", r)
+    monkeypatch.setattr(commands, "limiter", RateLimiter(rate=0.001, capacity=1))
+    monkeypatch.setattr(commands, "stats", Counter())
+    e = Event(Source())
+    commands.admit(Command("cash", []), e)
+    with pytest.raises(Throttled) as ex:
+        commands.admit(Command("cash", []), e)
+    assert not ex.value.quiet
+    with pytest.raises(Throttled) as ex:
+        commands.admit(Command("cash", []), e)
+    assert ex.value.quiet
+    assert commands.stats["throttled"] == 2
+    # The same host on another network is someone else.
+    e.network = "other"
+    commands.admit(Command("cash", []), e)
+
+
+def test_invalid_commands_are_charged(monkeypatch):
+    from irc.client import NickMask
+    from ircfacade.ircclient import IrcConnection
+
+    class Settings:
+        def __getattr__(self, name):
+            return lambda: 1
+
+    class Line:
+        source = NickMask("xeno!~xeno@unaffiliated/xeno")
+        target = "xenobook"
+
+        def __init__(self, line):
+            self.arguments = [line]
+
+    r = CommandRegistry()
+    r.reg("cash", handler)
+    monkeypatch.setattr(commands, "registry", r)
+    monkeypatch.setattr(commands, "limiter", RateLimiter(rate=0.001, capacity=2))
+    monkeypatch.setattr(commands, "stats", Counter())
+    connection = IrcConnection(None, Settings(), None, commands, "net")
+    out = []
+    monkeypatch.setattr(connection, "respond", lambda e, m: out.append(m))
+    monkeypatch.setattr(connection, "dispatch", lambda command, e, respond: out.append(command.command))
+    for line in ("$zz", "$zz", "$zz", "$zz", "$cash"):
+        connection.handle(Line(line))
+    assert out == ["Invalid command: zz", "Invalid command: zz",
+                   "Too many commands, your command was not run. Try again in 1000s."]
+    assert commands.stats["throttled"] == 3
+
+
+def test_kinds():
+    r = CommandRegistry()
+    r.reg("cash", commands.read(lambda s, e, respond: None))
+    r.reg("buy", commands.trade(lambda s, e, respond: None))
+    r.reg("judge", commands.admin(lambda s, e, respond: None))
+    r.reg("help", handler)
+    assert r.kind("cash") == commands.READ
+    assert r.kind("buy") == commands.TRADE
+    assert r.kind("judge") == commands.ADMIN
+    assert r.kind("help") == commands.READ
+    assert not r.is_mutating("cash")
+    assert r.is_mutating("buy")
+    assert r.is_mutating("judge")
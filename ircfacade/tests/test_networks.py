@@ -0,0 +1,27 @@
+import pytest
+
+from ircfacade.networks import Networks
+
+
+def test_freenode():
+    auth = Networks.get("freenode").get_auth_service()
+    assert auth.is_auth_request("NickServ!NickServ@services.", "Please identify via /msg NickServ identify")
+    assert auth.is_auth_confirmation("NickServ!NickServ@services.", "You are now identified for xenobook.")
+    assert not auth.is_auth_confirmation("xeno!~xeno@host", "You are now identified for xenobook.")
+
+
+def test_libera():
+    auth = Networks.get("libera").get_auth_service()
+    assert auth.is_auth_request("NickServ!NickServ@services.libera.chat", "or identify via /msg NickServ")
+    assert not auth.is_auth_request("NickServ!NickServ@services.", "or identify via /msg NickServ")
+
+
+def test_unauthenticated():
+    network = Networks.get("none")
+    assert not network.needs_auth
+    assert not network.get_auth_service().is_auth_request("NickServ!NickServ@services.", "identify via")
+
+
+def test_unknown():
+    with pytest.raises(ValueError):
+        Networks.get("efnet")
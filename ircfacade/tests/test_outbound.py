@@ -0,0 +1,144 @@
+import pytest
+
+from ircfacade.outbound import (Coalescer, SendQueue, TokenBucket, chunk_message, line_budget, guess_prefix,
+                                pack_messages, MAX_LINE)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_line_budget():
+    prefix = "bot!~bot@host"
+    budget = line_budget(prefix, "#chan")
+    assert budget + len(":bot!~bot@host PRIVMSG #chan :\r\n") == MAX_LINE
+    assert line_budget(guess_prefix("bot"), "#chan") < budget
+
+
+def test_short_message_is_one_chunk():
+    assert list(chunk_message("hello world", 100)) == ["hello world"]
+
+
+def test_chunks_respect_budget():
+    words = ["word" + str(i) for i in range(500)]
+    m = " ".join(words)
+    chunks = list(chunk_message(m, 50))
+    assert all(len(c.encode("latin-1")) <= 50 for c in chunks)
+    assert " ".join(chunks) == m
+
+
+def test_chunks_count_bytes_not_characters():
+    m = " ".join(["été"] * 100)
+    chunks = list(chunk_message(m, 20, encoding="utf-8"))
+    assert all(len(c.encode("utf-8")) <= 20 for c in chunks)
+    assert " ".join(chunks) == m
+
+
+def test_chunks_fit_on_the_wire():
+    """Lines are measured as they are sent, in utf-8, and never cut inside a character."""
+    m = "claim: " + "\u00e9" * 500
+    budget = line_budget(guess_prefix("xenobook"), "##xenobook")
+    chunks = list(chunk_message(m, budget))
+    assert all(len(c.encode("utf-8")) <= budget for c in chunks)
+    assert "".join(chunks).replace(" ", "") == m.replace(" ", "")
+
+
+def test_chunk_budget_must_be_positive():
+    for budget in (0, -5):
+        with pytest.raises(ValueError):
+            list(chunk_message("hello world", budget))
+    with pytest.raises(ValueError):
+        list(chunk_message("\u00e9", 1))
+
+
+def test_long_words_are_cut():
+    m = "a" * 25 + " b"
+    chunks = list(chunk_message(m, 10))
+    assert chunks == ["a" * 10, "a" * 10, "a" * 5 + " b"]
+
+
+def test_token_bucket():
+    clock = Clock()
+    bucket = TokenBucket(rate=2, capacity=3, clock=clock)
+    assert all(bucket.consume() for i in range(3))
+    assert not bucket.consume()
+    assert bucket.delay() == 0.5
+    clock.now = 0.5
+    assert bucket.consume()
+    clock.now = 100
+    bucket.consume()
+    assert bucket.tokens == 2
+
+
+def test_send_queue_paces_and_prioritises():
+    clock = Clock()
+    sent = []
+    queue = SendQueue(lambda t, m: sent.append((t, m)), TokenBucket(rate=1, capacity=2, clock=clock))
+    for i in range(3):
+        queue.put("#chan", "public" + str(i))
+    queue.put("nick", "private", private=True)
+    assert queue.pump() == 1
+    assert sent == [("nick", "private"), ("#chan", "public0")]
+    clock.now = 1
+    assert queue.pump() == 1
+    clock.now = 2
+    assert queue.pump() is None
+    assert len(queue) == 0
+    assert [m for t, m in sent] == ["private", "public0", "public1", "public2"]
+
+
+def test_pack_messages_shares_lines():
+    lines = list(pack_messages(["one", "two", "three"], 100))
+    assert lines == ["one | two | three"]
+    lines = list(pack_messages(["aaaa", "bbbb", "cccc"], 11))
+    assert lines == ["aaaa | bbbb", "cccc"]
+
+
+def test_pack_messages_chunks_long_messages():
+    m = " ".join(["word"] * 50)
+    lines = list(pack_messages([m, "end"], 40))
+    assert all(len(l) <= 40 for l in lines)
+    assert lines[-1].endswith("end")
+
+
+def test_coalescer():
+    c = Coalescer()
+    c.add("#chan", "a")
+    c.add("nick", "b", private=True)
+    c.add("#chan", "c")
+    assert len(c) == 2
+    assert c.drain() == [("#chan", ["a", "c"], False), ("nick", ["b"], True)]
+    assert c.drain() == []
+
+
+def test_send_queue_multiple_targets():
+    sent = []
+    queue = SendQueue(lambda t, m: sent.append((t, m)), TokenBucket(rate=1, capacity=10), max_targets=2)
+    for target in ["#a", "#b", "#c"]:
+        queue.put(target, "news")
+    queue.put("#a", "other")
+    queue.pump()
+    assert sent == [("#a,#b", "news"), ("#c", "news"), ("#a", "other")]
+
+
+def test_send_queue_keeps_order_per_target():
+    sent = []
+    queue = SendQueue(lambda t, m: sent.append((t, m)), TokenBucket(rate=1, capacity=10), max_targets=3)
+    queue.put("#a", "news")
+    queue.put("#b", "first")
+    queue.put("#b", "news")
+    queue.put("#c", "news")
+    queue.pump()
+    assert sent == [("#a,#c", "news"), ("#b", "first"), ("#b", "news")]
+
+
+def test_coalescer_keeps_private_apart():
+    c = Coalescer()
+    c.add("nick", "public")
+    c.add("nick", "private", private=True)
+    c.add("nick", "public again")
+    assert c.drain() == [("nick", ["public", "public again"], False), ("nick", ["private"], True)]
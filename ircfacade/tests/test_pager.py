@@ -0,0 +1,82 @@
+import pytest
+
+from ircfacade.pager import Pager, split_filters
+
+
+class Source:
+    host = "unaffiliated/xeno"
+
+
+class Event:
+    def __init__(self):
+        self.source = Source()
+
+    @staticmethod
+    def on(network):
+        e = Event()
+        e.network = network
+        return e
+
+
+def test_pages():
+    pager = Pager(page_size=2)
+    e = Event()
+    assert pager.format(iter(range(5)), e, "Empty.") == "0 and 1 ($more for more)"
+    e.page = 2
+    assert pager.format(iter(range(5)), e, "Empty.") == "4"
+    e.page = 3
+    with pytest.raises(ValueError, match="Nothing more"):
+        pager.format(iter(range(5)), e, "Empty.")
+    with pytest.raises(ValueError, match="Empty."):
+        pager.format([], Event(), "Empty.")
+
+
+def test_more_follows_the_cursor():
+    pager = Pager(page_size=2)
+    seen = []
+
+    @pager.paged
+    def do_list(s, e, respond):
+        """List."""
+        respond(pager.format(range(int(s[0])), e, "Empty."))
+
+    with pytest.raises(ValueError):
+        pager.more(Event(), seen.append)
+    do_list(["5"], Event(), seen.append)
+    pager.more(Event(), seen.append)
+    pager.more(Event(), seen.append)
+    assert seen == ["0 and 1 ($more for more)", "2 and 3 ($more for more)", "4"]
+    assert do_list.__doc__ == "List."
+
+
+def test_forgets_oldest_cursors():
+    pager = Pager(max_cursors=1)
+    pager.paged(lambda s, e, respond: None)([], Event(), print)
+    other = Event()
+    other.source = type("Other", (), {"host": "other"})()
+    pager.paged(lambda s, e, respond: None)([], other, print)
+    assert list(pager.cursors) == [(None, "other")]
+
+
+def test_cursors_are_per_network():
+    pager = Pager(page_size=2)
+    seen = []
+
+    @pager.paged
+    def do_list(s, e, respond):
+        respond(pager.format(range(int(s[0])), e, "Empty."))
+
+    do_list(["5"], Event.on("a"), seen.append)
+    do_list(["3"], Event.on("b"), seen.append)
+    pager.more(Event.on("a"), seen.append)
+    pager.more(Event.on("b"), seen.append)
+    assert seen == ["0 and 1 ($more for more)", "0 and 1 ($more for more)", "2 and 3 ($more for more)", "2"]
+    with pytest.raises(ValueError):
+        pager.more(Event(), seen.append)
+
+
+def test_split_filters():
+    assert split_filters(["xeno", "prefix=ab", "side=y"], ["prefix", "side"]) == (["xeno"],
+                                                                                  {"prefix": "ab", "side": "y"})
+    with pytest.raises(ValueError):
+        split_filters(["colour=red"], ["prefix"])
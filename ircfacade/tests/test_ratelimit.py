@@ -0,0 +1,38 @@
+from ircfacade.ratelimit import RateLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_buckets_per_hostmask():
+    clock = Clock()
+    limiter = RateLimiter(rate=1, capacity=2, clock=clock)
+    assert limiter.allow("a")
+    assert limiter.allow("a")
+    assert not limiter.allow("a")
+    assert "a" in limiter.refused
+    assert limiter.allow("b")
+    clock.now = 1.0
+    assert limiter.allow("a")
+    assert "a" not in limiter.refused
+
+
+def test_mutating_costs_more():
+    clock = Clock()
+    limiter = RateLimiter(rate=1, capacity=3, query_cost=1, mutating_cost=2, clock=clock)
+    assert limiter.allow("a", mutating=True)
+    assert not limiter.allow("a", mutating=True)
+    assert limiter.delay("a", mutating=True) == 1.0
+    assert limiter.allow("a")
+
+
+def test_forgets_oldest_hostmasks():
+    limiter = RateLimiter(rate=1, capacity=1, max_buckets=2, clock=Clock())
+    for mask in ["a", "b", "c"]:
+        assert limiter.allow(mask)
+    assert list(limiter.buckets) == ["b", "c"]
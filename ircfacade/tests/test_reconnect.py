@@ -0,0 +1,135 @@
+import asyncio
+
+from ircfacade.reconnect import Backoff, ReconnectSupervisor
+
+
+class Scheduler:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, delay, func):
+        self.calls.append((delay, func))
+
+    def run_next(self):
+        delay, func = self.calls.pop(0)
+        func()
+        return delay
+
+
+def test_backoff_grows_and_caps():
+    b = Backoff(base=1, factor=2, maximum=10, jitter=0)
+    assert [b.next() for i in range(6)] == [1, 2, 4, 8, 10, 10]
+    b.reset()
+    assert b.next() == 1
+
+
+def test_backoff_jitter():
+    b = Backoff(base=4, jitter=0.5, rand=lambda: 1.0)
+    assert b.next() == 2
+
+
+def test_supervisor_retries_until_connected():
+    attempts = []
+    connected = []
+
+    def connect():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise OSError("refused")
+        return "connection"
+
+    scheduler = Scheduler()
+    s = ReconnectSupervisor(connect, scheduler, connected.append, Backoff(jitter=0))
+    s.start()
+    assert scheduler.run_next() == 0
+    assert scheduler.run_next() == 1
+    assert scheduler.run_next() == 2
+    assert connected == ["connection"]
+    assert s.is_connected()
+    assert scheduler.calls == []
+
+
+def test_supervisor_reconnects_after_loss_and_stops():
+    scheduler = Scheduler()
+    connected = []
+    s = ReconnectSupervisor(lambda: "c", scheduler, connected.append, Backoff(jitter=0))
+    s.start()
+    scheduler.run_next()
+    s.lost()
+    assert not s.is_connected()
+    s.lost()
+    assert len(scheduler.calls) == 1
+    scheduler.run_next()
+    assert connected == ["c", "c"]
+    s.stop()
+    s.lost()
+    assert scheduler.calls == []
+
+
+def test_supervisor_awaits_coroutines():
+    loop = asyncio.new_event_loop()
+    connected = []
+    attempts = []
+
+    async def connect():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise OSError("refused")
+        return "c"
+
+    def call_later(delay, func):
+        loop.call_later(0, func)
+
+    def on_connected(c):
+        connected.append(c)
+        loop.stop()
+
+    s = ReconnectSupervisor(connect, call_later, on_connected)
+    loop.call_soon(s.start)
+    loop.call_later(5, loop.stop)
+    loop.run_forever()
+    loop.close()
+    assert connected == ["c"]
+    assert len(attempts) == 2
+
+
+def test_backoff_starts_over_only_once_registered():
+    """A server dropping the bot right after accepting it is retried ever more slowly."""
+    scheduler = Scheduler()
+    s = ReconnectSupervisor(lambda: "c", scheduler, lambda c: None, Backoff(jitter=0))
+    s.start()
+    scheduler.run_next()
+    delays = []
+    for i in range(4):
+        s.lost()
+        delays.append(scheduler.run_next())
+    assert delays == [1, 2, 4, 8]
+    s.registered()
+    s.lost()
+    assert scheduler.run_next() == 1
+
+
+def test_reconnections_reuse_the_server_connection():
+    from ircfacade.ircclient import IrcConnection
+
+    class Connection:
+        def connect(self, server, port, nick):
+            return self
+
+    class Reactor:
+        def __init__(self):
+            self.connections = []
+
+        def server(self):
+            self.connections.append(Connection())
+            return self.connections[-1]
+
+    class Settings:
+        def __getattr__(self, name):
+            return lambda: 1
+
+    reactor = Reactor()
+    connection = IrcConnection(reactor, Settings(), None, None, "net")
+    first = connection.connect_to_server()
+    assert connection.connect_to_server() is first
+    assert len(reactor.connections) == 1
@@ -0,0 +1,53 @@
+import queue
+
+import pytest
+
+from ircfacade.scheduler import CommandQueue
+
+
+def test_writes_keep_their_order():
+    q = CommandQueue()
+    for i in range(5):
+        q.put(i)
+    assert [q.get() for _ in range(5)] == list(range(5))
+
+
+def test_reads_are_bounded_by_read_burst():
+    q = CommandQueue(read_burst=1)
+    q.put("w0")
+    q.put("w1")
+    q.put("r0", read=True)
+    q.put("r1", read=True)
+    q.put("r2", read=True)
+    assert [q.get() for _ in range(5)] == ["r0", "w0", "r1", "w1", "r2"]
+
+
+def test_full():
+    q = CommandQueue(maxsize=1)
+    q.put("w0")
+    with pytest.raises(queue.Full):
+        q.put("r0", read=True)
+    q.put("w1", bounded=False)
+    assert q.qsize() == 2
+
+
+def test_close_after_queued_jobs():
+    q = CommandQueue()
+    q.put("w0")
+    q.close()
+    assert q.get() == "w0"
+    assert q.get() is None
+
+
+def test_reads_wait_for_writes_of_their_owner():
+    q = CommandQueue(read_burst=4)
+    q.put("buy", owner="xeno")
+    q.put("cash", read=True, owner="xeno")
+    q.put("coupons", read=True, owner="xeno")
+    q.put("ticker", read=True, owner="other")
+    assert [q.get() for _ in range(4)] == ["ticker", "buy", "cash", "coupons"]
+    assert q.owners == {}
+    # Once the writes ran, reads of xeno are served ahead of writes again.
+    q.put("sell", owner="other")
+    q.put("cash", read=True, owner="xeno")
+    assert [q.get() for _ in range(2)] == ["cash", "sell"]
@@ -0,0 +1,68 @@
+import threading
+
+from ircfacade.worker import EngineWorker
+
+
+def test_runs_jobs_in_order_on_one_thread():
+    worker = EngineWorker()
+    worker.start()
+    seen = []
+    threads = set()
+
+    def job(i):
+        seen.append(i)
+        threads.add(threading.current_thread().name)
+
+    for i in range(100):
+        worker.submit(job, i)
+    worker.stop(timeout=5)
+    assert seen == list(range(100))
+    assert threads == {"engine"}
+
+
+def test_survives_failing_jobs():
+    worker = EngineWorker()
+    worker.start()
+    seen = []
+
+    def fail():
+        raise ValueError("boom")
+
+    worker.submit(fail)
+    worker.submit(seen.append, 1)
+    worker.stop(timeout=5)
+    assert seen == [1]
+
+
+def test_is_worker_thread():
+    worker = EngineWorker()
+    worker.start()
+    result = []
+    worker.submit(lambda: result.append(worker.is_worker_thread()))
+    worker.stop(timeout=5)
+    assert result == [True]
+    assert not worker.is_worker_thread()
+
+
+def test_offer_sheds_reads_first():
+    worker = EngineWorker(maxsize=3, shed_at=1)
+    assert worker.offer(print, "query", read=True)
+    assert not worker.offer(print, "query", read=True)
+    assert worker.offer(print, "trade")
+    assert worker.offer(print, "trade")
+    assert not worker.offer(print, "trade")
+    assert worker.backlog() == 3
+    worker.submit(print, "admin")
+    assert worker.backlog() == 4
+
+
+def test_reads_overtake_writes():
+    worker = EngineWorker(read_burst=2)
+    seen = []
+    for i in range(3):
+        worker.submit(seen.append, "w" + str(i))
+    for i in range(3):
+        worker.submit(seen.append, "r" + str(i), read=True)
+    worker.start()
+    worker.stop(timeout=5)
+    assert seen == ["r0", "r1", "w0", "r2", "w1", "w2"]
@@ -0,0 +1,63 @@
+import queue
+import threading
+import traceback
+
+from ircfacade.scheduler import CommandQueue
+
+
+class EngineWorker:
+    """
+    Single thread running engine commands one at a time, away from the
+    thread that does network I/O. Writes run in the order they were
+    submitted; reads are scheduled around them, see CommandQueue.
+    """
+
+    def __init__(self, maxsize=0, shed_at=None, read_burst=4):
+        self.queue = CommandQueue(maxsize, read_burst)
+        # Backlog from which reads are refused.
+        self.shed_at = shed_at
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="engine", daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args, read=False, owner=None):
+        """Queue func(*args) to run on the worker, however long the queue. See CommandQueue for owner."""
+        self.queue.put((func, args), read, bounded=False, owner=owner)
+
+    def offer(self, func, *args, read=False, owner=None):
+        """
+        Queue func(*args) unless the queue is full, or, for a read, holds
+        shed_at jobs already. Tells whether it was queued.
+        """
+        if read and self.shed_at is not None and self.queue.qsize() >= self.shed_at:
+            return False
+        try:
+            self.queue.put((func, args), read, owner=owner)
+        except queue.Full:
+            return False
+        return True
+
+    def backlog(self):
+        return self.queue.qsize()
+
+    def stop(self, timeout=None):
+        """Finish the commands already queued, then stop."""
+        self.queue.close()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            func, args = job
+            try:
+                func(*args)
+            except Exception:
+                traceback.print_exc()
+
+    def is_worker_thread(self):
+        return threading.current_thread() is self.thread
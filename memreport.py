@@ -0,0 +1,17 @@
+# Print the memory footprint of a saved market state.
+# Usage: python memreport.py [status.txt] [claims.txt]
+import sys
+import tracemalloc
+
+import ircbook
+
+
+def main(status_file="status.txt", claims_file="claims.txt"):
+    tracemalloc.start()
+    ircbook.users = ircbook.load_users(status_file)
+    ircbook.claims = ircbook.load_claims(claims_file)
+    print(ircbook.memory_report())
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:3])
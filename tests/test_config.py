@@ -1,4 +1,11 @@
-from config import Configuration
+import json
+import os
+import pickle
+
+import pytest
+
+from config import Configuration, Settings
+from ircfacade.ircclient import IrcClient
 
 
 def test_active_channels():
@@ -18,3 +25,145 @@ def test_channels():
     config.add_channel('#bar')
     assert config.get_channels() == ["#foo", '#bar']
     assert config.has_channel("#foo")
+
+
+def test_owners():
+    config = Configuration({'owners': ['xeno!~xeno@host']})
+    assert config.is_owner('xeno!~xeno@host')
+    assert not config.is_owner('other!~other@host')
+    assert isinstance(config.owners, frozenset)
+
+
+def test_owners_per_network():
+    config = Configuration({'home_network': 'a', 'owners': ['xeno!~xeno@host'], 'networks': {
+        'a': {}, 'b': {}, 'c': {'owners': ['other!~other@host']}}})
+    assert config.is_owner('xeno!~xeno@host')
+    assert config.is_owner('xeno!~xeno@host', 'a')
+    assert not config.is_owner('xeno!~xeno@host', 'b')
+    assert not config.is_owner('xeno!~xeno@host', 'c')
+    assert config.is_owner('other!~other@host', 'c')
+    assert not config.is_owner('other!~other@host', 'a')
+    assert not config.is_owner('xeno!~xeno@host', 'efnet')
+
+
+def test_save_and_load_json(tmpdir):
+    path = str(tmpdir.join("conf"))
+    config = Configuration({'channels': ['#foo'], 'active_channels': [], 'owners': []})
+    config.config_file = path
+    config.add_channel('#bar')
+    config.save()
+    with open(path) as f:
+        assert json.load(f)['channels'] == ['#foo', '#bar']
+    loaded = Configuration(path)
+    assert loaded.get_channels() == ['#foo', '#bar']
+    assert not loaded.changed()
+
+
+def test_load_legacy_pickle(tmpdir):
+    path = str(tmpdir.join("conf"))
+    with open(path, "wb") as f:
+        pickle.dump({'channels': ['#foo'], 'active_channels': ['#foo'], 'owners': []}, f)
+    config = Configuration(path)
+    assert config.has_active_channel('#foo')
+
+
+def test_reload(tmpdir):
+    path = str(tmpdir.join("conf"))
+    with open(path, "w") as f:
+        json.dump({'channels': ['#foo', '#bar'], 'active_channels': [], 'owners': []}, f)
+    config = Configuration(path)
+    with open(path, "w") as f:
+        json.dump({'channels': ['#bar', '#baz'], 'active_channels': ['#baz'], 'owners': []}, f)
+    os.utime(path, (0, 0))
+    assert config.changed()
+    joined, left = config.reload()
+    assert joined == {'#baz'}
+    assert left == {'#foo'}
+    assert config.has_active_channel('#baz')
+    assert not config.changed()
+
+
+def test_single_network():
+    config = Configuration({'nick': 'xenobook', 'channels': ['#foo'], 'active_channels': []})
+    assert config.network_names() == ['default']
+    settings = config.network('default')
+    assert settings.nick() == 'xenobook'
+    settings.add_channel('#bar')
+    assert config.get_channels() == ['#foo', '#bar']
+    assert settings.has_channel('#bar')
+
+
+def test_networks():
+    config = Configuration({'nick': 'xenobook', 'send_rate': 2.0, 'owners': [], 'networks': {
+        'freenode': {'server': 'chat.freenode.net', 'channels': ['#foo'], 'active_channels': []},
+        'libera': {'server': 'irc.libera.chat', 'nick': 'ircbook', 'auth': 'libera', 'channels': []}}})
+    assert sorted(config.network_names()) == ['freenode', 'libera']
+    freenode = config.network('freenode')
+    libera = config.network('libera')
+    assert freenode.nick() == 'xenobook'
+    assert libera.nick() == 'ircbook'
+    assert libera.send_rate() == 2.0
+    assert freenode.auth() == 'freenode'
+    assert libera.auth() == 'libera'
+    libera.add_channel('#bar')
+    libera.add_active_channel('#bar')
+    assert libera.has_active_channel('#bar')
+    assert not freenode.has_channel('#bar')
+    with pytest.raises(ValueError):
+        config.network('efnet')
+
+
+def test_reload_networks(tmpdir):
+    path = str(tmpdir.join("conf"))
+    with open(path, "w") as f:
+        json.dump({'networks': {'a': {'channels': ['#foo']}, 'b': {'channels': []}}}, f)
+    config = Configuration(path)
+    a = config.network('a')
+    with open(path, "w") as f:
+        json.dump({'networks': {'a': {'channels': ['#foo', '#bar']}, 'c': {'channels': []}}}, f)
+    config.reload()
+    assert sorted(config.network_names()) == ['a', 'c']
+    assert config.network('a') is a
+    assert a.has_channel('#bar')
+
+
+def test_load_legacy_pickle_protocols(tmpdir):
+    path = str(tmpdir.join("conf"))
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        with open(path, "wb") as f:
+            pickle.dump({'channels': ['#foo'], 'owners': []}, f, protocol)
+        assert Configuration(path).get_channels() == ['#foo']
+
+
+def test_bad_edit_is_retried(tmpdir):
+    path = str(tmpdir.join("conf"))
+    with open(path, "w") as f:
+        json.dump({'channels': ['#foo'], 'active_channels': [], 'owners': []}, f)
+    config = Configuration(path)
+    with open(path, "w") as f:
+        f.write('{"channels": ["#foo", "#bar"],, "owners": []}')
+    os.utime(path, (0, 0))
+    with pytest.raises(ValueError):
+        config.reload()
+    assert config.get_channels() == ['#foo']
+    assert config.changed()
+    # The client logs it, keeps the old configuration and tries again later.
+    client = IrcClient(config)
+    client.check_config()
+    assert config.get_channels() == ['#foo']
+    with open(path, "w") as f:
+        json.dump({'channels': ['#foo', '#bar'], 'active_channels': [], 'owners': []}, f)
+    os.utime(path, (1, 1))
+    client.check_config()
+    assert config.get_channels() == ['#foo', '#bar']
+    assert not config.changed()
+
+
+def test_settings_is_abstract():
+    with pytest.raises(TypeError):
+        Settings()
+
+
+def test_home_network():
+    assert Configuration({}).home_network() == 'default'
+    assert Configuration({'home_network': 'libera'}).home_network() == 'libera'
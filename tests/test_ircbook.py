@@ -0,0 +1,228 @@
+import threading
+from datetime import timedelta
+from decimal import Decimal as D
+
+import pytest
+from irc.client import NickMask
+
+from ircfacade import commands
+from ircfacade.commands import Command, WarmingUp
+from trading.orderbook import Order
+from util.auditlog import AuditLog
+from util.dateutils import clock
+
+
+class Event:
+    def __init__(self, source):
+        self.source = NickMask(source)
+        self.target = "#ircbook"
+
+
+def test_import_has_no_side_effects(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    import ircbook
+    assert ircbook.config is None
+    assert ircbook.users is None
+    assert tmpdir.listdir() == []
+
+
+def test_warming_up(tmpdir, monkeypatch):
+    import ircbook
+    monkeypatch.setattr(commands, "ready", threading.Event())
+    monkeypatch.setattr(commands, "audit", AuditLog(str(tmpdir.join("log.txt"))))
+    e = Event("xeno!~xeno@unaffiliated/xeno")
+    with pytest.raises(WarmingUp):
+        commands.execute(Command("cash", []), e, print)
+    out = []
+    commands.execute(Command("help", ["cash"]), e, out.append)
+    assert out == [ircbook.do_cash.__doc__]
+    commands.audit.close(timeout=5)
+
+
+def claim(name, days, approved=True):
+    expires = clock.today() + timedelta(days=days)
+    return name, (expires.year, expires.month, expires.day), name, "u", approved, None, (2017, 1, 1)
+
+
+def test_claims_close_at_expiry(tmpdir, monkeypatch):
+    import ircbook
+    monkeypatch.chdir(tmpdir)
+    claims = ircbook.Claims([claim("later", 2), claim("gone", 0), claim("soon", 1), claim("new", 1, False)])
+    users = ircbook.Users()
+    monkeypatch.setattr(ircbook, "claims", claims)
+    monkeypatch.setattr(ircbook, "users", users)
+    monkeypatch.setattr(commands, "ready", threading.Event())
+    commands.ready.set()
+    assert [cl.name for cl in claims.open_claims()] == ["soon", "later"]
+    assert [cl.name for cl in claims.open_claims(clock.today() + timedelta(days=2))] == ["soon"]
+    assert not claims.is_open(claims.claims["gone"])
+    assert not claims.is_open(claims.claims["new"])
+    users.positions.add_portfolio("u")
+    p = users.positions.get_portfolio("u")
+    users.ob.add_order(Order("u", Order.bid, "gone", D(10), D(5)))
+    users.ob.add_order(Order("u", Order.bid, "soon", D(10), D(2)))
+    p.calc_risk(users.ob.get_by_account_id("u").risk.risk)
+    assert p.locked_cash == D(70)
+    ircbook.close_expired_claims()
+    assert p.locked_cash == D(20)
+    assert len(users.ob.get_by_account_id("u")) == 1
+    assert [cl.name for cl in claims.open] == ["soon", "later"]
+    # Accounts left without orders lock nothing.
+    users.ob.mass_cancel(account_id="u")
+    ircbook.update_locks({"u"})
+    assert p.locked_cash == D(0)
+
+
+def test_accounts_are_per_network():
+    import ircbook
+    users = ircbook.Users()
+    users.home_network = "freenode"
+    mask = "xeno!~xeno@unaffiliated/xeno"
+    assert users.identify(mask, "freenode").host == "unaffiliated/xeno"
+    assert users.identify(mask).host == "unaffiliated/xeno"
+    assert users.identify(mask, "libera").host == "unaffiliated/xeno@libera"
+    users.users["unaffiliated/xeno"] = ircbook.User("unaffiliated/xeno", True)
+    users.identities.clear()
+    assert users.identify(mask, "freenode").user is not None
+    assert users.identify(mask, "libera").user is None
+
+
+def test_failed_load_stops_the_bot(tmpdir, monkeypatch):
+    """A load that fails stops the client rather than leaving the bot warming up forever."""
+    import ircbook
+    from config import Configuration
+    from ircfacade.ircclient import IrcClient
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join("status.txt").write("{not json")
+    config = Configuration({"networks": {}, "owners": []})
+    monkeypatch.setattr(ircbook, "config", config)
+    monkeypatch.setattr(ircbook, "ircclient", IrcClient(config))
+    monkeypatch.setattr(commands, "ready", threading.Event())
+    app = ircbook.Application()
+    app.bootstrap()
+    assert isinstance(app.failure, ValueError)
+    assert not commands.ready.is_set()
+    assert ircbook.ircclient.stopping
+    monkeypatch.setattr(app, "configure", lambda: None)
+    monkeypatch.setattr(app, "bootstrap", lambda: None)
+    stopped = []
+    monkeypatch.setattr(ircbook, "on_shutdown", lambda: stopped.append(True))
+    with pytest.raises(SystemExit) as ex:
+        app.run()
+    assert "Could not load the state" in str(ex.value)
+    assert stopped == [True]
+
+
+def test_aio_client_stops_soon():
+    from config import Configuration
+    from ircfacade.aioclient import AioIrcClient
+    client = AioIrcClient(Configuration({"networks": {}, "owners": []}))
+    client.stop_soon()
+    stopped = []
+    client.run(commands, lambda: stopped.append(True))
+    assert stopped == [True]
+
+
+def test_no_amends_once_expired(tmpdir, monkeypatch):
+    """Orders of claims that expired but are not swept yet cannot be amended into trades."""
+    import ircbook
+    from trading.tradingengine import TradingEngine
+    monkeypatch.chdir(tmpdir)
+    claims = ircbook.Claims([claim("gone", 0)])
+    users = ircbook.Users()
+    users.users["unaffiliated/xeno"] = ircbook.User("unaffiliated/xeno", True)
+    users.positions.add_portfolio("unaffiliated/xeno")
+    users.ob.add_order(Order("unaffiliated/xeno", Order.bid, "gone", D(10), D(5)))
+    monkeypatch.setattr(ircbook, "claims", claims)
+    monkeypatch.setattr(ircbook, "users", users)
+    monkeypatch.setattr(ircbook, "engine", TradingEngine(users.ob, users.positions, users.trades))
+    e = Event("xeno!~xeno@unaffiliated/xeno")
+    with pytest.raises(ValueError, match="not open"):
+        ircbook.do_amend(["gone#0", "price=20"], e, print)
+    assert users.ob.get_order("gone", 0).price == D(10)
+
+
+def test_identity_cache(tmpdir, monkeypatch):
+    import ircbook
+    monkeypatch.chdir(tmpdir)
+    users = ircbook.Users()
+    monkeypatch.setattr(users, "identity_cache_size", 2)
+    mask = "xeno!~xeno@unaffiliated/xeno"
+    first = users.identify(mask)
+    assert first.user is None and first.nick == "xeno"
+    assert users.identify(mask) is first
+    # Registering clears the cache, so the new user is seen.
+    users.add(ircbook.User("unaffiliated/xeno", True))
+    assert users.identify(mask).user is users.users["unaffiliated/xeno"]
+    users.identify("a!~a@a")
+    assert len(users.identities) == 2
+    users.identify("b!~b@b")
+    assert list(users.identities) == [(None, "b!~b@b")]
+
+
+def test_nicks(tmpdir, monkeypatch):
+    import ircbook
+    monkeypatch.chdir(tmpdir)
+    users = ircbook.Users()
+    users.add(ircbook.User("unaffiliated/xeno", True))
+    users.set_nick("unaffiliated/xeno", "xeno")
+    assert users.get_user("xeno") is users.users["unaffiliated/xeno"]
+    users.set_nick("unaffiliated/xeno", "xeno2")
+    assert users.by_nick == {"xeno2": users.users["unaffiliated/xeno"]}
+    assert users.get_user("xeno2").name == "unaffiliated/xeno"
+    with pytest.raises(ValueError):
+        users.get_user("xeno")
+    # Nicks are saved and loaded with the users.
+    assert ircbook.load_users().get_user("xeno2").name == "unaffiliated/xeno"
+
+
+def test_cash_uses_the_sender(tmpdir, monkeypatch):
+    import ircbook
+    monkeypatch.chdir(tmpdir)
+    users = ircbook.Users()
+    users.add(ircbook.User("unaffiliated/xeno", True))
+    monkeypatch.setattr(ircbook, "users", users)
+    out = []
+    ircbook.do_cash([], Event("xeno!~xeno@unaffiliated/xeno"), out.append)
+    assert out == ["1000000 (1000000)"]
+    with pytest.raises(ValueError):
+        ircbook.do_cash([], Event("a!~a@elsewhere"), out.append)
+
+
+def test_owners_are_per_network(tmpdir, monkeypatch):
+    import ircbook
+    from config import Configuration
+    monkeypatch.chdir(tmpdir)
+    config = Configuration({"home_network": "a", "owners": ["xeno!~xeno@host"], "networks": {"a": {}, "b": {}}})
+    claims = ircbook.Claims([claim("c", 2, False)])
+    monkeypatch.setattr(ircbook, "config", config)
+    monkeypatch.setattr(ircbook, "claims", claims)
+    e = Event("xeno!~xeno@host")
+    e.network = "b"
+    out = []
+    ircbook.do_approve(["c"], e, out.append)
+    assert out == ["You lack appropriate permission."]
+    with pytest.raises(ValueError):
+        claims.approve(claims.claims["c"], e.source, e.network)
+    assert not claims.claims["c"].approved
+    e.network = "a"
+    ircbook.do_approve(["c"], e, out.append)
+    assert out[-1] == "Claim approved."
+    assert claims.claims["c"].approved
+
+
+def test_no_stale_missing_claims(tmpdir, monkeypatch):
+    import ircbook
+    from ircfacade.cache import ResponseCache
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr(ircbook, "claims", ircbook.Claims())
+    monkeypatch.setattr(ircbook, "users", ircbook.Users())
+    monkeypatch.setattr(commands.cache, "entries", ResponseCache().entries)
+    e = Event("xeno!~xeno@unaffiliated/xeno")
+    for handler in (ircbook.do_chart, ircbook.do_change):
+        with pytest.raises(ValueError, match="No such claim."):
+            handler(["foo"], e, print)
+    ircbook.claims.add(ircbook.Claim(*claim("foo", 2)))
+    for handler in (ircbook.do_chart, ircbook.do_change):
+        with pytest.raises(ValueError, match="No trades yet."):
+            handler(["foo"], e, print)
@@ -0,0 +1,212 @@
+# Copyright (c) 2016 the IrcBook team
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+from collections import deque
+from datetime import datetime, timedelta
+from decimal import Decimal as D
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class Bar:
+    """Open, high, low and close price and volume of the trades in one period."""
+
+    __slots__ = ("n", "open", "high", "low", "close", "volume", "value")
+
+    def __init__(self, n, price, shares):
+        # Number of the period since the epoch.
+        self.n = n
+        self.open = self.high = self.low = self.close = price
+        self.volume = shares
+        # Sum of price times shares, for the VWAP.
+        self.value = price * shares
+
+    def add(self, price, shares):
+        self.high = max(self.high, price)
+        self.low = min(self.low, price)
+        self.close = price
+        self.volume += shares
+        self.value += price * shares
+
+
+class BarSeries:
+    """
+    Bars of one resolution, a timedelta, in a ring of capacity slots, so
+    that the latest capacity periods are kept. The bar of period n is in
+    slot n % capacity; older bars are overwritten as newer periods come.
+    """
+
+    def __init__(self, resolution, capacity):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.ring = [None] * capacity
+        # Period of the latest bar, None before the first trade.
+        self.last = None
+
+    def period(self, time):
+        return (time - EPOCH) // self.resolution
+
+    def start(self, n):
+        """When period n starts."""
+        return EPOCH + n * self.resolution
+
+    def first(self):
+        """Oldest period still kept."""
+        return self.last - self.capacity + 1
+
+    def add(self, time, price, shares):
+        n = self.period(time)
+        if self.last is not None and n < self.first():
+            return
+        bar = self.ring[n % self.capacity]
+        if bar is None or bar.n != n:
+            self.ring[n % self.capacity] = Bar(n, price, shares)
+        else:
+            bar.add(price, shares)
+        if self.last is None or n > self.last:
+            self.last = n
+
+    def get(self, n):
+        """Bar of period n, or None if there were no trades or it is gone."""
+        if self.last is None or not self.first() <= n <= self.last:
+            return None
+        bar = self.ring[n % self.capacity]
+        return bar if bar is not None and bar.n == n else None
+
+    def bars(self, reverse=False):
+        """Bars kept, oldest first unless reverse."""
+        if self.last is None:
+            return
+        periods = range(self.first(), self.last + 1)
+        for n in reversed(periods) if reverse else periods:
+            bar = self.get(n)
+            if bar is not None:
+                yield bar
+
+    def close_before(self, time, since):
+        """Close of the latest bar ending by time and starting at since or later, or None."""
+        if self.last is None:
+            return None
+        for n in range(min(self.period(time) - 1, self.last), max(self.period(since), self.first()) - 1, -1):
+            bar = self.get(n)
+            if bar is not None:
+                return bar.close
+        return None
+
+
+class Window:
+    """
+    Rolling VWAP and TWAP of the trades in the last span, a timedelta.
+    Trades leave the window as it moves past them, when trades are added
+    and when it is asked for averages, so both take amortized O(1).
+    """
+
+    def __init__(self, span):
+        self.span = span
+        # (time, price, shares) of the trades in the window, oldest first.
+        self.trades = deque()
+        self.value = D(0)
+        self.volume = D(0)
+        # Sum of each price in the window times the microseconds it stood until the next trade.
+        self.area = D(0)
+        # Price of the latest trade to leave the window, which stood when it opened.
+        self.before = None
+
+    @staticmethod
+    def micros(delta):
+        return D(delta // timedelta(microseconds=1))
+
+    def add(self, time, price, shares):
+        if self.trades:
+            last_time, last_price, _ = self.trades[-1]
+            if time < last_time:
+                # Out of order; it would not fit in the area.
+                return
+            self.area += last_price * Window.micros(time - last_time)
+        self.trades.append((time, price, shares))
+        self.value += price * shares
+        self.volume += shares
+        self.move(time)
+
+    def move(self, now):
+        """Let out the trades older than span before now."""
+        start = now - self.span
+        while self.trades and self.trades[0][0] <= start:
+            time, price, shares = self.trades.popleft()
+            self.value -= price * shares
+            self.volume -= shares
+            if self.trades:
+                self.area -= price * Window.micros(self.trades[0][0] - time)
+            self.before = price
+
+    def vwap(self, now):
+        """Average price of the shares traded in the window, or None if there were none."""
+        self.move(now)
+        return self.value / self.volume if self.volume else None
+
+    def twap(self, now):
+        """Average of the price over the window, or None if nothing traded before now."""
+        self.move(now)
+        if not self.trades:
+            return self.before
+        first_time = self.trades[0][0]
+        last_time, last_price, _ = self.trades[-1]
+        area = self.area + last_price * Window.micros(now - last_time)
+        covered = Window.micros(now - first_time)
+        if self.before is not None:
+            area += self.before * Window.micros(first_time - (now - self.span))
+            covered = Window.micros(self.span)
+        return area / covered if covered else last_price
+
+
+class Bars:
+    """
+    Market data of each instrument, built as trades come: bars at each of
+    resolutions, a map of name to timedelta and number of bars kept, and
+    rolling windows of each of spans, a map of name to timedelta.
+    """
+
+    resolutions = {"1m": (timedelta(minutes=1), 24 * 60), "1h": (timedelta(hours=1), 30 * 24),
+                   "1d": (timedelta(days=1), 2 * 366)}
+    spans = {"1h": timedelta(hours=1), "24h": timedelta(days=1)}
+
+    def __init__(self):
+        self.series = {}
+        self.windows = {}
+
+    def add(self, trade):
+        inst = trade.instrument_id
+        if inst not in self.series:
+            self.series[inst] = {name: BarSeries(*r) for name, r in Bars.resolutions.items()}
+            self.windows[inst] = {name: Window(span) for name, span in Bars.spans.items()}
+        for s in self.series[inst].values():
+            s.add(trade.timestamp, trade.price, trade.shares)
+        for w in self.windows[inst].values():
+            w.add(trade.timestamp, trade.price, trade.shares)
+
+    def get_series(self, instrument_id, resolution):
+        """Bars of instrument_id at resolution, or None if it never traded."""
+        if resolution not in Bars.resolutions:
+            raise ValueError("Resolution must be one of: {0}.".format(", ".join(Bars.resolutions)))
+        return self.series.get(instrument_id, {}).get(resolution)
+
+    def get_window(self, instrument_id, span):
+        """Rolling window of instrument_id over span, or None if it never traded."""
+        if span not in Bars.spans:
+            raise ValueError("Span must be one of: {0}.".format(", ".join(Bars.spans)))
+        return self.windows.get(instrument_id, {}).get(span)
+
+    def price_at(self, instrument_id, time):
+        """
+        Last price of instrument_id by time, to the finest resolution still
+        kept for it, or None if it had not traded. Each resolution looks
+        back only as far as the start of the period of the next one.
+        """
+        series = sorted(self.series.get(instrument_id, {}).values(), key=lambda s: s.resolution)
+        for s, coarser in zip(series, series[1:] + [None]):
+            since = coarser.start(coarser.period(time)) if coarser else EPOCH
+            close = s.close_before(time, since)
+            if close is not None:
+                return close
+        return None
@@ -0,0 +1,149 @@
+# Copyright (c) 2016 the IrcBook team
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+from collections import defaultdict
+from decimal import Decimal as D
+
+
+class Ledger:
+    """
+    Double-entry record of cash and coupons. Every movement is posted as a
+    set of entries (owner, asset, amount) adding up to zero for each asset,
+    so nothing is made or lost on the way. The asset is "cash", or a side
+    and an instrument_id such as "y:claim".
+
+    Besides the accounts, the owners are the system accounts: equity,
+    where granted cash comes from, the escrow of each instrument, which
+    holds 100 for every yes and no coupon pair outstanding, and the
+    issuer, from which coupons come. Running totals over them make check()
+    O(1).
+
+    Postings are also handed to journal, if set, as dictionaries, making
+    an append-only trail that rebuild() replays. The journal must keep
+    every record, see util.auditlog.Journal.
+    """
+
+    equity = "*equity"
+    issuer = "*issuer"
+    cash = "cash"
+
+    def __init__(self, journal=None):
+        self.journal = journal
+        self.balances = defaultdict(D)
+        # Cash of all users, and in all escrows; yes and no coupons outstanding.
+        self.user_cash = D(0)
+        self.escrowed = D(0)
+        self.yes = D(0)
+        self.no = D(0)
+
+    @staticmethod
+    def escrow(instrument_id):
+        return "*escrow:" + instrument_id
+
+    @staticmethod
+    def coupon(side, instrument_id):
+        return side + ":" + instrument_id
+
+    def post(self, kind, entries):
+        """Post entries, (owner, asset, amount) triples. Raises ValueError unless they balance."""
+        sums = defaultdict(D)
+        for owner, asset, amount in entries:
+            sums[asset] += amount
+        if any(sums.values()):
+            raise ValueError("Unbalanced {0} posting: {1}".format(kind, entries))
+        for owner, asset, amount in entries:
+            self.balances[owner, asset] += amount
+            if asset == Ledger.cash:
+                if owner.startswith("*escrow:"):
+                    self.escrowed += amount
+                elif not owner.startswith("*"):
+                    self.user_cash += amount
+            elif owner == Ledger.issuer:
+                if asset.startswith("y:"):
+                    self.yes -= amount
+                else:
+                    self.no -= amount
+        if self.journal is not None:
+            self.journal({"kind": kind, "entries": [[o, a, str(m)] for o, a, m in entries]})
+
+    def balance(self, owner, asset=cash):
+        return self.balances.get((owner, asset), D(0))
+
+    def grant(self, account_id, amount):
+        """New cash for account_id."""
+        self.post("grant", [(Ledger.equity, Ledger.cash, -amount), (account_id, Ledger.cash, amount)])
+
+    def buy(self, account_id, instrument_id, side, shares, cost):
+        """
+        account_id buys shares coupons of side at cost each, paid into the
+        escrow. The other side of the trade buys the opposite coupons at
+        100 - cost, so that each pair is backed by 100.
+        """
+        coupon = Ledger.coupon(side, instrument_id)
+        self.post("buy", [(account_id, Ledger.cash, -cost * shares),
+                          (Ledger.escrow(instrument_id), Ledger.cash, cost * shares),
+                          (Ledger.issuer, coupon, -shares), (account_id, coupon, shares)])
+
+    def redeem(self, account_id, instrument_id, pairs):
+        """account_id hands back pairs of yes and no coupons for 100 each."""
+        yes, no = Ledger.coupon("y", instrument_id), Ledger.coupon("n", instrument_id)
+        self.post("redeem", [(account_id, yes, -pairs), (account_id, no, -pairs), (Ledger.issuer, yes, pairs),
+                             (Ledger.issuer, no, pairs), (Ledger.escrow(instrument_id), Ledger.cash, -100 * pairs),
+                             (account_id, Ledger.cash, 100 * pairs)])
+
+    def settle(self, account_id, instrument_id, side, shares, won):
+        """account_id hands back shares coupons of side, paid 100 each if they won."""
+        coupon = Ledger.coupon(side, instrument_id)
+        entries = [(account_id, coupon, -shares), (Ledger.issuer, coupon, shares)]
+        if won:
+            entries += [(Ledger.escrow(instrument_id), Ledger.cash, -100 * shares),
+                        (account_id, Ledger.cash, 100 * shares)]
+        self.post("settle", entries)
+
+    def open(self, portfolios):
+        """
+        Post the cash and coupons of portfolios, as a starting point. The
+        escrow is funded for the yes coupons, each of which pairs with a no.
+        """
+        entries = []
+        for p in portfolios:
+            entries += [(Ledger.equity, Ledger.cash, -p.cash_balance), (p.account_id, Ledger.cash, p.cash_balance)]
+            for c in p.coupons.values():
+                coupon = Ledger.coupon(c.side, c.instrument_id)
+                entries += [(Ledger.issuer, coupon, -c.shares), (p.account_id, coupon, c.shares)]
+                if c.side == "y":
+                    entries += [(Ledger.equity, Ledger.cash, -100 * c.shares),
+                                (Ledger.escrow(c.instrument_id), Ledger.cash, 100 * c.shares)]
+        self.post("open", entries)
+
+    def snapshot(self):
+        """Post every balance as an "open" posting, from which rebuild() can start, and return it."""
+        entries = [(owner, asset, amount) for (owner, asset), amount in self.balances.items() if amount]
+        if self.journal is not None:
+            self.journal({"kind": "open", "entries": [[o, a, str(m)] for o, a, m in entries]})
+        return entries
+
+    def check(self):
+        """
+        Whether cash and coupons are conserved: yes and no coupons come in
+        pairs, each backed by 100 in escrow, and cash of users and escrows
+        adds up to what was granted.
+        """
+        return (self.yes == self.no and self.escrowed == 100 * self.yes and
+                self.user_cash + self.escrowed + self.balance(Ledger.equity) == D(0))
+
+    @staticmethod
+    def rebuild(records):
+        """
+        Ledger replaying the postings of a journal, from its last "open"
+        posting on. Raises ValueError if there is none to start from.
+        """
+        records = list(records)
+        start = max((i for i, r in enumerate(records) if r["kind"] == "open"), default=None)
+        if start is None:
+            raise ValueError("No snapshot in the journal to rebuild the ledger from.")
+        ledger = Ledger()
+        for r in records[start:]:
+            ledger.post(r["kind"], [(o, a, D(m)) for o, a, m in r["entries"]])
+        return ledger
@@ -4,9 +4,10 @@
 
 from collections import defaultdict
 from datetime import datetime
+from itertools import chain
 from decimal import Decimal as D
 
-from sortedcontainers import SortedList
+from sortedcontainers import SortedDict, SortedList
 
 
 # Sorting rules.
@@ -39,6 +40,8 @@ class OrderBook:
             book = {}
         self.orders_by_acct = defaultdict(AccountOrders)
         self.orders_by_instrument = defaultdict(InstrumentOrders)
+        # Bumped on every change to the orders of an instrument.
+        self.versions = defaultdict(int)
 
         if book:
             for order in book["orders"]:
@@ -71,19 +74,78 @@ class OrderBook:
         """
         self.orders_by_acct[order.account_id].add(order)
         self.orders_by_instrument[order.instrument_id].add(order)
+        self.versions[order.instrument_id] += 1
 
     def remove_order(self, order):
         self.orders_by_acct[order.account_id].remove(order)
         self.orders_by_instrument[order.instrument_id].remove(order)
+        self.versions[order.instrument_id] += 1
+
+    def mass_cancel(self, account_id=None, instrument_id=None, side=None, predicate=None):
+        """
+        Removes in one pass the orders of account_id, on instrument_id, on
+        side, for which predicate(order) holds, leaving out any of these
+        that is None. Price levels and Risk are updated once per account,
+        instrument and side. Returns a Cancellation; the portfolios of its
+        accounts still need calc_risk.
+        """
+        if account_id is not None:
+            account = self.get_by_account_id(account_id)
+            candidates = account.get_orders(side) if account else ()
+        elif instrument_id is not None:
+            orders = self.get_by_instrument_id(instrument_id)
+            candidates = orders.get_orders(side) if orders else ()
+        else:
+            candidates = chain.from_iterable(i.get_orders(side) for i in self.orders_by_instrument.values())
+        selected = [o for o in candidates if (instrument_id is None or o.instrument_id == instrument_id) and
+                    (predicate is None or predicate(o))]
+        costs = defaultdict(D)
+        books = defaultdict(list)
+        for order in selected:
+            account = self.orders_by_acct[order.account_id]
+            (account.bids if order.side == Order.bid else account.asks).remove(order)
+            costs[order.account_id, order.instrument_id, order.side] += order.cost()
+            books[order.instrument_id, order.side].append(order)
+        for (account_id, inst, s), cost in costs.items():
+            self.orders_by_acct[account_id].risk.reduce(inst, s, cost)
+        for (inst, s), orders in books.items():
+            self.orders_by_instrument[inst].remove_orders(orders, s)
+            self.versions[inst] += 1
+        return Cancellation(selected)
+
+    def has_order(self, order):
+        """Whether order is still on the book."""
+        orders = self.get_by_instrument_id(order.instrument_id)
+        return orders is not None and order in orders
+
+    def version(self, instrument_id):
+        """Changes whenever the orders of instrument_id change."""
+        return self.versions.get(instrument_id, 0)
 
     def remove_shares_from_order(self, order, removed_num_shares):
+        """
+        Takes removed_num_shares off order where it stands, so that it keeps
+        its place in the queue. The order is removed once no shares are left.
+        """
         new_num_shares = order.num_shares - removed_num_shares
         if new_num_shares < D(0):
             raise ValueError("Can't remove more shares than exist.")
-        self.remove_order(order)
+        if new_num_shares == D(0):
+            self.remove_order(order)
+            order.num_shares = new_num_shares
+            return
+        cost = order.cost()
         order.num_shares = new_num_shares
-        if order.num_shares > D(0):
-            self.add_order(order)
+        self.orders_by_acct[order.account_id].risk.reduce(order.instrument_id, order.side, cost - order.cost())
+        self.orders_by_instrument[order.instrument_id].reduce(order, removed_num_shares)
+        self.versions[order.instrument_id] += 1
+
+    def get_order(self, instrument_id, rank):
+        """The order on instrument_id with rank, or None."""
+        orders = self.get_by_instrument_id(instrument_id)
+        if orders is None:
+            return None
+        return orders.by_rank.get(rank)
 
     def get_priority_cross(self, instrument_id):
         """
@@ -129,6 +191,18 @@ class OrderBook:
         return {"rank": ranks, "orders": l}
 
 
+class Cancellation:
+    """Orders removed by OrderBook.mass_cancel."""
+
+    def __init__(self, orders):
+        self.orders = orders
+        self.num_shares = sum((o.num_shares for o in orders), D(0))
+        self.accounts = {o.account_id for o in orders}
+
+    def __len__(self):
+        return len(self.orders)
+
+
 class AccountOrders:
     def __init__(self):
         self.bids = set()
@@ -156,11 +230,14 @@ class AccountOrders:
         """Get us the risk for an instrument for this user."""
         return self.risk.get_risk(inst)
 
-    def __getitem__(self, index):
-        l = list(self.bids) + list(self.asks)
-        if index < len(l):
-            return l[index]
-        raise IndexError("Index out of bounds: %d, size is %d" % (index, len(l)))
+    def get_orders(self, side=None):
+        """Orders on side, or on both sides."""
+        if side is None:
+            return chain(self.bids, self.asks)
+        return self.bids if side == Order.bid else self.asks
+
+    def __iter__(self):
+        return chain(self.bids, self.asks)
 
     def __len__(self):
         return len(self.bids) + len(self.asks)
@@ -185,10 +262,13 @@ class Risk:
 
     def remove(self, order):
         """Remove an order from risk structure."""
-        inst, side = order.instrument_id, order.side
-        if self.risk[inst][side] < order.cost():
+        self.reduce(order.instrument_id, order.side, order.cost())
+
+    def reduce(self, inst, side, cost):
+        """Take cost off the risk of orders on inst on side, as when they shrink or go."""
+        if self.risk[inst][side] < cost:
             raise ValueError("Attempting to remove more risk than exists.")
-        self.risk[inst][side] -= order.cost()
+        self.risk[inst][side] -= cost
 
     def get_risk(self, inst):
         """Returns risk state for a given claim."""
@@ -211,6 +291,10 @@ class InstrumentOrders:
         # lists ordered by posted value and secondarily by time entered
         self.bids = SortedList(key=opricerank)
         self.asks = SortedList(key=antiopricerank)
+        # Total shares at each price.
+        self.bid_levels = SortedDict()
+        self.ask_levels = SortedDict()
+        self.by_rank = {}
 
         # order in which an order was added, 1st, 2nd, ...
         self.next_order_rank = next_order_rank
@@ -244,19 +328,73 @@ class InstrumentOrders:
             self.bids.add(order)
         else:
             self.asks.add(order)
+        levels = self.get_levels(order.side)
+        levels[order.price] = levels.get(order.price, D(0)) + order.num_shares
+        self.by_rank[order.rank] = order
 
     def remove(self, order):
         if order.side == Order.bid:
             self.bids.remove(order)
         else:
             self.asks.remove(order)
+        levels = self.get_levels(order.side)
+        levels[order.price] -= order.num_shares
+        if not levels[order.price]:
+            del levels[order.price]
+        del self.by_rank[order.rank]
+
+    def reduce(self, order, num_shares):
+        """Account for num_shares taken off order, which keeps its place."""
+        self.get_levels(order.side)[order.price] -= num_shares
+
+    def remove_orders(self, orders, side):
+        """Remove orders, all on side, at once."""
+        book = self.bids if side == Order.bid else self.asks
+        levels = self.get_levels(side)
+        if len(orders) == len(book):
+            book.clear()
+            levels.clear()
+        else:
+            taken = defaultdict(D)
+            for order in orders:
+                book.remove(order)
+                taken[order.price] += order.num_shares
+            for price, num_shares in taken.items():
+                levels[price] -= num_shares
+                if not levels[price]:
+                    del levels[price]
+        for order in orders:
+            del self.by_rank[order.rank]
+
+    def get_orders(self, side=None):
+        """Orders on side, or on both sides."""
+        if side is None:
+            return chain(self.bids, self.asks)
+        return self.bids if side == Order.bid else self.asks
+
+    def get_levels(self, side):
+        """Total shares at each price on side, as a SortedDict by price."""
+        return self.bid_levels if side == Order.bid else self.ask_levels
+
+    def __contains__(self, order):
+        if order.side == Order.bid:
+            return order in self.bids
+        return order in self.asks
 
 
 class Order:
     ask = "a"
     bid = "b"
 
-    def __init__(self, account_id, side, instrument_id, price, num_shares, timestamp=None, rank=None):
+    # Time in force: good till cancelled, immediate or cancel, fill or
+    # kill, and good till date, the datetime expires.
+    gtc = "gtc"
+    ioc = "ioc"
+    fok = "fok"
+    gtd = "gtd"
+
+    def __init__(self, account_id, side, instrument_id, price, num_shares, timestamp=None, rank=None, tif=gtc,
+                 expires=None):
         self.account_id = account_id
         self.side = side
         self.instrument_id = instrument_id
@@ -267,6 +405,11 @@ class Order:
         else:
             self.timestamp = datetime(*timestamp)
         self.rank = rank
+        self.tif = tif
+        if expires is None or isinstance(expires, datetime):
+            self.expires = expires
+        else:
+            self.expires = datetime(*expires)
 
         self._check_order_validity()
 
@@ -283,6 +426,10 @@ class Order:
             raise ValueError("Number of shares must be a positive Decimal.")
         if self.rank and self.rank < 0:
             raise ValueError("Rank must be zero or greater.")
+        if self.tif not in (Order.gtc, Order.ioc, Order.fok, Order.gtd):
+            raise ValueError("Invalid time in force.")
+        if (self.tif == Order.gtd) != (self.expires is not None):
+            raise ValueError("Good till date orders, and only they, must have an expiry.")
 
     def get_buy_cost(self):
         return self.price * self.num_shares
@@ -291,8 +438,11 @@ class Order:
         self.rank = rank
 
     def __str__(self):
-        return (str(self.instrument_id) + "#" + str(self.rank) + ": " +
-                str(self.side) + " @ " + str(self.price) + " * " + str(self.num_shares))
+        s = (str(self.instrument_id) + "#" + str(self.rank) + ": " +
+             str(self.side) + " @ " + str(self.price) + " * " + str(self.num_shares))
+        if self.expires is not None:
+            s += " until " + self.expires.strftime("%Y-%m-%d %H:%M")
+        return s
 
     def name(self):
         return str(self.instrument_id) + '#' + str(self.rank)
@@ -309,10 +459,15 @@ class Order:
             return self.price < o.price
 
     def dump(self):
+        expires = None
+        if self.expires is not None:
+            expires = (self.expires.year, self.expires.month, self.expires.day, self.expires.hour,
+                       self.expires.minute, self.expires.second, self.expires.microsecond)
         return (self.account_id, self.side, self.instrument_id, str(self.price),
                 str(self.num_shares), (self.timestamp.year, self.timestamp.month,
                                        self.timestamp.day, self.timestamp.hour, self.timestamp.minute,
-                                       self.timestamp.second, self.timestamp.microsecond), self.rank)
+                                       self.timestamp.second, self.timestamp.microsecond), self.rank,
+                self.tif, expires)
 
     def cost(self):
         """Got sick of having this code all over the place."""
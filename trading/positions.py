@@ -5,6 +5,8 @@
 from collections import defaultdict
 from decimal import Decimal as D
 
+from trading.ledger import Ledger
+
 
 class Positions:
     """
@@ -17,14 +19,72 @@ class Positions:
         if pos is None:
             pos = []
         self.portfolios = defaultdict(Portfolio)
+        # Bumped on every change to cash balances or coupons.
+        self.version = 0
+        # Every move of cash and coupons, see Ledger.
+        self.ledger = Ledger()
+        # Whether portfolios were saved before profit and loss was tracked, see seed_pnl().
+        self.untracked = any(len(i) < 5 for i in pos)
 
         for i in pos:
             self.portfolios[i[0]] = Portfolio(*i)
+        if self.portfolios:
+            self.ledger.open(self.portfolios.values())
+
+    def mark_changed(self):
+        """Bump the version after changing portfolios directly."""
+        self.version += 1
 
     def add_coupon(self, coupon, cost=D(0)):
         if coupon.account_id not in self.portfolios:
-            self.portfolios[coupon.account_id] = Portfolio(coupon.account_id)
-        self.portfolios[coupon.account_id].add_coupon(coupon, cost)
+            self.add_portfolio(coupon.account_id)
+        p = self.portfolios[coupon.account_id]
+        held = p.get_coupon(coupon.instrument_id)
+        pairs = min(held.shares, coupon.shares) if held and held.side != coupon.side else D(0)
+        p.add_coupon(coupon, cost)
+        self.ledger.buy(coupon.account_id, coupon.instrument_id, coupon.side, coupon.shares, cost)
+        if pairs:
+            self.ledger.redeem(coupon.account_id, coupon.instrument_id, pairs)
+        self.version += 1
+
+    def settle(self, instrument_id, result):
+        """
+        Pays 100 for each coupon on instrument_id on the side result, and
+        takes all coupons on instrument_id away. Returns the account_ids
+        that held any.
+        """
+        accounts = set()
+        for p in self.portfolios.values():
+            c = p.coupons.pop(instrument_id, None)
+            if c is None:
+                continue
+            if c.side == result:
+                p.cash_balance += D(100) * c.shares
+            self.ledger.settle(p.account_id, instrument_id, c.side, c.shares, c.side == result)
+            p.get_pnl(instrument_id).close(D(100) if result == Coupon.yes else D(0))
+            accounts.add(p.account_id)
+        self.version += 1
+        return accounts
+
+    def seed_pnl(self, trades, results):
+        """
+        Work out profit and loss for portfolios saved before it was tracked,
+        replaying trades, oldest first, then closing the instruments in
+        results, a map of instrument_id to the side that won.
+        """
+        for p in self.portfolios.values():
+            p.pnl.clear()
+        for t in trades:
+            # The first account of a trade is the bidder, which bought yes coupons; see Trade.
+            for account_id, shares in ((t.sell_user, t.shares), (t.buy_user, -t.shares)):
+                if account_id in self.portfolios:
+                    self.portfolios[account_id].get_pnl(t.instrument_id).fill(shares, t.price)
+        for instrument_id, result in results.items():
+            for p in self.portfolios.values():
+                if instrument_id in p.pnl:
+                    p.pnl[instrument_id].close(D(100) if result == Coupon.yes else D(0))
+        self.untracked = False
+        self.version += 1
 
     def get_coupons(self, account_id):
         return self.portfolios[account_id].get_coupons()
@@ -37,6 +97,8 @@ class Positions:
 
     def add_portfolio(self, account_id):
         self.portfolios[account_id] = Portfolio(account_id)
+        self.ledger.grant(account_id, self.portfolios[account_id].cash_balance)
+        self.version += 1
 
     def dump(self):
         l = []
@@ -45,7 +107,7 @@ class Positions:
         return l
 
     def __eq__(self, o):
-        return isinstance(o, Positions) and self.__dict__ == o.__dict__
+        return isinstance(o, Positions) and self.portfolios == o.portfolios
 
     def __ne__(self, o):
         return not self == o
@@ -56,9 +118,11 @@ class Portfolio:
     portfolio of a single account.
     """
 
-    def __init__(self, account_id, coupons=None, cash_balance=D(1000000), locked_cash=D(0)):
+    def __init__(self, account_id, coupons=None, cash_balance=D(1000000), locked_cash=D(0), pnl=None):
         if coupons is None:
             coupons = []
+        if pnl is None:
+            pnl = []
         self.account_id = account_id
         self.coupons = {}
         if D(cash_balance) < D(0):
@@ -69,6 +133,11 @@ class Portfolio:
         for coupon in coupons:
             c = Coupon(*coupon)
             self.coupons[c.instrument_id] = c
+        # Profit and loss by instrument_id, see Pnl.
+        self.pnl = {}
+        for record in pnl:
+            r = Pnl(*record)
+            self.pnl[r.instrument_id] = r
 
     def get_unlocked_cash(self):
         return self.cash_balance - self.locked_cash
@@ -96,6 +165,24 @@ class Portfolio:
     def get_cash_balance(self):
         return self.cash_balance
 
+    def get_pnl(self, instrument_id):
+        """Profit and loss on instrument_id, started if there is none yet."""
+        if instrument_id not in self.pnl:
+            self.pnl[instrument_id] = Pnl(instrument_id)
+        return self.pnl[instrument_id]
+
+    def profit(self, mark):
+        """
+        Realized and unrealized profit over all instruments, open positions
+        valued at mark(instrument_id).
+        """
+        realized, unrealized = D(0), D(0)
+        for instrument_id, r in self.pnl.items():
+            realized += r.realized
+            if r.shares:
+                unrealized += r.unrealized(mark(instrument_id))
+        return realized, unrealized
+
     def add_coupon(self, new_coupon, cost=D(0)):
 
         if not isinstance(new_coupon, Coupon):
@@ -104,6 +191,11 @@ class Portfolio:
         if self.account_id != new_coupon.account_id:
             raise ValueError("Cannot add someone else's coupon.")
 
+        if new_coupon.side == Coupon.yes:
+            self.get_pnl(new_coupon.instrument_id).fill(new_coupon.shares, cost)
+        else:
+            self.get_pnl(new_coupon.instrument_id).fill(-new_coupon.shares, D(100) - cost)
+
         # if new coupon, simply add the coupon
         if new_coupon.instrument_id not in self.coupons:
             self.coupons[new_coupon.instrument_id] = new_coupon
@@ -136,9 +228,18 @@ class Portfolio:
     def calc_risk(self, risk):
         """Calculates how much cash should be locked for a given user and risk."""
         locked = self.locked_cash
+        locking = self.locking(risk)
+        result = locked, locking
+        self.locked_cash = locking
+        return result
+
+    def locking(self, risk, coupons=None):
+        """Cash to lock for risk, holding coupons, a map of instrument_id to Coupon, or our own."""
+        if coupons is None:
+            coupons = self.coupons
         locking = D(0)
         for inst in risk:
-            c = self.get_coupon(inst)
+            c = coupons.get(inst)
             r = risk[inst]
             a, b = D(0), D(0)
             if "a" in r:
@@ -151,9 +252,7 @@ class Portfolio:
                 elif c.side == Coupon.no:
                     b -= D(100) * c.shares
             locking += max(a, b)
-        result = locked, locking
-        self.locked_cash = locking
-        return result
+        return locking
 
     def afford(self, risk, order):
         locking = D(0)
@@ -195,7 +294,8 @@ class Portfolio:
         coupons = []
         for i in self.coupons.values():
             coupons.append(i.dump())
-        return self.account_id, coupons, str(self.cash_balance), str(self.locked_cash)
+        pnl = [r.dump() for r in self.pnl.values()]
+        return self.account_id, coupons, str(self.cash_balance), str(self.locked_cash), pnl
 
     def __eq__(self, o):
         return isinstance(o, Portfolio) and self.__dict__ == o.__dict__
@@ -254,3 +354,60 @@ class Coupon:
 
     def __ne__(self, o):
         return not self == o
+
+
+class Pnl:
+    """
+    Profit and loss of an account on an instrument, at average cost. The
+    position is counted in yes coupons, negative for no coupons, since a
+    no coupon bought at cost is a yes coupon sold at 100 - cost; prices
+    are those of yes coupons. basis is what the open position cost in
+    total, so that closing all of it realizes exactly what was made.
+    """
+
+    def __init__(self, instrument_id, shares=D(0), basis=D(0), realized=D(0)):
+        self.instrument_id = instrument_id
+        self.shares = D(shares)
+        self.basis = D(basis)
+        self.realized = D(realized)
+
+    def fill(self, shares, price):
+        """Buy shares yes coupons at price, or sell them if shares is negative."""
+        if not self.shares or (self.shares > D(0)) == (shares > D(0)):
+            self.shares += shares
+            self.basis += shares * price
+            return
+        closed = min(abs(self.shares), abs(shares))
+        if closed == abs(self.shares):
+            part = self.basis
+        else:
+            part = self.basis * closed / abs(self.shares)
+        self.realized += closed * price * (1 if self.shares > D(0) else -1) - part
+        self.basis -= part
+        self.shares += shares
+        if abs(shares) > closed:
+            self.basis = self.shares * price
+
+    def close(self, price):
+        """Close the position at price, as when the claim is judged."""
+        if self.shares:
+            self.fill(-self.shares, price)
+
+    def average_cost(self):
+        """Average price paid for the open position, or None if there is none."""
+        return self.basis / self.shares if self.shares else None
+
+    def unrealized(self, mark):
+        """What closing the position at mark would realize; nothing without a mark."""
+        if mark is None:
+            return D(0)
+        return self.shares * mark - self.basis
+
+    def dump(self):
+        return self.instrument_id, str(self.shares), str(self.basis), str(self.realized)
+
+    def __eq__(self, o):
+        return isinstance(o, Pnl) and self.__dict__ == o.__dict__
+
+    def __ne__(self, o):
+        return not self == o
@@ -0,0 +1,83 @@
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal as D
+
+from trading.bars import EPOCH, BarSeries, Window
+from trading.tradingengine import Trades, Trade
+
+
+def stamp(t):
+    return t.year, t.month, t.day, t.hour, t.minute, t.second, t.microsecond
+
+
+def random_trades(seed, n=500):
+    rng = random.Random(seed)
+    t = datetime(2020, 1, 1)
+    trades = []
+    for i in range(n):
+        t += timedelta(seconds=rng.choice((1, 30, 100, 3000, 20000)))
+        trades.append(Trade("u", "u2", "i", D(rng.randint(1, 99)), D(rng.randint(1, 50)), stamp(t)))
+    return trades
+
+
+def test_bars_match_trades():
+    trades = Trades()
+    raw = random_trades(1)
+    for t in raw:
+        trades.add_trade(t)
+    hours = trades.bars.get_series("i", "1h")
+    kept = list(hours.bars())
+    assert len(kept) <= hours.capacity
+    for bar in kept:
+        start = hours.start(bar.n)
+        inside = [t for t in raw if start <= t.timestamp < start + hours.resolution]
+        assert bar.open == inside[0].price and bar.close == inside[-1].price
+        assert bar.high == max(t.price for t in inside) and bar.low == min(t.price for t in inside)
+        assert bar.volume == sum(t.shares for t in inside)
+    now = raw[-1].timestamp
+    for back in (timedelta(minutes=1), timedelta(minutes=75), timedelta(hours=30), timedelta(days=10)):
+        at = now - back
+        # The last price before the minute of at within a day, before its hour within a month.
+        resolution = timedelta(minutes=1) if back <= timedelta(days=1) else timedelta(hours=1)
+        cut = EPOCH + (at - EPOCH) // resolution * resolution
+        assert trades.bars.price_at("i", at) == [t.price for t in raw if t.timestamp < cut][-1]
+    assert trades.bars.price_at("i", raw[0].timestamp - timedelta(days=1)) is None
+    assert trades.bars.get_series("j", "1m") is None
+
+
+def test_ring_overwrites_old_bars():
+    s = BarSeries(timedelta(minutes=1), 3)
+    t = datetime(2020, 1, 1)
+    for m in range(5):
+        s.add(t + timedelta(minutes=m), D(m + 1), D(1))
+    assert [b.close for b in s.bars()] == [D(3), D(4), D(5)]
+    assert s.get(s.period(t)) is None
+    # Too old to keep.
+    s.add(t, D(50), D(1))
+    assert [b.close for b in s.bars(reverse=True)] == [D(5), D(4), D(3)]
+
+
+def test_rolling_windows():
+    raw = random_trades(2, 300)
+    span = timedelta(hours=6)
+    w = Window(span)
+    for i, t in enumerate(raw):
+        w.add(t.timestamp, t.price, t.shares)
+        times = [t.timestamp]
+        if i + 1 < len(raw):
+            times.append(t.timestamp + (raw[i + 1].timestamp - t.timestamp) / 2)
+        for now in times:
+            start = now - span
+            inside = [x for x in raw[:i + 1] if x.timestamp > start]
+            vwap = w.vwap(now)
+            if inside:
+                assert vwap == sum(x.price * x.shares for x in inside) / sum(x.shares for x in inside)
+            else:
+                assert vwap is None
+            # The price over time, starting from the last one before the window.
+            before = [x for x in raw[:i + 1] if x.timestamp <= start]
+            points = ([(start, before[-1].price)] if before else []) + [(x.timestamp, x.price) for x in inside]
+            area = sum(p * Window.micros(b[0] - a) for (a, p), b in zip(points, points[1:] + [(now, None)]))
+            covered = Window.micros(now - points[0][0])
+            expected = area / covered if covered else points[-1][1]
+            assert abs(w.twap(now) - expected) < D("1e-15")
@@ -0,0 +1,58 @@
+from decimal import Decimal as D
+
+import pytest
+
+from trading.ledger import Ledger
+from trading.orderbook import OrderBook, Order
+from trading.positions import Positions, Portfolio, Coupon
+from trading.tradingengine import TradingEngine, Trades
+
+
+def test_unbalanced_posting():
+    ledger = Ledger()
+    with pytest.raises(ValueError):
+        ledger.post("grant", [(Ledger.equity, Ledger.cash, D(-5)), ("u", Ledger.cash, D(4))])
+    assert ledger.balance("u") == D(0)
+
+
+def test_trade_and_settle():
+    pos = Positions()
+    engine = TradingEngine(OrderBook(), pos, Trades())
+    pos.add_portfolio("u")
+    pos.add_portfolio("u2")
+    engine.place(Order("u", Order.bid, "i", D(40), D(10)))
+    engine.place(Order("u2", Order.ask, "i", D(40), D(10)))
+    ledger = pos.ledger
+    assert ledger.check()
+    assert ledger.balance(Ledger.escrow("i")) == D(1000)
+    assert ledger.balance("u", Ledger.coupon("y", "i")) == D(10)
+    # Selling coupons back redeems pairs out of the escrow.
+    engine.place(Order("u", Order.ask, "i", D(50), D(4)))
+    engine.place(Order("u2", Order.bid, "i", D(50), D(4)))
+    assert ledger.check()
+    assert ledger.balance(Ledger.escrow("i")) == D(600)
+    assert pos.settle("i", Coupon.yes) == {"u", "u2"}
+    assert ledger.check()
+    assert ledger.balance(Ledger.escrow("i")) == D(0)
+    assert ledger.balance("u") == pos.get_portfolio("u").cash_balance == D(1000000 - 400 + 200 + 600)
+    assert ledger.balance("u2") == pos.get_portfolio("u2").cash_balance
+
+
+def test_rebuild_needs_a_snapshot():
+    journal = []
+    ledger = Ledger(journal.append)
+    ledger.grant("u", D(10))
+    with pytest.raises(ValueError):
+        Ledger.rebuild(journal)
+    ledger.snapshot()
+    ledger.grant("u2", D(5))
+    rebuilt = Ledger.rebuild(journal)
+    assert rebuilt.balance("u") == D(10) and rebuilt.balance("u2") == D(5)
+
+
+def test_open():
+    pos = Positions([Portfolio("u", [Coupon("u", "i", D(3), Coupon.yes).dump()], D(10)).dump(),
+                     Portfolio("u2", [Coupon("u2", "i", D(3), Coupon.no).dump()], D(20)).dump()])
+    assert pos.ledger.check()
+    assert pos.ledger.balance("u2") == D(20)
+    assert pos.ledger.balance(Ledger.escrow("i")) == D(300)
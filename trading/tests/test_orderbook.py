@@ -118,6 +118,44 @@ def test_orderbook_remove():
     assert (not ob.get_by_account_id("u").asks)
 
 
+def test_orderbook_mass_cancel():
+    ob = OrderBook()
+    o = Order("u", Order.bid, "i", D(10), D(100))
+    o2 = Order("u2", Order.ask, "i", D(20), D(5))
+    o3 = Order("u", Order.ask, "j", D(20), D(5))
+    o4 = Order("u", Order.ask, "j", D(30), D(5))
+    for i in (o, o2, o3, o4):
+        ob.add_order(i)
+    cancelled = ob.mass_cancel(instrument_id="i")
+    assert cancelled.accounts == {"u", "u2"} and cancelled.num_shares == D(105)
+    assert not ob.get_by_instrument_id("i").get_bids()
+    assert not ob.get_by_instrument_id("i").get_asks()
+    assert set(ob.get_by_account_id("u")) == {o3, o4}
+    assert ob.get_by_account_id("u").get_risk("i") == {Order.bid: D(0), Order.ask: D(0)}
+    assert len(ob.mass_cancel(instrument_id="k")) == 0
+    cancelled = ob.mass_cancel(account_id="u", side=Order.ask, predicate=lambda o: o.price > D(25))
+    assert cancelled.orders == [o4]
+    assert dict(ob.get_by_instrument_id("j").ask_levels) == {D(20): D(5)}
+    assert ob.get_by_account_id("u").get_risk("j")[Order.ask] == D(400)
+    assert ob.get_order("j", o4.rank) is None
+    assert ob.mass_cancel().orders == [o3]
+
+
+def test_levels():
+    ob = OrderBook()
+    o = Order("u", Order.bid, "i", D(10), D(100))
+    for i in (o, Order("u2", Order.bid, "i", D(10), D(5)), Order("u", Order.bid, "i", D(12), D(1))):
+        ob.add_order(i)
+    levels = ob.get_by_instrument_id("i").get_levels(Order.bid)
+    assert dict(levels) == {D(10): D(105), D(12): D(1)}
+    ob.remove_shares_from_order(o, D(40))
+    assert levels[D(10)] == D(65)
+    ob.remove_order(o)
+    assert dict(levels) == {D(10): D(5), D(12): D(1)}
+    ob.mass_cancel(instrument_id="i")
+    assert not levels
+
+
 def test_orderbook_remove_shares():
     ob = OrderBook()
     o = Order("u", Order.bid, "i", D(10), D(100))
@@ -127,6 +165,8 @@ def test_orderbook_remove_shares():
     ob.remove_shares_from_order(o, D(11))
     assert (o.rank == o_rank)
     assert (o.num_shares == D(89))
+    assert ob.get_order("i", o_rank) is o
+    assert ob.get_by_account_id("u").get_risk("i")[Order.bid] == D(890)
     assert (o in ob.get_by_instrument_id("i").get_bids())
     with pytest.raises(ValueError):
         ob.remove_shares_from_order(o, D(100))
@@ -174,3 +214,15 @@ def test_order_dump_and_construct():
     ob.add_order(o)
     o2 = Order(*o.dump())
     assert (str(o) == str(o2) and o.dump() == o2.dump())
+
+
+def test_orderbook_versions():
+    ob = OrderBook()
+    assert ob.version("i") == 0
+    o = Order("u", Order.bid, "i", D(10), D(100))
+    ob.add_order(o)
+    added = ob.version("i")
+    assert added > 0
+    ob.remove_shares_from_order(o, D(10))
+    assert ob.version("i") > added
+    assert ob.version("j") == 0
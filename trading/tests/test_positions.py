@@ -3,6 +3,7 @@ from decimal import InvalidOperation, Decimal as D
 import pytest
 
 from trading.positions import Positions, Portfolio, Coupon
+from trading.tradingengine import Trade
 
 
 def test_coupon_constructor():
@@ -57,3 +58,51 @@ def test_positions():
     p = Positions(portfolios)
     p2 = Positions(p.dump())
     assert (p == p2)
+
+
+def test_positions_versions():
+    p = Positions()
+    p.add_portfolio("u")
+    added = p.version
+    p.add_coupon(Coupon("u", "i", D(5), Coupon.yes), D(50))
+    assert p.version > added
+    p2 = Positions(p.dump())
+    assert p2.version != p.version
+    assert p == p2
+
+
+def test_pnl():
+    p = Positions()
+    p.add_portfolio("u")
+    p.add_coupon(Coupon("u", "i", D(10), Coupon.yes), D(40))
+    p.add_coupon(Coupon("u", "i", D(10), Coupon.yes), D(50))
+    r = p.get_portfolio("u").get_pnl("i")
+    assert r.average_cost() == D(45)
+    assert r.unrealized(D(60)) == D(300)
+    # Selling 25 at 60, that is buying no coupons at 40, closes the 20 and goes 5 short.
+    p.add_coupon(Coupon("u", "i", D(25), Coupon.no), D(40))
+    assert r.realized == D(20) * D(15)
+    assert r.shares == D(-5) and r.average_cost() == D(60)
+    assert p.get_portfolio("u").profit(lambda i: D(70)) == (D(300), D(-50))
+    assert Positions(p.dump()) == p
+    p.settle("i", Coupon.no)
+    assert r.shares == D(0)
+    assert r.realized == p.get_portfolio("u").cash_balance - D(1000000) == D(600)
+
+
+def test_seed_pnl():
+    """Portfolios saved before profit and loss was tracked get it from the trades."""
+    p = Positions()
+    for u in ("u", "u2"):
+        p.add_portfolio(u)
+    trades = [Trade("u", "u2", "i", D(40), D(10)), Trade("u2", "u", "i", D(55), D(4)),
+              Trade("u", "u2", "j", D(30), D(2))]
+    for t in trades:
+        p.add_coupon(Coupon(t.sell_user, t.instrument_id, t.shares, Coupon.yes), t.price)
+        p.add_coupon(Coupon(t.buy_user, t.instrument_id, t.shares, Coupon.no), D(100) - t.price)
+    p.settle("j", Coupon.yes)
+    old = Positions([d[:4] for d in p.dump()])
+    assert old.untracked
+    old.seed_pnl(trades, {"j": Coupon.yes})
+    assert not old.untracked
+    assert old == p
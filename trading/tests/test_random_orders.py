@@ -4,6 +4,7 @@ from decimal import Decimal as D
 from json import dumps
 from random import randint as r
 
+from trading.ledger import Ledger
 from trading.orderbook import OrderBook, Order
 from trading.positions import Positions
 from trading.tradingengine import TradingEngine, Trades
@@ -89,6 +90,7 @@ def test_random_orders():
             assert (c % 2 == 0)
             assert (m + ((c // D(2)) * D(100)) == D(10000000))
             assert (y == n)
+            assert (pos.ledger.check())
 
 
 # Setup.
@@ -153,3 +155,32 @@ def test_random_multi():
             assert (c % 2 == 0)
             assert (m + ((c // D(2)) * D(100)) == D(10000000))
             assert (y == n)
+            assert (pos2.ledger.check())
+
+
+def test_ledger_matches_portfolios():
+    """The ledger has the cash and coupons of every portfolio, and its journal gives them back."""
+    for positions in (pos, pos2):
+        journal = []
+        positions.ledger.journal = journal.append
+        positions.ledger.snapshot()
+        positions.ledger.journal = None
+        rebuilt = Ledger.rebuild(journal)
+        assert rebuilt.check()
+        for p in positions.portfolios.values():
+            assert rebuilt.balance(p.account_id) == p.cash_balance
+            for coupon in p.coupons.values():
+                assert rebuilt.balance(p.account_id, Ledger.coupon(coupon.side, coupon.instrument_id)) == coupon.shares
+
+
+def test_pnl_matches_cash():
+    """Profit and loss adds up to the cash made, once every claim is judged."""
+    for positions in (pos, pos2):
+        settled = Positions(positions.dump())
+        instruments = {i for p in settled.portfolios.values() for i in p.coupons}
+        for i in instruments:
+            settled.settle(i, "y")
+        for p in settled.portfolios.values():
+            realized, unrealized = p.profit(lambda i: None)
+            assert abs(realized - (p.cash_balance - D(1000000))) < D("1e-10")
+            assert unrealized == D(0)
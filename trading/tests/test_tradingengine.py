@@ -0,0 +1,151 @@
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal as D
+
+import pytest
+
+from trading.orderbook import OrderBook, Order
+from trading.positions import Positions
+from trading.tradingengine import TradingEngine, Trades, Trade
+
+
+def new_engine():
+    pos = Positions()
+    for u in ("u", "u2"):
+        pos.add_portfolio(u)
+    return TradingEngine(OrderBook(), pos, Trades())
+
+
+def test_immediate_or_cancel():
+    engine = new_engine()
+    engine.place(Order("u", Order.ask, "i", D(40), D(5)))
+    result = engine.place(Order("u2", Order.bid, "i", D(50), D(8), tif=Order.ioc))
+    assert result.shares_exchanged == D(5)
+    assert result.killed == D(3)
+    assert not engine.orderbook.get_by_instrument_id("i").get_bids()
+    p = engine.positions.get_portfolio("u2")
+    assert p.locked_cash == D(0)
+    assert p.get_coupon("i").shares == D(5)
+
+
+def test_fill_or_kill():
+    engine = new_engine()
+    engine.place(Order("u", Order.ask, "i", D(40), D(5)))
+    result = engine.place(Order("u2", Order.bid, "i", D(50), D(8), tif=Order.fok))
+    assert result.killed == D(8)
+    assert not result.trades
+    assert engine.orderbook.get_by_instrument_id("i").get_best_ask() == D(40)
+    result = engine.place(Order("u2", Order.bid, "i", D(40), D(5), tif=Order.fok))
+    assert result.shares_exchanged == D(5)
+    assert result.killed == D(0)
+
+
+def test_good_till_date():
+    engine = new_engine()
+    now = datetime.utcnow()
+    soon = Order("u", Order.bid, "i", D(10), D(5), tif=Order.gtd, expires=now + timedelta(hours=1))
+    later = Order("u", Order.bid, "j", D(10), D(2), tif=Order.gtd, expires=now + timedelta(hours=2))
+    engine.place(soon)
+    engine.place(later)
+    p = engine.positions.get_portfolio("u")
+    assert p.locked_cash == D(70)
+    assert engine.expire(now) == []
+    assert engine.expire(now + timedelta(minutes=90)) == [soon]
+    assert p.locked_cash == D(20)
+    # Orders on the book when the engine starts expire too.
+    reloaded = TradingEngine(OrderBook(engine.orderbook.dump()), engine.positions, engine.trades)
+    assert [o.name() for o in reloaded.expire(now + timedelta(hours=3))] == [later.name()]
+    assert p.locked_cash == D(0)
+
+
+def test_time_in_force_dump():
+    expires = datetime(2030, 1, 2, 3, 4, 5)
+    o = Order("u", Order.bid, "i", D(2), D(11), tif=Order.gtd, expires=expires)
+    o2 = Order(*o.dump())
+    assert o2.tif == Order.gtd and o2.expires == expires
+    # Orders dumped before time in force are good till cancelled.
+    o3 = Order(*o.dump()[:7])
+    assert o3.tif == Order.gtc and o3.expires is None
+
+
+def test_simulate_matches_place():
+    """Simulations change nothing and agree with placing the order right after."""
+    rng = random.Random(4)
+    engine = new_engine()
+    for u in ("u3", "u4"):
+        engine.positions.add_portfolio(u)
+    now = datetime.utcnow()
+    for n in range(400):
+        u = rng.choice(("u", "u2", "u3", "u4"))
+        tif = rng.choice((Order.gtc, Order.gtc, Order.ioc, Order.fok, Order.gtd))
+        expires = now + timedelta(minutes=rng.randint(-5, 60)) if tif == Order.gtd else None
+        o = Order(u, rng.choice((Order.bid, Order.ask)), rng.choice(("i", "j")), D(rng.randint(40, 60)),
+                  D(rng.randint(1, 3000)), tif=tif, expires=expires)
+        p = engine.positions.get_portfolio(u)
+        before = (engine.orderbook.dump(), engine.positions.dump())
+        sim = engine.simulate(o)
+        assert (engine.orderbook.dump(), engine.positions.dump()) == before
+        coupon = p.get_coupon(o.instrument_id)
+        coupon = coupon and coupon.dump()
+        result = engine.place(o)
+        assert sim.shares == result.shares_exchanged
+        fills = defaultdict(D)
+        for t in result.trades:
+            fills[t.price] += t.shares
+        assert sim.fills == list(fills.items())
+        assert sim.cancelled_shares == result.cancelled_shares
+        assert sim.killed == result.killed
+        assert sim.cash == result.cash
+        assert sim.locked_after == p.locked_cash
+        if sim.shares:
+            assert (sim.old_coupon and sim.old_coupon.dump()) == coupon
+            new_coupon = p.get_coupon(o.instrument_id)
+            assert (sim.new_coupon and sim.new_coupon.dump()) == (new_coupon and new_coupon.dump())
+
+
+def test_amend():
+    engine = new_engine()
+    first = Order("u", Order.bid, "i", D(40), D(10))
+    second = Order("u2", Order.bid, "i", D(40), D(10))
+    engine.place(first)
+    engine.place(second)
+    p = engine.positions.get_portfolio("u")
+    assert engine.amend(first, num_shares=D(4)) is None
+    assert p.locked_cash == D(160)
+    # Still first in line.
+    engine.place(Order("u3", Order.ask, "i", D(40), D(4)))
+    assert not engine.orderbook.has_order(first)
+    assert second.num_shares == D(10)
+    result = engine.amend(second, price=D(45))
+    replacement = engine.orderbook.get_by_instrument_id("i").get_bids()[-1]
+    assert not engine.orderbook.has_order(second)
+    assert replacement.price == D(45) and replacement.rank > second.rank
+    assert str(result) == "0 coupons traded."
+    with pytest.raises(ValueError):
+        engine.amend(replacement, num_shares=D(1000000))
+    assert engine.orderbook.has_order(replacement)
+    assert replacement.num_shares == D(10)
+
+
+def test_history():
+    trades = Trades()
+    start = datetime(2020, 1, 1)
+    for n in range(10):
+        t = start + timedelta(hours=n)
+        trades.add_trade(Trade("u" if n % 2 else "u2", "u3", "i" if n < 5 else "j", D(50), D(n + 1),
+                               (t.year, t.month, t.day, t.hour, t.minute, t.second, t.microsecond)))
+    window = trades.get_in_timerange(start + timedelta(hours=2), start + timedelta(hours=5))
+    assert [t.shares for t in window] == [D(3), D(4), D(5)]
+    window = trades.get_in_timerange(start, start + timedelta(hours=7), "j")
+    assert [t.shares for t in window] == [D(6), D(7)]
+    assert [t.shares for t in trades.history(account_id="u")] == [D(10), D(8), D(6), D(4), D(2)]
+    assert [t.shares for t in trades.history(account_id="u", instrument_id="i")] == [D(4), D(2)]
+    assert [t.shares for t in trades.history(account_id="u3", limit=2, offset=1)] == [D(9), D(8)]
+    # u3 is in every trade, so these go through the trades of the instrument.
+    assert [t.shares for t in trades.history(account_id="u3", instrument_id="j")] == [D(10), D(9), D(8), D(7), D(6)]
+    assert [t.shares for t in trades.history(account_id="u2", instrument_id="j", reverse=False)] == [D(7), D(9)]
+    assert list(trades.history(account_id="u", instrument_id="k")) == []
+    assert [t.shares for t in trades.history(instrument_id="i", end=start + timedelta(hours=2))] == [D(2), D(1)]
+    assert list(trades.history(account_id="nobody")) == []
+    assert "nobody" not in trades.trades_by_account
@@ -2,14 +2,18 @@
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 
+import heapq
 from collections import defaultdict
 from datetime import datetime
 from decimal import Decimal as D
+from itertools import chain, count, islice, takewhile
 
 from sortedcontainers import SortedList
 
-from trading.orderbook import Order
-from trading.positions import Coupon
+from trading.bars import Bars
+from trading.orderbook import Order, opricerank, antiopricerank
+from trading.positions import Coupon, Portfolio
+from util.tracing import span
 
 
 class TradingEngine:
@@ -21,6 +25,161 @@ class TradingEngine:
         self.orderbook = orderbook
         self.positions = positions
         self.trades = trades
+        # Min-heap of (expires, n, order) for good till date orders. Those
+        # filled or cancelled meanwhile are skipped when they come up.
+        self.expiries = []
+        self.expiry_count = count()
+        for orders in orderbook.orders_by_instrument.values():
+            for order in chain(orders.bids, orders.asks):
+                if order.expires is not None:
+                    self.expiries.append((order.expires, next(self.expiry_count), order))
+        heapq.heapify(self.expiries)
+
+    def expire(self, now=None):
+        """
+        Cancels the good till date orders whose time is up, releasing the
+        cash each locked. Returns them.
+        """
+        if now is None:
+            now = datetime.utcnow()
+        expired = []
+        while self.expiries and self.expiries[0][0] <= now:
+            order = heapq.heappop(self.expiries)[-1]
+            if self.orderbook.has_order(order):
+                self.orderbook.remove_order(order)
+                account_handler = self.orderbook.get_by_account_id(order.account_id)
+                self.positions.get_portfolio(order.account_id).calc_risk(account_handler.risk.risk)
+                expired.append(order)
+        if expired:
+            self.positions.mark_changed()
+        return expired
+
+    def due(self, now):
+        """Good till date orders on the book whose time is up at now, which expire() would cancel."""
+        due = []
+        pending = [0] if self.expiries else []
+        while pending:
+            i = pending.pop()
+            expires, _, order = self.expiries[i]
+            if expires <= now:
+                if self.orderbook.has_order(order):
+                    due.append(order)
+                pending.extend(j for j in (2 * i + 1, 2 * i + 2) if j < len(self.expiries))
+        return due
+
+    def simulate(self, order, now=None):
+        """
+        Works out what place(order) would do, from the book and the
+        portfolio of the account, without changing anything: see
+        Simulation. Contrary orders are taken by price level, so the cost
+        grows with the levels crossed rather than the size of the book.
+        """
+        if now is None:
+            now = datetime.utcnow()
+        sim = Simulation()
+        u, inst, side = order.account_id, order.instrument_id, order.side
+        p = self.positions.get_portfolio(u) or Portfolio(u)
+        inst_handler = self.orderbook.get_by_instrument_id(inst)
+        account_handler = self.orderbook.get_by_account_id(u)
+        sim.locked_before = sim.locked_after = p.locked_cash
+        contrary_side = Order.ask if side == Order.bid else Order.bid
+
+        def crosses(price):
+            return price <= order.price if side == Order.bid else price >= order.price
+
+        # Orders due to expire are gone by the time order would be placed.
+        risk = {}
+        if account_handler:
+            risk = {i: dict(r) for i, r in account_handler.risk.risk.items()}
+        gone = defaultdict(D)
+        due = self.due(now)
+        for o in due:
+            if o.account_id == u:
+                risk[o.instrument_id][o.side] -= o.cost()
+            if o.instrument_id == inst and o.side == contrary_side:
+                gone[o.price] += o.num_shares
+        if due:
+            sim.locked_before = p.locking(risk)
+
+        # Contrary orders of the account cancel out first, best first.
+        due = set(due)
+        own = []
+        if account_handler:
+            own = sorted((o for o in (account_handler.asks if side == Order.bid else account_handler.bids)
+                          if o.matches(order) and o not in due),
+                         key=opricerank if contrary_side == Order.bid else antiopricerank, reverse=True)
+        levels = inst_handler.get_levels(contrary_side) if inst_handler else {}
+        prices = list(takewhile(crosses, levels if side == Order.bid else reversed(levels)))
+        if order.tif == Order.fok:
+            crossing = sum(levels[q] - gone[q] for q in prices)
+            own_shares = sum(o.num_shares for o in own)
+            if crossing < order.num_shares or p.afford(risk, order) < order.num_shares - own_shares:
+                sim.killed = order.num_shares
+                return sim
+        shares = order.num_shares
+        for o in own:
+            netted = min(o.num_shares, shares - sim.cancelled_shares)
+            sim.cancelled_shares += netted
+            risk[inst][o.side] -= o.cost() * netted / o.num_shares
+            gone[o.price] += o.num_shares
+            if sim.cancelled_shares == shares:
+                sim.locked_after = p.locking(risk)
+                return sim
+        remaining = min(p.afford(risk, order), shares - sim.cancelled_shares)
+        if remaining <= D(0):
+            sim.locked_after = p.locking(risk)
+            return sim
+
+        # Then the order takes what is left at each level it crosses, at the level's price.
+        coupon = p.get_coupon(inst)
+        sim.old_coupon = coupon and Coupon(*coupon.dump())
+        scratch = Portfolio(u, [coupon.dump()] if coupon else [], p.cash_balance)
+        coupon_side = Coupon.yes if side == Order.bid else Coupon.no
+        for q in prices:
+            if remaining <= D(0):
+                break
+            filled = min(remaining, levels[q] - gone[q])
+            if filled <= D(0):
+                continue
+            sim.fills.append((q, filled))
+            sim.shares += filled
+            remaining -= filled
+            scratch.add_coupon(Coupon(u, inst, filled, coupon_side), q if side == Order.bid else D(100) - q)
+        sim.new_coupon = scratch.get_coupon(inst)
+        sim.cash = p.cash_balance - scratch.cash_balance
+        if order.tif in (Order.ioc, Order.fok):
+            sim.killed = remaining
+        elif remaining > D(0):
+            sim.resting = remaining
+            cost = (order.price if side == Order.bid else D(100) - order.price) * remaining
+            risk.setdefault(inst, {})[side] = risk.get(inst, {}).get(side, D(0)) + cost
+        coupons = dict(p.coupons)
+        coupons.pop(inst, None)
+        if sim.new_coupon:
+            coupons[inst] = sim.new_coupon
+        sim.locked_after = p.locking(risk, coupons)
+        return sim
+
+    def fillable(self, order, portfolio):
+        """
+        Whether order would be filled in full right away, by contrary orders
+        it crosses and the cash of portfolio. Contrary orders of the same
+        account cancel out against it rather than trade.
+        """
+        inst_handler = self.orderbook.get_by_instrument_id(order.instrument_id)
+        crossing, own = D(0), D(0)
+        if inst_handler:
+            contrary = inst_handler.asks if order.side == Order.bid else inst_handler.bids
+            for i in reversed(contrary):
+                if (i.price > order.price) if order.side == Order.bid else (i.price < order.price):
+                    break
+                crossing += i.num_shares
+                if i.account_id == order.account_id:
+                    own += i.num_shares
+        if crossing < order.num_shares:
+            return False
+        account_handler = self.orderbook.get_by_account_id(order.account_id)
+        return portfolio.afford(account_handler.risk.risk if account_handler else {}, order) >= order.num_shares - own
 
     def settle_cross(self, post, match):
         """
@@ -73,6 +232,32 @@ class TradingEngine:
         self.trades.add_trade(trade)
         return trade
 
+    def amend(self, order, price=None, num_shares=None):
+        """
+        Changes the price or the size of order, which is on the book.
+        Reducing the size keeps the place of the order in the queue and
+        returns None. Anything else cancels the order and places a new one
+        in its stead, queued last, returning its Placement; if the new one
+        cannot be afforded in full, the order is left as it was.
+        """
+        price = order.price if price is None else D(price)
+        num_shares = order.num_shares if num_shares is None else D(num_shares)
+        p = self.positions.get_portfolio(order.account_id)
+        account_handler = self.orderbook.get_by_account_id(order.account_id)
+        if price == order.price and num_shares <= order.num_shares:
+            if num_shares <= D(0):
+                raise ValueError("Number of shares must be a positive Decimal.")
+            self.orderbook.remove_shares_from_order(order, order.num_shares - num_shares)
+            p.calc_risk(account_handler.risk.risk)
+            return None
+        replacement = Order(order.account_id, order.side, order.instrument_id, price, num_shares, tif=order.tif,
+                            expires=order.expires)
+        self.orderbook.remove_order(order)
+        if p.afford(account_handler.risk.risk, replacement) < num_shares:
+            self.orderbook.add_order(order)
+            raise ValueError("Cannot afford the amended order.")
+        return self.place(replacement)
+
     def get_trades(self):
         return self.trades
 
@@ -82,13 +267,20 @@ class TradingEngine:
         maximum possible extent. It will use as resources contrary orders,
         contrary coupons, and cash. It returns a dictionary containing all
         incidents related to the placement.
+
+        Immediate or cancel orders are not left on the book, and fill or
+        kill orders are only placed if they would be filled in full.
         """
-        results = Placement()
+        self.expire()
+        results = Placement(order)
         u = order.account_id
         p = self.positions.get_portfolio(u)
         if not p:
             self.positions.add_portfolio(u)
             p = self.positions.get_portfolio(u)
+        if order.tif == Order.fok and not self.fillable(order, p):
+            results.killed = order.num_shares
+            return results
         inst = order.instrument_id
         side = order.side
         price = order.price
@@ -107,58 +299,69 @@ class TradingEngine:
                 inst_orders = inst_handler.get_asks()
         else:
             inst_orders = None
-        matching_orders = []
-        if inst_orders:
-            for i in inst_orders:
-                if i.matches(order):
-                    matching_orders.append(i)
-
-        # If so, cancel them out in reversed order.
-        matching_orders.reverse()
-        for i in matching_orders:
-            if order.num_shares > D(0):
-                if i.num_shares > order.num_shares:
-                    net_shares = i.num_shares - order.num_shares
-                    results.cancelled_shares += order.num_shares
-                    results.remaining_shares = net_shares
-                    self.orderbook.remove_shares_from_order(i, order.num_shares)
-                    results.lock.append(p.calc_risk(account_handler.risk.risk))
-                    return results
-                if i.num_shares == order.num_shares:
-                    results.cancelled_shares += i.num_shares
-                    self.orderbook.remove_order(i)
-                    results.lock.append(p.calc_risk(account_handler.risk.risk))
+        with span("self_cross"):
+            matching_orders = []
+            if inst_orders:
+                for i in inst_orders:
+                    if i.matches(order):
+                        matching_orders.append(i)
+
+            # If so, cancel them out in reversed order.
+            matching_orders.reverse()
+            for i in matching_orders:
+                if order.num_shares > D(0):
+                    if i.num_shares > order.num_shares:
+                        net_shares = i.num_shares - order.num_shares
+                        results.cancelled_shares += order.num_shares
+                        results.remaining_shares = net_shares
+                        self.orderbook.remove_shares_from_order(i, order.num_shares)
+                        results.lock.append(p.calc_risk(account_handler.risk.risk))
+                        return results
+                    if i.num_shares == order.num_shares:
+                        results.cancelled_shares += i.num_shares
+                        self.orderbook.remove_order(i)
+                        results.lock.append(p.calc_risk(account_handler.risk.risk))
+                        return results
+                    if i.num_shares < order.num_shares:
+                        results.cancelled_shares += i.num_shares
+                        order.num_shares -= i.num_shares
+                        self.orderbook.remove_order(i)
+                        results.lock.append(p.calc_risk(account_handler.risk.risk))
+                else:
                     return results
-                if i.num_shares < order.num_shares:
-                    results.cancelled_shares += i.num_shares
-                    order.num_shares -= i.num_shares
-                    self.orderbook.remove_order(i)
-                    results.lock.append(p.calc_risk(account_handler.risk.risk))
-            else:
-                return results
 
         # Calculate affordability.
         shares = order.num_shares
-        if account_handler:
-            afford = p.afford(account_handler.risk.risk, order)
-        else:
-            afford = p.afford({}, order)
+        with span("afford"):
+            if account_handler:
+                afford = p.afford(account_handler.risk.risk, order)
+            else:
+                afford = p.afford({}, order)
         if afford <= D(0):
             return results
         order.num_shares = min(afford, shares)
 
         # Add, lock, and execute.
-        self.orderbook.add_order(order)
-        if account_handler:
-            p.calc_risk(account_handler.risk.risk)
-        else:
-            account_handler = self.orderbook.get_by_account_id(u)
-            p.calc_risk(account_handler.risk.risk)
-        while True:
-            cross = self.orderbook.get_priority_cross(inst)
-            if not cross:
-                break
-            results.trades.append(self.settle_cross(**cross))
+        with span("add_order"):
+            self.orderbook.add_order(order)
+            if account_handler:
+                p.calc_risk(account_handler.risk.risk)
+            else:
+                account_handler = self.orderbook.get_by_account_id(u)
+                p.calc_risk(account_handler.risk.risk)
+        with span("match"):
+            while True:
+                cross = self.orderbook.get_priority_cross(inst)
+                if not cross:
+                    break
+                results.trades.append(self.settle_cross(**cross))
+        if order.tif in (Order.ioc, Order.fok):
+            if self.orderbook.has_order(order):
+                results.killed = order.num_shares
+                self.orderbook.remove_order(order)
+                p.calc_risk(account_handler.risk.risk)
+        elif order.expires is not None and self.orderbook.has_order(order):
+            heapq.heappush(self.expiries, (order.expires, next(self.expiry_count), order))
 
         # Calculate outcomes.
         shares_exchanged = D(0)
@@ -185,19 +388,64 @@ class Trades:
             l = []
         self.sorted_trades = SortedList(key=lambda t: t.timestamp)
         self.trades_by_instrument = defaultdict(t_list)
+        # Trades of each account, on either side.
+        self.trades_by_account = defaultdict(t_list)
+        # Bars and rolling averages of each instrument.
+        self.bars = Bars()
+        # Bumped on every trade.
+        self.version = 0
         for i in l:
             self.add_trade(Trade(*i))
 
     def add_trade(self, trade):
         self.sorted_trades.add(trade)
         self.trades_by_instrument[trade.instrument_id].add(trade)
+        self.trades_by_account[trade.sell_user].add(trade)
+        if trade.buy_user != trade.sell_user:
+            self.trades_by_account[trade.buy_user].add(trade)
+        self.bars.add(trade)
+        self.version += 1
 
     def get_in_timerange(self, starttime, endtime, instrument_id=None):
-        if instrument_id:
-            trade_list = self.trades_by_instrument[instrument_id]
+        """Trades from starttime until before endtime, oldest first, on instrument_id if given."""
+        return self.history(instrument_id=instrument_id, start=starttime, end=endtime, reverse=False)
+
+    def history(self, instrument_id=None, account_id=None, start=None, end=None, limit=None, offset=0,
+                reverse=True):
+        """
+        Iterator over the trades on instrument_id, of account_id on either
+        side, from start until before end, leaving out any of these that is
+        None; newest first unless reverse is false. The first offset trades
+        are skipped and at most limit given. Trades are taken from the
+        smallest index that covers the query, the trades of the account or
+        of the instrument, and only as they are asked for.
+        """
+        by_account = self.trades_by_account.get(account_id) if account_id is not None else None
+        by_instrument = self.trades_by_instrument.get(instrument_id) if instrument_id is not None else None
+        if account_id is not None and instrument_id is not None:
+            if not by_account or not by_instrument:
+                return iter(())
+            if len(by_account) <= len(by_instrument):
+                trade_list, keep = by_account, lambda t: t.instrument_id == instrument_id
+            else:
+                trade_list, keep = by_instrument, lambda t: account_id in (t.sell_user, t.buy_user)
+        elif account_id is not None:
+            trade_list, keep = by_account, None
+        elif instrument_id is not None:
+            trade_list, keep = by_instrument, None
         else:
-            trade_list = self.sorted_trades
-        return trade_list.irange(trade_list.bisect(starttime), trade_list.bisect(endtime))
+            trade_list, keep = self.sorted_trades, None
+        if not trade_list:
+            return iter(())
+        trades = trade_list.irange_key(start, end, inclusive=(True, False), reverse=reverse)
+        if keep is not None:
+            trades = filter(keep, trades)
+        return islice(trades, offset, None if limit is None else offset + limit)
+
+    def last_price(self, instrument_id):
+        """Price of the latest trade on instrument_id, or None if there is none."""
+        trade_list = self.trades_by_instrument.get(instrument_id)
+        return trade_list[-1].price if trade_list else None
 
     def get_most_recent(self, n, instrument_id=None):
         if instrument_id:
@@ -213,6 +461,12 @@ class Trades:
 
 
 class Trade:
+    """
+    Trade of shares at price, the price of yes coupons. Despite the names,
+    sell_user is the bidder, who bought the yes coupons, and buy_user the
+    asker, who bought the no coupons; trades are saved with these names.
+    """
+
     def __init__(self, sell_user, buy_user, instrument_id, price, shares, timestamp=None):
 
         self.sell_user = sell_user
@@ -236,10 +490,58 @@ class Trade:
                                    self.timestamp.second, self.timestamp.microsecond))
 
 
+class Simulation:
+    """What placing an order would do, see TradingEngine.simulate."""
+
+    def __init__(self):
+        # (price, shares) taken at each price level, best first.
+        self.fills = []
+        self.shares = D(0)
+        # Shares cancelled out against contrary orders of the same account.
+        self.cancelled_shares = D(0)
+        # Cash paid, or received if negative.
+        self.cash = D(0)
+        self.old_coupon = None
+        self.new_coupon = None
+        self.locked_before = D(0)
+        self.locked_after = D(0)
+        # Shares left on the book, and those dropped by ioc and fok orders.
+        self.resting = D(0)
+        self.killed = D(0)
+
+    def average_price(self):
+        if not self.shares:
+            return None
+        return sum(price * shares for price, shares in self.fills) / self.shares
+
+    def __str__(self):
+        if self.shares > D(0):
+            s = "Would trade {0} coupons at {1} on average. ".format(self.shares,
+                                                                     self.average_price().quantize(D("0.01")))
+        else:
+            s = "Would trade no coupons. "
+        if self.cancelled_shares > D(0):
+            s += "Would cancel your orders for {0} coupons. ".format(self.cancelled_shares)
+        if self.cash > D(0):
+            s += "Cost: {0}. ".format(self.cash)
+        elif self.cash < D(0):
+            s += "Revenue: {0}. ".format(abs(self.cash))
+        if self.shares > D(0):
+            s += "Coupons: {0} -> {1}. ".format(self.old_coupon or "none", self.new_coupon or "none")
+        if self.resting > D(0):
+            s += "Orders for {0} coupons would remain queued. ".format(self.resting)
+        if self.killed > D(0):
+            s += "Orders for {0} coupons would be cancelled. ".format(self.killed)
+        if self.locked_after != self.locked_before:
+            s += "Locked cash: {0} -> {1}.".format(self.locked_before, self.locked_after)
+        return s.strip()
+
+
 class Placement:
     """This object represents the results of trading."""
 
-    def __init__(self):
+    def __init__(self, order=None):
+        self.order = order
         self.cash = D(0)
         self.cancelled_shares = D(0)
         self.trades = []
@@ -252,6 +554,7 @@ class Placement:
         self.invalid = D(0)
         self.lock = []
         self.residual = D(0)
+        self.killed = D(0)
 
     def __str__(self):
         s = ""
@@ -260,6 +563,8 @@ class Placement:
         s += "{0} coupons traded. ".format(self.shares_exchanged)
         if self.trades:
             s += "{0} orders matched. ".format(len(self.trades))
+        if self.killed > D(0):
+            s += "Orders for {0} coupons could not be filled right away and were cancelled. ".format(self.killed)
         if self.remaining_shares > D(0):
             s += "Orders for {0} coupons remain queued. ".format(self.remaining_shares)
         if self.invalid > D(0):
@@ -0,0 +1,182 @@
+import atexit
+import glob
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import traceback
+from datetime import datetime
+
+
+class AuditLog:
+    """
+    Log of records written in batches by a background thread; log() only
+    puts a record on a queue and never waits. The file is rotated when it
+    would grow past max_bytes or when the day changes, and rotated files
+    are gzipped, keeping the latest backups of them.
+
+    Records are dictionaries, written as JSON lines with fmt "json", or as
+    lines of key=value pairs with fmt "text". Each record gets the UTC time
+    it was logged at.
+    """
+
+    def __init__(self, path="log.txt", fmt="text", max_bytes=10 * 1024 * 1024, backups=10, batch=256,
+                 flush_interval=1.0, maxsize=100000):
+        self.path = path
+        self.fmt = fmt
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch = batch
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self.thread = None
+        self.lock = threading.Lock()
+        self.file = None
+        self.size = 0
+        self.day = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="audit", daemon=True)
+                self.thread.start()
+                atexit.register(self.close)
+
+    def log(self, record):
+        """Queue record to be written. Records are dropped, and counted, while the queue is full."""
+        if self.thread is None:
+            self.start()
+        record = dict({"time": datetime.utcnow().isoformat()}, **record)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout=None):
+        """Wait until the records logged so far are written."""
+        if self.thread is None:
+            return
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    def close(self, timeout=None):
+        """Write the records logged so far and stop."""
+        if self.thread is None or not self.thread.is_alive():
+            return
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def format(self, record):
+        if self.fmt == "json":
+            return json.dumps(record, default=str)
+        return " ".join("{0}={1}".format(k, v) for k, v in record.items())
+
+    def _run(self):
+        while True:
+            try:
+                job = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            lines = []
+            while True:
+                if job is None:
+                    self._write(lines)
+                    self._close_file()
+                    return
+                if isinstance(job, threading.Event):
+                    self._write(lines)
+                    lines = []
+                    job.set()
+                else:
+                    lines.append(self.format(job) + "\n")
+                if len(lines) >= self.batch:
+                    break
+                try:
+                    job = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            self._write(lines)
+
+    def _write(self, lines):
+        if not lines:
+            return
+        try:
+            data = "".join(lines).encode("utf-8")
+            self._open()
+            if self.size and (self.size + len(data) > self.max_bytes or self._today() != self.day):
+                self._rotate()
+                self._open()
+            self.file.write(data)
+            self.file.flush()
+            self.size += len(data)
+        except OSError:
+            traceback.print_exc()
+
+    @staticmethod
+    def _today():
+        return datetime.utcnow().date()
+
+    def _open(self):
+        if self.file is not None:
+            return
+        self.file = open(self.path, "ab")
+        self.size = self.file.tell()
+        if self.size:
+            self.day = datetime.utcfromtimestamp(os.path.getmtime(self.path)).date()
+        else:
+            self.day = self._today()
+
+    def _close_file(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _rotate(self):
+        """Gzip the current file away and start a new one."""
+        self._close_file()
+        rotated = "{0}.{1}".format(self.path, datetime.utcnow().strftime("%Y%m%d-%H%M%S-%f"))
+        os.rename(self.path, rotated)
+        with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+        old = sorted(glob.glob(glob.escape(self.path) + ".*.gz"))
+        for name in old[:max(0, len(old) - self.backups)]:
+            os.remove(name)
+
+
+class Journal:
+    """
+    Append-only file of records, as JSON lines stamped with the UTC time.
+    Unlike AuditLog, log() writes and flushes each record before returning,
+    and the file is never rotated, so no record is ever dropped or deleted.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+
+    def log(self, record):
+        line = json.dumps(dict({"time": datetime.utcnow().isoformat()}, **record), default=str) + "\n"
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, "a", encoding="utf-8")
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    @staticmethod
+    def read(path):
+        """The records in the journal at path, oldest first."""
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
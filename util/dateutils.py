@@ -1,4 +1,5 @@
 import re
+import time
 from datetime import datetime, date
 
 
@@ -8,6 +9,26 @@ def today():
     return date(now.year, now.month, now.day)
 
 
+class DayClock:
+    """today(), worked out again only once the day is over."""
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.day = None
+        self.day_ends = 0
+
+    def today(self):
+        now = self.clock()
+        if now >= self.day_ends:
+            self.day = datetime.utcfromtimestamp(now).date()
+            self.day_ends = (now // 86400 + 1) * 86400
+        return self.day
+
+
+# Shared by everything asking for the date many times over.
+clock = DayClock()
+
+
 def to_int(s):
     try:
         int(s[0:4])
@@ -0,0 +1,97 @@
+import gc
+import sys
+import tracemalloc
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+
+
+def deep_sizeof(obj, exclude=()):
+    """
+    Size in bytes of obj and everything reachable from it. Objects of the
+    excluded types are not counted, so that the overhead of a container can
+    be told apart from the size of the objects it holds.
+    """
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        if isinstance(o, (type, ModuleType, FunctionType, BuiltinFunctionType, MethodType)):
+            continue
+        if exclude and o is not obj and isinstance(o, exclude):
+            continue
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        if hasattr(o, "__dict__"):
+            stack.append(o.__dict__)
+        for slot in getattr(type(o), "__slots__", ()):
+            if hasattr(o, slot):
+                stack.append(getattr(o, slot))
+    return size
+
+
+def count_instances(types):
+    """
+    Count the live instances of each of the given types and add up their
+    sizes. Sizes exclude any other instance of the given types they point to.
+    Returns a mapping of class name to [count, bytes].
+    """
+    types = tuple(types)
+    counts = {}
+    for t in types:
+        counts[t.__name__] = [0, 0]
+    for o in gc.get_objects():
+        if isinstance(o, types):
+            entry = counts[type(o).__name__]
+            entry[0] += 1
+            entry[1] += deep_sizeof(o, exclude=types)
+    return counts
+
+
+class MemoryReport:
+    """Snapshot of object counts, container overheads and traced memory."""
+
+    def __init__(self, types, containers, top=5):
+        types = tuple(types)
+        self.objects = count_instances(types)
+        self.containers = {}
+        for name, container in containers.items():
+            self.containers[name] = deep_sizeof(container, exclude=types)
+        self.traced = None
+        self.sites = []
+        if tracemalloc.is_tracing():
+            self.traced = tracemalloc.get_traced_memory()
+            stats = tracemalloc.take_snapshot().statistics("filename")
+            for i in stats[:top]:
+                self.sites.append((i.traceback[0].filename, i.count, i.size))
+
+    def lines(self):
+        """Full report, one line per entry."""
+        l = []
+        for name, (count, size) in sorted(self.objects.items(), key=lambda k: -k[1][1]):
+            l.append("{0}: {1} objects, {2} bytes".format(name, count, size))
+        for name, size in sorted(self.containers.items(), key=lambda k: -k[1]):
+            l.append("{0}: {1} bytes overhead".format(name, size))
+        if self.traced:
+            l.append("traced: {0} bytes current, {1} bytes peak".format(*self.traced))
+            for filename, count, size in self.sites:
+                l.append("{0}: {1} blocks, {2} bytes".format(filename, count, size))
+        return l
+
+    def summary(self):
+        """Short form of the report, fit for a single IRC line."""
+        objects = ["{0} {1}/{2}B".format(name, count, size) for name, (count, size) in self.objects.items()]
+        containers = ["{0} {1}B".format(name, size) for name, size in self.containers.items()]
+        s = "Objects: " + ", ".join(objects) + ". Containers: " + ", ".join(containers) + "."
+        if self.traced:
+            s += " Traced: {0}B (peak {1}B).".format(*self.traced)
+        return s
+
+    def __str__(self):
+        return "\n".join(self.lines())
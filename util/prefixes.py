@@ -0,0 +1,51 @@
+from bisect import bisect_left, insort
+
+
+class PrefixIndex:
+    """
+    Map from every prefix of a set of words to the sorted words starting
+    with it, so that completing a prefix is a single dictionary lookup.
+    """
+
+    def __init__(self, words=()):
+        self.words = set()
+        self.prefixes = {}
+        for w in words:
+            self.add(w)
+
+    def add(self, word):
+        if word in self.words:
+            return
+        self.words.add(word)
+        for i in range(len(word) + 1):
+            insort(self.prefixes.setdefault(word[:i], []), word)
+
+    def remove(self, word):
+        if word not in self.words:
+            raise KeyError(word)
+        self.words.remove(word)
+        for i in range(len(word) + 1):
+            p = word[:i]
+            candidates = self.prefixes[p]
+            del candidates[bisect_left(candidates, word)]
+            if not candidates:
+                del self.prefixes[p]
+
+    def find(self, prefix):
+        """Sorted words starting with prefix."""
+        return list(self.prefixes.get(prefix, ()))
+
+    def resolve(self, prefix):
+        """
+        The words a prefix stands for: the word itself if it is one, else
+        every word it is a prefix of.
+        """
+        if prefix in self.words:
+            return [prefix]
+        return self.find(prefix)
+
+    def __contains__(self, word):
+        return word in self.words
+
+    def __len__(self):
+        return len(self.words)
@@ -1,14 +1,34 @@
+from itertools import chain
+
+_end = object()
+
+
 def pretty_list(l):
-    """Take a list, print its members separated by commas, and put and before the last."""
-    if len(l) == 0:
-        return ""
-    elif len(l) == 1:
-        return str(l[0])
-    elif len(l) == 2:
-        return str(l[0]) + " and " + str(l[1])
-    else:
-        s = ""
-        for i in l[:-1]:
-            s += str(i) + ", "
-        s += "and " + str(l[-1])
-        return s
+    """Take an iterable, print its members separated by commas, and put and before the last."""
+    return "".join(pretty_pieces(l))
+
+
+def pretty_pieces(l):
+    """The pieces of pretty_list(l), produced as the members of l are taken, one ahead."""
+    items = iter(l)
+    first = next(items, _end)
+    if first is _end:
+        return
+    second = next(items, _end)
+    if second is _end:
+        yield str(first)
+        return
+    third = next(items, _end)
+    if third is _end:
+        yield str(first)
+        yield " and "
+        yield str(second)
+        return
+    yield str(first)
+    previous = second
+    for item in chain([third], items):
+        yield ", "
+        yield str(previous)
+        previous = item
+    yield ", and "
+    yield str(previous)
@@ -0,0 +1,59 @@
+import glob
+import gzip
+import json
+
+from util.auditlog import AuditLog, Journal
+
+
+def test_json_lines(tmpdir):
+    path = str(tmpdir.join("log.jsonl"))
+    log = AuditLog(path, fmt="json")
+    log.log({"command": "buy", "args": ["x", "y"]})
+    log.log({"message": "hello"})
+    log.close(timeout=5)
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+    assert [r.get("command") for r in records] == ["buy", None]
+    assert records[0]["args"] == ["x", "y"]
+    assert "time" in records[1]
+
+
+def test_text_lines(tmpdir):
+    path = str(tmpdir.join("log.txt"))
+    log = AuditLog(path)
+    log.log({"message": "hello"})
+    log.flush(timeout=5)
+    with open(path) as f:
+        line = f.read()
+    assert line.startswith("time=")
+    assert line.endswith(" message=hello\n")
+    log.close(timeout=5)
+
+
+def test_rotation(tmpdir):
+    path = str(tmpdir.join("log.txt"))
+    log = AuditLog(path, max_bytes=100, backups=2, batch=1)
+    for i in range(20):
+        log.log({"message": "x" * 40})
+    log.close(timeout=5)
+    rotated = sorted(glob.glob(path + ".*.gz"))
+    assert len(rotated) == 2
+    with gzip.open(rotated[-1], "rt") as f:
+        assert "message=" + "x" * 40 in f.read()
+    with open(path) as f:
+        assert len(f.read()) <= 100
+
+
+def test_journal_keeps_every_record(tmpdir):
+    path = str(tmpdir.join("ledger.txt"))
+    journal = Journal(path)
+    for i in range(1000):
+        journal.log({"kind": "grant", "n": i})
+    # Written as soon as logged.
+    assert [r["n"] for r in Journal.read(path)] == list(range(1000))
+    journal.close()
+    journal = Journal(path)
+    journal.log({"kind": "grant", "n": 1000})
+    journal.close()
+    assert len(list(Journal.read(path))) == 1001
+    assert glob.glob(path + ".*") == []
@@ -1,9 +1,9 @@
 import sys
-from datetime import date
+from datetime import date, datetime, timezone
 
 import pytest
 
-from util.dateutils import today, parse_iso_date
+from util.dateutils import today, parse_iso_date, DayClock
 
 
 def test_today():
@@ -52,3 +52,11 @@ def test_parse_iso_date_valid():
     assert d.year == 2017
     assert d.month == 2
     assert d.day == 2
+
+
+def test_day_clock():
+    now = [datetime(2017, 2, 2, 23, 59, 59, tzinfo=timezone.utc).timestamp()]
+    c = DayClock(lambda: now[0])
+    assert c.today() == date(2017, 2, 2)
+    now[0] += 1
+    assert c.today() == date(2017, 2, 3)
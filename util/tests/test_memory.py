@@ -0,0 +1,45 @@
+import tracemalloc
+
+from util.memory import deep_sizeof, count_instances, MemoryReport
+
+
+class Thing:
+    def __init__(self, payload):
+        self.payload = payload
+
+
+def test_deep_sizeof_grows_with_contents():
+    assert deep_sizeof([]) < deep_sizeof(["x" * 1000])
+    assert deep_sizeof({"a": [1, 2, 3]}) > deep_sizeof({})
+
+
+def test_deep_sizeof_excludes_types():
+    things = [Thing("x" * 1000) for i in range(10)]
+    assert deep_sizeof(things, exclude=(Thing,)) < deep_sizeof(things)
+
+
+def test_deep_sizeof_handles_cycles():
+    a = []
+    a.append(a)
+    assert deep_sizeof(a) > 0
+
+
+def test_count_instances():
+    things = [Thing(i) for i in range(7)]
+    counts = count_instances([Thing])
+    assert counts["Thing"][0] >= 7
+    assert counts["Thing"][1] > 0
+    del things
+
+
+def test_memory_report():
+    things = [Thing(i) for i in range(3)]
+    tracemalloc.start()
+    try:
+        report = MemoryReport([Thing], {"things": things})
+    finally:
+        tracemalloc.stop()
+    assert report.containers["things"] > 0
+    assert report.traced is not None
+    assert "Thing" in report.summary()
+    assert str(report).startswith("Thing")
@@ -0,0 +1,32 @@
+from util.prefixes import PrefixIndex
+
+
+def test_find():
+    p = PrefixIndex(["cancel", "cash", "claims", "buy"])
+    assert p.find("c") == ["cancel", "cash", "claims"]
+    assert p.find("ca") == ["cancel", "cash"]
+    assert p.find("cas") == ["cash"]
+    assert p.find("x") == []
+    assert p.find("") == ["buy", "cancel", "cash", "claims"]
+
+
+def test_resolve_prefers_exact_match():
+    p = PrefixIndex(["trace", "traces"])
+    assert p.resolve("trace") == ["trace"]
+    assert p.resolve("tra") == ["trace", "traces"]
+
+
+def test_remove():
+    p = PrefixIndex(["cancel", "cash"])
+    p.remove("cash")
+    assert p.find("ca") == ["cancel"]
+    assert "cash" not in p
+    assert len(p) == 1
+    p.remove("cancel")
+    assert p.prefixes == {}
+
+
+def test_find_returns_copy():
+    p = PrefixIndex(["buy"])
+    p.find("b").append("bogus")
+    assert p.find("b") == ["buy"]
@@ -14,4 +14,12 @@ def test_pretty_list_two():
 
 
 def test_pretty_list_three():
-    assert (pretty_list(["Curly", "Larry", "Moe"]) == "Curly, Larry, and Moe")
+    assert (pretty_list(["Curly", "Larry", "Moe"]) == "Curly, Larry, and Moe")
+
+
+def test_pretty_list_four():
+    assert (pretty_list(["a", "b", "c", "d"]) == "a, b, c, and d")
+
+
+def test_pretty_list_generator():
+    assert (pretty_list(i for i in range(3)) == "0, 1, and 2")
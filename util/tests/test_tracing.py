@@ -0,0 +1,55 @@
+import json
+
+from util.tracing import Tracer, span
+
+
+def test_trace_records_spans():
+    tracer = Tracer()
+    with tracer.trace("buy"):
+        with span("place"):
+            with span("match"):
+                pass
+        with span("save"):
+            pass
+    t = tracer.recent(1)[0]
+    assert t.name == "buy"
+    assert t.duration >= 0
+    assert [i[0] for i in t.spans] == ["match", "place", "save"]
+    assert [i[3] for i in t.spans] == [1, 0, 0]
+
+
+def test_span_without_trace_is_noop():
+    with span("orphan"):
+        pass
+
+
+def test_sampling():
+    tracer = Tracer(sample_rate=0)
+    with tracer.trace("buy"):
+        with span("place"):
+            pass
+    assert tracer.recent(10) == []
+
+
+def test_ring_buffer_and_trace_ids():
+    tracer = Tracer(capacity=3)
+    for i in range(5):
+        with tracer.trace("c" + str(i)):
+            pass
+    traces = tracer.recent(10)
+    assert [t.name for t in traces] == ["c2", "c3", "c4"]
+    assert [t.trace_id for t in traces] == [3, 4, 5]
+    assert len(tracer.slowest(2)) == 2
+
+
+def test_json_lines_file(tmpdir):
+    path = str(tmpdir.join("traces.jsonl"))
+    tracer = Tracer(path=path)
+    for i in range(2):
+        with tracer.trace("buy"):
+            with span("place"):
+                pass
+    with open(path) as f:
+        lines = [json.loads(l) for l in f]
+    assert len(lines) == 2
+    assert lines[0]["spans"][0]["name"] == "place"
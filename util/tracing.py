@@ -0,0 +1,96 @@
+import itertools
+import json
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+_local = threading.local()
+_noop = nullcontext()
+
+
+class Trace:
+    """Timing of the stages a single command goes through."""
+
+    def __init__(self, trace_id, name):
+        self.trace_id = trace_id
+        self.name = name
+        self.wall = time.time()
+        self.start = time.monotonic()
+        self.duration = None
+        self.spans = []
+        self.depth = 0
+
+    def __str__(self):
+        s = "{0} {1}: {2:.2f}ms".format(self.trace_id, self.name, self.duration * 1000)
+        if self.spans:
+            s += " (" + ", ".join("{0} {1:.2f}ms".format(i[0], i[2] * 1000) for i in self.spans) + ")"
+        return s
+
+    def dump(self):
+        return {"id": self.trace_id, "name": self.name, "time": self.wall, "duration": self.duration,
+                "spans": [{"name": i[0], "offset": i[1], "duration": i[2], "depth": i[3]} for i in self.spans]}
+
+
+class Tracer:
+    """
+    Samples a fraction of commands and records how long each of their stages
+    takes. Finished traces are kept in a ring buffer and, when a path is
+    given, appended to a JSON-lines file.
+    """
+
+    def __init__(self, sample_rate=1.0, capacity=1000, path=None):
+        self.sample_rate = sample_rate
+        self.traces = deque(maxlen=capacity)
+        self.path = path
+        self._ids = itertools.count(1)
+
+    def trace(self, name):
+        """Context manager tracing a command, or doing nothing if not sampled."""
+        if getattr(_local, "trace", None) is not None or random.random() >= self.sample_rate:
+            return _noop
+        return self._trace(name)
+
+    @contextmanager
+    def _trace(self, name):
+        t = Trace(next(self._ids), name)
+        _local.trace = t
+        try:
+            yield t
+        finally:
+            _local.trace = None
+            t.duration = time.monotonic() - t.start
+            self.traces.append(t)
+            if self.path:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(t.dump()) + "\n")
+
+    def recent(self, n):
+        """The last n finished traces, most recent last."""
+        if n <= 0:
+            return []
+        return list(self.traces)[-n:]
+
+    def slowest(self, n):
+        """The n slowest traces in the ring buffer, slowest first."""
+        return sorted(self.traces, key=lambda t: t.duration, reverse=True)[:n]
+
+
+def span(name):
+    """Time a stage of the command being traced on this thread, if any."""
+    t = getattr(_local, "trace", None)
+    if t is None:
+        return _noop
+    return _span(t, name)
+
+
+@contextmanager
+def _span(t, name):
+    start = time.monotonic()
+    t.depth += 1
+    try:
+        yield
+    finally:
+        t.depth -= 1
+        t.spans.append((name, start - t.start, time.monotonic() - start, t.depth))